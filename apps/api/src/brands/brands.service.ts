@@ -10,6 +10,7 @@ import { CreateBrandDto } from './dto/create-brand.dto';
 import { UpdateBrandDto } from './dto/update-brand.dto';
 import { OrganizationsService } from '../organizations/organizations.service';
 import { MembershipsService } from '../memberships/memberships.service';
+import { NatsService } from '../common/nats/nats.service';
 import { UserRole } from '@shared/types';
 
 @Injectable()
@@ -19,8 +20,21 @@ export class BrandsService {
     private brandsRepository: Repository<Brand>,
     private organizationsService: OrganizationsService,
     private membershipsService: MembershipsService,
+    private natsService: NatsService,
   ) {}
 
+  // Workers that cache brand kits (image-prompt-worker) rebuild them from this.
+  private async publishUpdated(brand: Brand): Promise<void> {
+    await this.natsService.publish('brand.updated', {
+      brand_id: brand.id,
+      name: brand.name,
+      colors: brand.colors,
+      fonts: brand.fonts,
+      guidelines: brand.guidelines,
+      updated_at: brand.updatedAt.toISOString(),
+    });
+  }
+
   async create(createBrandDto: CreateBrandDto, userId: string): Promise<Brand> {
     const { organizationId, ...brandData } = createBrandDto;
 
@@ -51,7 +65,9 @@ export class BrandsService {
       organizationId: finalOrganizationId,
     });
 
-    return this.brandsRepository.save(brand);
+    const saved = await this.brandsRepository.save(brand);
+    await this.publishUpdated(saved);
+    return saved;
   }
 
   async findAll(userId: string): Promise<Brand[]> {
@@ -121,7 +137,9 @@ export class BrandsService {
     }
 
     Object.assign(brand, updateBrandDto);
-    return this.brandsRepository.save(brand);
+    const saved = await this.brandsRepository.save(brand);
+    await this.publishUpdated(saved);
+    return saved;
   }
 
   async remove(id: string, userId: string): Promise<void> {
@@ -136,5 +154,6 @@ export class BrandsService {
     }
 
     await this.brandsRepository.remove(brand);
+    await this.natsService.publish('brand.updated', { brand_id: id, deleted: true });
   }
 }
@@ -0,0 +1,62 @@
+"""Helpers shared by the worker benchmarks.
+
+Benchmarks run from `services/workers/` (`python benchmarks/<name>.py`). Each
+worker ships its code as a top-level `app` package, so a benchmark process
+loads at most one worker via `use_worker()`.
+"""
+import resource
+import statistics
+import sys
+from pathlib import Path
+
+
+WORKERS_DIR = Path(__file__).resolve().parent.parent
+
+
+def use_worker(name: str) -> Path:
+  """Put `worker-common` and the given worker on sys.path; returns the worker dir."""
+  worker_dir = WORKERS_DIR / name
+  for path in (WORKERS_DIR / 'worker-common', worker_dir):
+    if str(path) not in sys.path:
+      sys.path.insert(0, str(path))
+  return worker_dir
+
+
+def rss_mb() -> float:
+  """Current resident set size in MiB (peak RSS where /proc is unavailable)."""
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+  except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def percentile(values: list[float], pct: float) -> float:
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  k = (len(ordered) - 1) * pct / 100
+  lo = int(k)
+  hi = min(lo + 1, len(ordered) - 1)
+  return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+  """p50/p95/p99 latency in ms plus throughput for a run of `len(latencies)` ops."""
+  return {
+    'count': len(latencies),
+    'elapsed_s': round(elapsed, 4),
+    'ops_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    'mean_ms': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+    'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+    'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+    'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+  }
+
+
+def print_table(rows: list[dict], columns: list[str]):
+  widths = {c: max([len(c)] + [len(str(r.get(c, ''))) for r in rows]) for c in columns}
+  print('  '.join(c.ljust(widths[c]) for c in columns))
+  for row in rows:
+    print('  '.join(str(row.get(c, '')).ljust(widths[c]) for c in columns))
@@ -0,0 +1,116 @@
+"""Connector publish throughput with a pooled vs a per-request HTTP client.
+
+Starts `mock_platform.py` in a subprocess, points twitter-connector at it and
+pushes `--posts` publish.twitter messages through the handler on a MemoryBus,
+first with the connector's long-lived pooled client and then with a fresh
+client per request. The mock serves HTTPS by default so each new connection
+pays a TLS handshake, as it would against the real APIs (`--plain` for HTTP).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from _common import print_table, summarize, use_worker
+
+
+HERE = Path(__file__).resolve().parent
+
+
+async def wait_ready(base_url: str, timeout: float = 20):
+  deadline = time.monotonic() + timeout
+  async with httpx.AsyncClient(verify=False) as client:
+    while True:
+      try:
+        return (await client.get(f"{base_url}/stats")).json()
+      except httpx.HTTPError:
+        if time.monotonic() > deadline:
+          raise
+        await asyncio.sleep(0.2)
+
+
+async def run(main, bus_cls, args, base_url: str, pooled: bool) -> dict:
+  main.http.config.pooled = pooled
+  main.runtime.config.max_concurrency = args.concurrency
+  before = await wait_ready(base_url)
+
+  bus = bus_cls()
+  started: dict[str, float] = {}
+  latencies: list[float] = []
+  failed = 0
+  done = asyncio.Event()
+
+  async def on_reply(msg):
+    nonlocal failed
+    body = json.loads(msg.data)
+    if msg.subject == 'publish.failed':
+      failed += 1
+    latencies.append(time.perf_counter() - started[body['request_id']])
+    if len(latencies) == args.posts:
+      done.set()
+
+  await bus.subscribe('publish.success', cb=on_reply)
+  await bus.subscribe('publish.failed', cb=on_reply)
+  await main.http.start()
+  await main.runtime.start(bus=bus)
+  t0 = time.perf_counter()
+  for i in range(args.posts):
+    rid = f"{'pooled' if pooled else 'unpooled'}-{i}"
+    started[rid] = time.perf_counter()
+    body = {'request_id': rid, 'content': f"post {i}", 'credentials': {'access_token': 'bench'}}
+    await bus.publish('publish.twitter', json.dumps(body).encode())
+  await asyncio.wait_for(done.wait(), timeout=600)
+  elapsed = time.perf_counter() - t0
+  await main.runtime.stop()
+  await main.http.close()
+
+  after = await wait_ready(base_url)
+  return {
+    'client': 'pooled' if pooled else 'per-request',
+    **summarize(latencies, elapsed),
+    'failed': failed,
+    'connections': after['connections'] - before['connections'],
+  }
+
+
+async def main_async(args, base_url: str):
+  use_worker('twitter-connector')
+  from worker_common import MemoryBus
+  from app import main
+
+  rows = [
+    await run(main, MemoryBus, args, base_url, pooled=True),
+    await run(main, MemoryBus, args, base_url, pooled=False),
+  ]
+  print_table(rows, ['client', 'count', 'ops_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'failed', 'connections'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--posts', type=int, default=2000)
+  parser.add_argument('--concurrency', type=int, default=32)
+  parser.add_argument('--latency-ms', type=float, default=5)
+  parser.add_argument('--port', type=int, default=9900)
+  parser.add_argument('--plain', action='store_true', help='serve plain HTTP instead of HTTPS')
+  args = parser.parse_args()
+
+  scheme = 'http' if args.plain else 'https'
+  base_url = f"{scheme}://127.0.0.1:{args.port}"
+  os.environ['TWITTER_API_BASE_URL'] = base_url
+  os.environ['TWITTER_HTTP_VERIFY'] = '0'
+  os.environ['TWITTER_RATE_LIMIT'] = '0'  # measure the HTTP client, not the pacing
+  server = subprocess.Popen(
+    [sys.executable, str(HERE / 'mock_platform.py'), '--port', str(args.port), '--latency-ms', str(args.latency_ms)]
+    + ([] if args.plain else ['--tls']),
+  )
+  try:
+    asyncio.run(main_async(args, base_url))
+  finally:
+    server.terminate()
+    server.wait()
@@ -0,0 +1,83 @@
+"""generate-worker near-duplicate index: build, reload, lookup latency and recall.
+
+Indexes `--posts` synthetic posts of 12-30 words for one brand, reloads the
+index from its file as a restarted worker would, then times lookups for
+posts with 1-3 words changed (which should be found) and for unrelated posts
+(which should not).
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from _common import print_table, rss_mb, summarize, use_worker
+
+use_worker('generate-worker')
+
+from app.dedupe import DuplicateIndex  # noqa: E402
+
+
+def edit(post: str, words: int, rng: random.Random) -> str:
+  tokens = post.split()
+  for i in rng.sample(range(len(tokens)), words):
+    tokens[i] = 'changed'
+  return ' '.join(tokens)
+
+
+def lookups(index: DuplicateIndex, brand: str, texts: list[str]) -> tuple[dict, float]:
+  latencies, hits = [], 0
+  t0 = time.perf_counter()
+  for text in texts:
+    start = time.perf_counter()
+    hits += index.brand(brand).nearest(index.signature(text), index.threshold) is not None
+    latencies.append(time.perf_counter() - start)
+  return summarize(latencies, time.perf_counter() - t0), hits / len(texts)
+
+
+def main(args):
+  rng = random.Random(11)
+  letters = 'abcdefghijklmnopqrstuvwxyz'
+  vocab = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 8))) for _ in range(args.vocab)]
+  posts = [' '.join(rng.choices(vocab, k=rng.randint(12, 30))) for _ in range(args.posts)]
+
+  with tempfile.TemporaryDirectory() as tmp:
+    index = DuplicateIndex(tmp, threshold=args.threshold)
+    t0 = time.perf_counter()
+    signatures = np.stack([index.signature(post) for post in posts])
+    sign_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    index.brand('brand').add_many(signatures, [0] * len(posts))
+    add_s = time.perf_counter() - t0
+    index.close()
+    del index, signatures
+    base = rss_mb()
+    t0 = time.perf_counter()
+    index = DuplicateIndex(tmp, threshold=args.threshold)
+    index.brand('brand')
+    load_s = time.perf_counter() - t0
+    memory = rss_mb() - base
+
+    print(f"{args.posts} posts: signatures {args.posts / sign_s:,.0f}/s, index {add_s:.2f}s, "
+          f"reload {load_s:.2f}s, +{memory:.0f} MiB RSS after reload")
+    rows = []
+    for words in (1, 2, 3):
+      queries = [edit(post, words, rng) for post in rng.sample(posts, args.queries)]
+      stats, found = lookups(index, 'brand', queries)
+      rows.append({'query': f"{words} word(s) changed", 'found': round(found, 3), **stats})
+    unrelated = [' '.join(rng.choices(vocab, k=rng.randint(12, 30))) for _ in range(args.queries)]
+    stats, found = lookups(index, 'brand', unrelated)
+    rows.append({'query': 'unrelated', 'found': round(found, 3), **stats})
+    index.close()
+
+  print_table(rows, ['query', 'found', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--posts', type=int, default=300_000)
+  parser.add_argument('--vocab', type=int, default=5000)
+  parser.add_argument('--queries', type=int, default=2000)
+  parser.add_argument('--threshold', type=float, default=0.6)
+  main(parser.parse_args())
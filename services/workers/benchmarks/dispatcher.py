@@ -0,0 +1,113 @@
+"""schedule-worker dispatcher: schedule / cancel / replay / fire throughput and firing jitter.
+
+Schedules `--posts` posts spread over the next `--days` days (logged to a
+temporary append-only log), cancels `--cancel` of them, replays the log as a
+restarted worker would, and compacts it. Firing is measured twice on fresh
+logs: a burst of `--fire` overdue posts (raw fire throughput), then `--fire`
+posts due evenly over the next `--window` seconds, reporting how late each
+post fired versus its due time.
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from _common import print_table, rss_mb, summarize, use_worker
+
+use_worker('schedule-worker')
+
+from app.dispatcher import Dispatcher  # noqa: E402
+
+
+PAYLOAD = b'{"request_id":"%d","platform":"twitter","payload":{"request_id":"%d","content":"Scheduled post","credentials":{"access_token":"t"}}}'
+
+
+def timed(label: str, n: int, fn) -> dict:
+  t0 = time.perf_counter()
+  fn()
+  elapsed = time.perf_counter() - t0
+  return {'op': label, 'count': n, 'ops_per_s': round(n / elapsed, 1) if elapsed else 0.0, 'seconds': round(elapsed, 3)}
+
+
+async def fire(dispatcher: Dispatcher, n: int, window: float, label: str) -> tuple[dict, dict]:
+  lateness = []
+  due_at: dict[bytes, float] = {}
+  done = asyncio.Event()
+
+  async def emit(payloads: list[bytes]):
+    now = time.time()
+    for data in payloads:
+      lateness.append(now - due_at.pop(data))
+    if not due_at:
+      done.set()
+
+  start = time.time() + (0.5 if window else -1)
+  for i in range(n):
+    data = b'{"fire":%d}' % i
+    due = start + window * i / n
+    due_at[data] = due
+    dispatcher.schedule(f"fire-{i}", due, data)
+  dispatcher.sync()
+  dispatcher.start(emit)
+  t0 = time.perf_counter()
+  await asyncio.wait_for(done.wait(), timeout=window + 60)
+  elapsed = time.perf_counter() - t0
+  await dispatcher.stop()
+  throughput = {'op': label, 'count': n, 'ops_per_s': round(n / elapsed, 1), 'seconds': round(elapsed, 3)}
+  return throughput, {**summarize(lateness, elapsed), 'max_ms': round(max(lateness) * 1000, 3)}
+
+
+def main(args):
+  rng = random.Random(7)
+  with tempfile.TemporaryDirectory() as tmp:
+    log = Path(tmp) / 'dispatch.log'
+    dispatcher = Dispatcher(log, batch=args.batch)
+    dispatcher.replay()
+    now = time.time()
+    dues = [now + 3600 + rng.random() * args.days * 86400 for _ in range(args.posts)]
+    rss_before = rss_mb()
+
+    def schedule():
+      for i, due in enumerate(dues):
+        dispatcher.schedule(f"post-{i}", due, PAYLOAD % (i, i))
+      dispatcher.sync()
+
+    def cancel():
+      for i in rng.sample(range(args.posts), args.cancel):
+        dispatcher.cancel(f"post-{i}")
+      dispatcher.sync()
+
+    rows = [timed('schedule', args.posts, schedule), timed('cancel', args.cancel, cancel)]
+    rss_after = rss_mb()
+    log_mb = dispatcher.log.size / 2**20
+    dispatcher.log.close()
+
+    restarted = Dispatcher(log, batch=args.batch)
+    rows.append(timed('replay', args.posts + args.cancel, restarted.replay))
+    assert restarted.pending == args.posts - args.cancel, restarted.pending
+    rows.append(timed('compact', restarted.pending, restarted.compact))
+
+    restarted.log.close()
+
+    burst, _ = asyncio.run(fire(Dispatcher(Path(tmp) / 'burst.log', batch=args.batch), args.fire, 0, 'fire (burst)'))
+    paced, lateness = asyncio.run(fire(Dispatcher(Path(tmp) / 'paced.log', batch=args.batch), args.fire, args.window, 'fire (paced)'))
+    rows += [burst, paced]
+
+  print(f"{args.posts} pending posts over {args.days} days: log {log_mb:.0f} MB, "
+        f"index ~{rss_after - rss_before:.0f} MB RSS ({rss_after:.0f} MB total)")
+  print_table(rows, ['op', 'count', 'ops_per_s', 'seconds'])
+  print(f"\nfiring lateness over {args.fire} posts due within {args.window}s")
+  print_table([{'what': 'late by', **lateness}], ['what', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--posts', type=int, default=1_000_000)
+  parser.add_argument('--cancel', type=int, default=100_000)
+  parser.add_argument('--days', type=float, default=30)
+  parser.add_argument('--fire', type=int, default=50_000)
+  parser.add_argument('--window', type=float, default=5.0)
+  parser.add_argument('--batch', type=int, default=500)
+  main(parser.parse_args())
@@ -0,0 +1,90 @@
+"""generate-worker throughput with and without backend micro-batching.
+
+Fires `--requests` concurrent gen.request messages through the worker's
+handler on a MemoryBus and compares a batcher that calls the backend once per
+variant (max_batch=1) against the micro-batched configuration. The stub
+backend charges a fixed `--call-latency` per call plus `--item-latency` per
+variant, which is the cost profile batching is meant to amortize.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from _common import print_table, summarize, use_worker
+
+use_worker('generate-worker')
+
+from worker_common import MemoryBus  # noqa: E402
+from app import main  # noqa: E402
+from app.backends import MicroBatcher, StubBackend  # noqa: E402
+from app.dedupe import DuplicateIndex  # noqa: E402
+
+
+PLATFORMS = ['twitter', 'linkedin', 'instagram', 'facebook', 'tiktok', 'youtube', 'threads', 'pinterest']
+
+
+async def run(args, label: str, max_batch: int, window: float) -> dict:
+  backend = StubBackend(call_latency=args.call_latency, item_latency=args.item_latency)
+  main.batcher = MicroBatcher(backend, max_batch=max_batch, window=window, max_inflight=args.backend_concurrency)
+  # Stub variants of similar topics are near-duplicates; keep regenerations out of the comparison.
+  main.dedupe = DuplicateIndex(None, threshold=2.0)
+  main.runtime.config.max_concurrency = args.concurrency
+
+  bus = MemoryBus()
+  started: dict[str, float] = {}
+  latencies: list[float] = []
+  done = asyncio.Event()
+
+  async def on_complete(msg):
+    rid = json.loads(msg.data)['request_id']
+    latencies.append(time.perf_counter() - started[rid])
+    if len(latencies) == args.requests:
+      done.set()
+
+  await bus.subscribe('gen.complete', cb=on_complete)
+  await main.runtime.start(bus=bus)
+  t0 = time.perf_counter()
+  for i in range(args.requests):
+    rid = f"bench-{i}"
+    started[rid] = time.perf_counter()
+    payload = {
+      'request_id': rid,
+      'brief_id': f"brief-{i % 17}",
+      'brand_id': 'brand-1',
+      'platforms': PLATFORMS[: args.platforms],
+      'num_variants': args.variants,
+      'topic': f"topic {i}",
+    }
+    await bus.publish('gen.request', json.dumps(payload).encode())
+  await asyncio.wait_for(done.wait(), timeout=600)
+  elapsed = time.perf_counter() - t0
+  await main.runtime.stop()
+  await main.batcher.close()
+
+  row = {'mode': label, **summarize(latencies, elapsed)}
+  row['variants_per_s'] = round(args.requests * args.platforms * args.variants / elapsed, 1)
+  row['backend_calls'] = backend.calls
+  return row
+
+
+async def main_async(args):
+  rows = [
+    await run(args, 'per-variant', max_batch=1, window=0),
+    await run(args, 'micro-batched', max_batch=args.max_batch, window=args.window_ms / 1000),
+  ]
+  print_table(rows, ['mode', 'count', 'ops_per_s', 'variants_per_s', 'backend_calls', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--requests', type=int, default=200)
+  parser.add_argument('--platforms', type=int, default=3)
+  parser.add_argument('--variants', type=int, default=3)
+  parser.add_argument('--concurrency', type=int, default=32, help='handler slots (WORKER_MAX_CONCURRENCY)')
+  parser.add_argument('--backend-concurrency', type=int, default=4)
+  parser.add_argument('--max-batch', type=int, default=64)
+  parser.add_argument('--window-ms', type=float, default=5)
+  parser.add_argument('--call-latency', type=float, default=0.02)
+  parser.add_argument('--item-latency', type=float, default=0.0005)
+  asyncio.run(main_async(parser.parse_args()))
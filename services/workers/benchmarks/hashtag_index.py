@@ -0,0 +1,72 @@
+"""hashtag-worker index build time, memory and query latency at corpus scale.
+
+Generates a synthetic corpus of `--tags` hashtags made of 1-3 words from a
+fixed vocabulary, loads it through `HashtagIndex.load`, then times `top()` for
+random one- and two-word topics.
+"""
+import argparse
+import random
+import tempfile
+import time
+
+from _common import print_table, rss_mb, summarize, use_worker
+
+use_worker('hashtag-worker')
+
+from app.index import HashtagIndex  # noqa: E402
+
+
+def write_corpus(path: str, n: int, rng: random.Random, vocab: list[str]) -> list[list[str]]:
+  """Write the corpus; returns a sample of the word combinations used, for queries."""
+  now = time.time()
+  used = []
+  with open(path, 'w') as f:
+    for i in range(n):
+      words = rng.sample(vocab, rng.choice((1, 2, 2, 3)))
+      if i % 97 == 0:
+        used.append(words)
+      tag = ''.join(words) + (str(i) if i % 3 == 0 else '')
+      f.write(f"{tag}\t{int(rng.paretovariate(1.2) * 10)}\t{int(now - rng.random() * 90 * 86400)}\n")
+  return used
+
+
+def main(args):
+  rng = random.Random(3)
+  letters = 'abcdefghijklmnopqrstuvwxyz'
+  vocab = list({''.join(rng.choice(letters) for _ in range(rng.randint(3, 8))) for _ in range(args.vocab)})
+  with tempfile.NamedTemporaryFile(suffix='.tsv') as corpus:
+    used = write_corpus(corpus.name, args.tags, rng, vocab)
+    base = rss_mb()
+    t0 = time.perf_counter()
+    index = HashtagIndex()
+    index.load(corpus.name)
+    build_s = time.perf_counter() - t0
+    memory = rss_mb() - base
+
+  print(f"{len(index)} tags, {len(index.postings)} trigrams, built in {build_s:.1f}s, +{memory:.0f} MiB RSS")
+  rows = []
+  for words in (1, 2):
+    pool = [w for w in used if len(w) >= words]
+    topics = [' '.join(rng.choice(pool)[:words]) for _ in range(args.queries)]
+    latencies, hits = [], 0
+    t0 = time.perf_counter()
+    for topic in topics:
+      start = time.perf_counter()
+      hits += len(index.top(topic, args.k))
+      latencies.append(time.perf_counter() - start)
+    rows.append({'topic_words': words, 'avg_hits': round(hits / len(topics), 1), **summarize(latencies, time.perf_counter() - t0)})
+
+  t0 = time.perf_counter()
+  for i in range(args.queries):
+    index.observe(f"{rng.choice(vocab)}{rng.choice(vocab)}new{i}")
+  print(f"incremental observe: {args.queries / (time.perf_counter() - t0):.0f} tags/s")
+  print_table(rows, ['topic_words', 'avg_hits', 'count', 'ops_per_s', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--tags', type=int, default=1_000_000)
+  parser.add_argument('--vocab', type=int, default=20_000)
+  parser.add_argument('--queries', type=int, default=1000)
+  parser.add_argument('--k', type=int, default=10)
+  main(parser.parse_args())
@@ -0,0 +1,152 @@
+"""Request-ID deduplication: memory and lookup cost at tens of millions of IDs.
+
+- filter: adds `--ids` request keys to the rotating cuckoo filter sized for
+  them and reports add and lookup cost (seen and unseen keys), the measured
+  false-positive rate, bytes per key and RSS growth.
+- store: claims and completes `--store-ids` requests in the SQLite store,
+  then looks up duplicates, and reports per-operation cost and file size per
+  key.
+- run: `Idempotency.run` overhead per message around a no-op handler for new
+  requests and replayed duplicates, with and without the store.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+from _common import print_table, rss_mb, use_worker
+
+use_worker('twitter-connector')
+
+from worker_common.idempotency import Idempotency, IdempotencyStore, RotatingFilter, request_key  # noqa: E402
+
+
+def digest(i: int, salt: str = '') -> bytes:
+  return hashlib.blake2b(f"publish.twitter\0{salt}req-{i}".encode(), digest_size=16).digest()
+
+
+def bench_filter(args) -> list[dict]:
+  rss0 = rss_mb()
+  cuckoo = RotatingFilter(args.ids, args.fingerprint_bits)
+  t0 = time.perf_counter()
+  for i in range(args.ids):
+    cuckoo.add(digest(i))
+  add_s = time.perf_counter() - t0
+  hashed = [digest(i) for i in range(0, args.ids, max(1, args.ids // args.probes))]
+  t0 = time.perf_counter()
+  assert all(d in cuckoo for d in hashed)
+  hit_s = (time.perf_counter() - t0) / len(hashed)
+  fresh = [digest(i, 'new-') for i in range(args.probes)]
+  t0 = time.perf_counter()
+  false_positives = sum(d in cuckoo for d in fresh)
+  miss_s = (time.perf_counter() - t0) / len(fresh)
+  return [{
+    'ids': args.ids,
+    'fp_bits': args.fingerprint_bits,
+    'filter_mb': round(cuckoo.nbytes / 2**20, 1),
+    'bytes_per_id': round(cuckoo.nbytes / args.ids, 2),
+    'rss_growth_mb': round(rss_mb() - rss0, 1),
+    'add_us': round(add_s / args.ids * 1e6, 2),
+    'hit_us': round(hit_s * 1e6, 2),
+    'miss_us': round(miss_s * 1e6, 2),
+    'fp_rate': f"{false_positives / len(fresh):.1e}",
+  }]
+
+
+def bench_store(args, workdir: str) -> list[dict]:
+  path = os.path.join(workdir, 'idempotency.db')
+  store = IdempotencyStore(path)
+  response = b'\x91\x93\xafpublish.success\xc4\x40' + b'x' * 64 + b'\xc0'
+  now = time.time()
+  t0 = time.perf_counter()
+  for i in range(args.store_ids):
+    key = digest(i)
+    store.claim(key, now, 60.0)
+    store.complete(key, response)
+  write_s = time.perf_counter() - t0
+  probes = [digest(random.randrange(args.store_ids)) for _ in range(min(args.probes, args.store_ids))]
+  t0 = time.perf_counter()
+  for key in probes:
+    assert store.claim(key, now, 60.0)[0] == 'done'
+  dup_s = (time.perf_counter() - t0) / len(probes)
+  store.close()
+  size = sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+  return [{
+    'ids': args.store_ids,
+    'claim_complete_us': round(write_s / args.store_ids * 1e6, 2),
+    'duplicate_lookup_us': round(dup_s * 1e6, 2),
+    'file_mb': round(size / 2**20, 1),
+    'bytes_per_id': round(size / args.store_ids, 1),
+  }]
+
+
+async def bench_run(args, workdir: str) -> list[dict]:
+  async def handler(msg):
+    await publish('publish.success', b'{"request_id":"x","external_id":"tw_1"}', None)
+
+  async def publish(subject, data, headers):
+    capture(subject, data, headers)
+
+  from worker_common.idempotency import capture
+
+  rows = []
+  n = args.run_ids
+  msgs = [SimpleNamespace(subject='publish.twitter', data=json.dumps({'request_id': f"r{i}", 'content': 'hi'}).encode())
+          for i in range(n)]
+  t0 = time.perf_counter()
+  for msg in msgs:
+    request_key(msg.subject, msg.data)
+  key_s = (time.perf_counter() - t0) / n
+  for mode, store in (('memory', None), ('sqlite', IdempotencyStore(os.path.join(workdir, 'run.db')))):
+    idem = Idempotency(store, max_entries=n, window=n)
+    t0 = time.perf_counter()
+    for msg in msgs:
+      await handler(msg)
+    bare_s = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for msg in msgs:
+      await idem.run(msg, handler, publish)
+    new_s = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for msg in msgs:
+      await idem.run(msg, handler, publish)
+    dup_s = (time.perf_counter() - t0) / n
+    rows.append({
+      'mode': mode,
+      'handler_us': round(bare_s * 1e6, 2),
+      'key_us': round(key_s * 1e6, 2),
+      'new_us': round(new_s * 1e6, 2),
+      'replay_us': round(dup_s * 1e6, 2),
+    })
+    idem.close()
+  return rows
+
+
+def main(args):
+  random.seed(24)
+  with tempfile.TemporaryDirectory() as workdir:
+    if 'filter' in args.parts:
+      print(f"Cuckoo filter, {args.ids:,} ids")
+      print_table(bench_filter(args), ['ids', 'fp_bits', 'filter_mb', 'bytes_per_id', 'rss_growth_mb', 'add_us', 'hit_us', 'miss_us', 'fp_rate'])
+    if 'store' in args.parts:
+      print(f"\nSQLite store, {args.store_ids:,} ids")
+      print_table(bench_store(args, workdir), ['ids', 'claim_complete_us', 'duplicate_lookup_us', 'file_mb', 'bytes_per_id'])
+    if 'run' in args.parts:
+      print(f"\nIdempotency.run around a no-op handler, {args.run_ids:,} requests")
+      print_table(asyncio.run(bench_run(args, workdir)), ['mode', 'handler_us', 'key_us', 'new_us', 'replay_us'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--ids', type=int, default=20_000_000)
+  parser.add_argument('--fingerprint-bits', type=int, default=16, choices=[8, 16, 32])
+  parser.add_argument('--store-ids', type=int, default=1_000_000)
+  parser.add_argument('--run-ids', type=int, default=50_000)
+  parser.add_argument('--probes', type=int, default=200_000)
+  parser.add_argument('--parts', type=lambda s: s.split(','), default=['filter', 'store', 'run'])
+  main(parser.parse_args())
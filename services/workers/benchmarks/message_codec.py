@@ -0,0 +1,229 @@
+"""Bus message codec: json + pydantic vs worker_common.codec per message type.
+
+For each message type, decodes a synthetic message and re-encodes it, once
+the way handlers used to (`Model(**json.loads(data.decode()))` and
+`json.dumps(model.model_dump()).encode()`) and once with `codec.decode` /
+`codec.encode`, and reports microseconds per message, the speedup, and
+whether both paths produce the same JSON document.
+"""
+import argparse
+import json
+import random
+import time
+
+from pydantic import BaseModel
+
+from _common import print_table, use_worker
+
+use_worker('generate-worker')
+
+from app.main import GenerateRequest, GenerateResponse  # noqa: E402
+from worker_common.codec import Message, decode, encode  # noqa: E402
+
+
+# pydantic models as the workers declared them before the codec.
+class OldGenerateRequest(BaseModel):
+  request_id: str
+  brief_id: str
+  brand_id: str
+  voice_model_id: str | None = None
+  platforms: list[str]
+  language: str = "en"
+  num_variants: int = 3
+  topic: str
+  audience: str | None = None
+  tone: str | None = None
+  constraints: dict | None = None
+  stream: bool = False
+
+
+class OldVariant(BaseModel):
+  platform: str
+  content: str
+  language: str
+  hashtags: list[str] = []
+  score: dict = {}
+
+
+class OldGenerateResponse(BaseModel):
+  request_id: str
+  brief_id: str
+  variants: list[OldVariant]
+  generated_at: str
+  streamed: bool = False
+  total_variants: int | None = None
+  part: int | None = None
+  parts: int | None = None
+  duplicates_rejected: int | None = None
+
+
+class OldPublishRequest(BaseModel):
+  request_id: str
+  brand_id: str | None = None
+  content: str
+  media_ids: list[str] | None = None
+  credentials: dict
+
+
+class OldPolicyBatchItem(BaseModel):
+  id: str | None = None
+  platform: str
+  content: str
+
+
+class OldPolicyBatchRequest(BaseModel):
+  request_id: str
+  items: list[OldPolicyBatchItem]
+
+
+class OldMetricsRecord(BaseModel):
+  external_post_id: str
+  platform: str | None = None
+  metrics: dict
+  published_at: str | None = None
+  region: str | None = None
+
+
+class OldMetricsIngestBatchRequest(BaseModel):
+  request_id: str
+  platform: str | None = None
+  records: list[OldMetricsRecord]
+
+
+# Codec types of the workers other than generate-worker (one `app` per process).
+class PublishRequest(Message, kw_only=True):
+  request_id: str
+  brand_id: str | None = None
+  content: str
+  media_ids: list[str] | None = None
+  credentials: dict
+
+
+class PolicyBatchItem(Message, kw_only=True):
+  id: str | None = None
+  platform: str
+  content: str
+
+
+class PolicyBatchRequest(Message):
+  request_id: str
+  items: list[PolicyBatchItem]
+
+
+class MetricsRecord(Message, kw_only=True):
+  external_post_id: str
+  platform: str | None = None
+  metrics: dict
+  published_at: str | None = None
+  region: str | None = None
+
+
+class MetricsIngestBatchRequest(Message, kw_only=True):
+  request_id: str
+  platform: str | None = None
+  records: list[MetricsRecord]
+
+
+PLATFORMS = ['twitter', 'linkedin', 'instagram', 'facebook', 'tiktok']
+WORDS = "growth team launch customers insight strategy lesson engagement audience product café naïve".split()
+
+
+def text(rng: random.Random, lo: int, hi: int) -> str:
+  return ' '.join(rng.choices(WORDS, k=rng.randint(lo, hi)))
+
+
+def messages(rng: random.Random) -> dict[str, dict]:
+  return {
+    'gen.request': {
+      'request_id': 'req-1', 'brief_id': 'brief-1', 'brand_id': 'brand-1', 'voice_model_id': None,
+      'platforms': PLATFORMS[:3], 'language': 'en', 'num_variants': 4, 'topic': text(rng, 6, 12),
+      'audience': 'founders', 'tone': 'friendly', 'constraints': {'max_hashtags': 3}, 'stream': False,
+    },
+    'gen.complete': {
+      'request_id': 'req-1', 'brief_id': 'brief-1', 'generated_at': '2024-05-01T12:00:00',
+      'variants': [{
+        'platform': rng.choice(PLATFORMS), 'content': text(rng, 30, 90), 'language': 'en',
+        'hashtags': rng.sample(WORDS, 3),
+        'score': {'brandFit': 0.8, 'readability': 0.71, 'policyRisk': 0.05, 'lengthFit': 1.0,
+                  'hashtagFit': 0.9, 'overall': 0.84},
+      } for _ in range(12)],
+      'streamed': False, 'total_variants': None, 'part': None, 'parts': None, 'duplicates_rejected': 0,
+    },
+    'publish.twitter': {
+      'request_id': 'req-1', 'brand_id': 'brand-1', 'content': text(rng, 20, 40), 'media_ids': ['m1', 'm2'],
+      'credentials': {'api_key': 'k', 'api_secret': 's', 'access_token': 't', 'access_token_secret': 'ts'},
+    },
+    'policy.check.batch': {
+      'request_id': 'req-1',
+      'items': [{'id': f"v{i}", 'platform': rng.choice(PLATFORMS), 'content': text(rng, 20, 60)} for i in range(200)],
+    },
+    'metrics.ingest.batch': {
+      'request_id': 'req-1', 'platform': 'twitter',
+      'records': [{
+        'external_post_id': f"tw_{i}", 'platform': rng.choice(PLATFORMS),
+        'metrics': {'impressions': rng.randint(100, 100_000), 'likes': rng.randint(0, 5000),
+                    'shares': rng.randint(0, 500), 'comments': rng.randint(0, 300)},
+        'published_at': '2024-05-01T12:00:00Z', 'region': 'US',
+      } for i in range(1000)],
+    },
+  }
+
+
+CASES = {
+  'gen.request': (OldGenerateRequest, GenerateRequest),
+  'gen.complete': (OldGenerateResponse, GenerateResponse),
+  'publish.twitter': (OldPublishRequest, PublishRequest),
+  'policy.check.batch': (OldPolicyBatchRequest, PolicyBatchRequest),
+  'metrics.ingest.batch': (OldMetricsIngestBatchRequest, MetricsIngestBatchRequest),
+}
+
+
+def old_path(model, data: bytes) -> bytes:
+  return json.dumps(model(**json.loads(data.decode())).model_dump()).encode()
+
+
+def new_path(type_, data: bytes) -> bytes:
+  return encode(decode(data, type_))
+
+
+def per_message(fn, type_, data: bytes, min_time: float) -> float:
+  """Seconds per call of fn(type_, data), repeated for at least `min_time`."""
+  n = 0
+  t0 = time.perf_counter()
+  while True:
+    for _ in range(10):
+      fn(type_, data)
+    n += 10
+    elapsed = time.perf_counter() - t0
+    if elapsed >= min_time:
+      return elapsed / n
+
+
+def main(args):
+  rng = random.Random(21)
+  rows = []
+  for subject, body in messages(rng).items():
+    if args.subjects and subject not in args.subjects:
+      continue
+    old_model, new_type = CASES[subject]
+    data = json.dumps(body).encode()
+    old_out, new_out = old_path(old_model, data), new_path(new_type, data)
+    old_s = per_message(old_path, old_model, data, args.min_time)
+    new_s = per_message(new_path, new_type, data, args.min_time)
+    rows.append({
+      'subject': subject,
+      'bytes': len(data),
+      'json_pydantic_us': round(old_s * 1e6, 2),
+      'codec_us': round(new_s * 1e6, 2),
+      'speedup': f"{old_s / new_s:.1f}x",
+      'out_bytes': f"{len(old_out)} -> {len(new_out)}",
+      'same_json': json.loads(old_out) == json.loads(new_out),
+    })
+  print_table(rows, ['subject', 'bytes', 'json_pydantic_us', 'codec_us', 'speedup', 'out_bytes', 'same_json'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--min-time', type=float, default=1.0, help='seconds spent per path and message type')
+  parser.add_argument('--subjects', type=lambda s: s.split(','), default=None)
+  main(parser.parse_args())
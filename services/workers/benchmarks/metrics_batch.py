@@ -0,0 +1,102 @@
+"""metrics-ingest-worker: one metrics.ingest per post vs metrics.ingest.batch.
+
+Pushes `--posts` synthetic raw records through the worker's handlers on a
+MemoryBus, once as individual messages and once as batches of `--batch`
+records, and checks that both paths produce the same normalized values.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from _common import print_table, use_worker
+
+use_worker('metrics-ingest-worker')
+
+from worker_common import MemoryBus  # noqa: E402
+from app import main  # noqa: E402
+
+
+PLATFORMS = ['twitter', 'linkedin', 'instagram', 'facebook', 'tiktok', 'youtube']
+
+
+def make_records(n: int, rng: random.Random) -> list[dict]:
+  records = []
+  for i in range(n):
+    metrics = {
+      'comments': rng.randint(0, 50),
+      'shares': rng.randint(0, 20),
+      'saves': rng.randint(0, 10),
+      'clicks': rng.randint(0, 200),
+    }
+    metrics['likes' if i % 2 else 'reactions'] = rng.randint(1, 500)
+    if i % 3:
+      metrics['impressions' if i % 5 else 'views'] = rng.randint(0, 20000)
+    records.append({'external_post_id': f"post-{i}", 'platform': rng.choice(PLATFORMS), 'metrics': metrics})
+  return records
+
+
+async def drive(subject: str, messages: list[bytes], done_subject: str, expected: int, rows_of) -> tuple[float, list]:
+  bus = MemoryBus(max_payload=8 * 2**20)
+  received = []
+  seen = 0
+  done = asyncio.Event()
+
+  async def on_done(msg):
+    nonlocal seen
+    body = json.loads(msg.data)
+    received.append(body)
+    seen += rows_of(body)
+    if seen >= expected:
+      done.set()
+
+  await bus.subscribe(done_subject, cb=on_done)
+  await main.runtime.start(bus=bus)
+  t0 = time.perf_counter()
+  for data in messages:
+    await bus.publish(subject, data)
+  await asyncio.wait_for(done.wait(), timeout=600)
+  elapsed = time.perf_counter() - t0
+  await main.runtime.stop()
+  return elapsed, received
+
+
+async def main_async(args):
+  main.runtime.config.max_concurrency = args.concurrency
+  records = make_records(args.posts, random.Random(5))
+
+  single = [
+    json.dumps({'request_id': r['external_post_id'], 'platform': r['platform'], **r}).encode()
+    for r in records
+  ]
+  single_s, single_out = await drive('metrics.ingest', single, 'metrics.processed', len(records), lambda body: 1)
+
+  batches = [
+    json.dumps({'request_id': f"batch-{i}", 'records': records[i:i + args.batch]}).encode()
+    for i in range(0, len(records), args.batch)
+  ]
+  batch_s, batch_out = await drive('metrics.ingest.batch', batches, 'metrics.processed.batch', len(records), lambda body: body['count'])
+
+  by_id = {body['request_id']: body['normalized'] for body in single_out}
+  for body in batch_out:
+    for j, post_id in enumerate(body['external_post_ids']):
+      expected = by_id[post_id]
+      for field, values in body['columns'].items():
+        if field in expected:
+          # Rates may differ from round() in the last place on ties.
+          assert abs(values[j] - expected[field]) <= 1.5e-4, (post_id, field, values[j], expected[field])
+
+  rows = [
+    {'mode': 'per-message', 'messages': len(single), 'elapsed_s': round(single_s, 3), 'posts_per_s': round(len(records) / single_s)},
+    {'mode': f"batch of {args.batch}", 'messages': len(batches), 'elapsed_s': round(batch_s, 3), 'posts_per_s': round(len(records) / batch_s)},
+  ]
+  print_table(rows, ['mode', 'messages', 'elapsed_s', 'posts_per_s'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--posts', type=int, default=100_000)
+  parser.add_argument('--batch', type=int, default=5000)
+  parser.add_argument('--concurrency', type=int, default=16)
+  asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""Per-message overhead of the runtime's Prometheus instrumentation.
+
+Runs policy-check-worker over the in-process MemoryBus twice, in child
+processes with `WORKER_METRICS=1` and `WORKER_METRICS=0`, and compares
+microseconds per message for its real `policy.check` handler and for a no-op
+handler (the worst case, where instrumentation is the largest share of the
+work). Also times the raw recording calls and a `/metrics` render.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from _common import print_table, use_worker
+
+
+POST = 'Five ways to plan a week of posts without burning out. #productivity'
+
+
+async def drive(main, subject: str, messages: int, replies: list[str]) -> float:
+  """Seconds per message for `messages` messages on `subject` until all are handled."""
+  from worker_common import MemoryBus
+
+  bus = MemoryBus()
+  done = asyncio.Event()
+  seen = 0
+
+  async def on_reply(msg):
+    nonlocal seen
+    seen += 1
+    if seen == messages:
+      done.set()
+
+  for reply in replies:
+    await bus.subscribe(reply, on_reply)
+  await main.runtime.start(bus=bus)
+  data = [json.dumps({'request_id': str(i), 'platform': 'twitter', 'content': POST}).encode() for i in range(messages)]
+  t0 = time.perf_counter()
+  for body in data:
+    await bus.publish(subject, body)
+  await done.wait()
+  elapsed = time.perf_counter() - t0
+  await main.runtime.stop()
+  return elapsed / messages
+
+
+def child(args):
+  use_worker('policy-check-worker')
+  from app import main
+
+  @main.runtime.subscribe('bench.noop')
+  async def noop(msg):
+    await main.runtime.publish('bench.done', b'{}')
+
+  results = {}
+  for subject, replies in (('policy.check', ['policy.approved', 'policy.rejected']), ('bench.noop', ['bench.done'])):
+    runs = [asyncio.run(drive(main, subject, args.messages, replies)) for _ in range(args.rounds)]
+    results[subject] = min(runs)
+  if main.runtime.metrics is not None:
+    t0 = time.perf_counter()
+    text = main.runtime.metrics.render()
+    results['render_ms'] = (time.perf_counter() - t0) * 1000
+    results['render_bytes'] = len(text)
+  print(json.dumps(results))
+
+
+def recording_cost(n: int) -> dict:
+  use_worker('policy-check-worker')
+  from worker_common.metrics import Metrics
+
+  metrics = Metrics('bench')
+  stats = metrics.subject('policy.check')
+
+  class Msg:
+    data = POST.encode()
+
+  msg = Msg()
+  t0 = time.perf_counter()
+  for _ in range(n):
+    stats.end(stats.begin(msg), 'ok')
+  handler_ns = (time.perf_counter() - t0) / n * 1e9
+  t0 = time.perf_counter()
+  for _ in range(n):
+    metrics.record_publish('policy.approved', 120)
+  publish_ns = (time.perf_counter() - t0) / n * 1e9
+  return {'begin_end_ns': round(handler_ns), 'record_publish_ns': round(publish_ns)}
+
+
+def run_child(args, enabled: bool) -> dict:
+  env = dict(os.environ, WORKER_METRICS='1' if enabled else '0', WORKER_LOOP_LAG_INTERVAL='0.5')
+  cmd = [sys.executable, os.path.abspath(__file__), '--child', '--messages', str(args.messages), '--rounds', str(args.rounds)]
+  out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+  return json.loads(out.strip().splitlines()[-1])
+
+
+def main(args):
+  on, off = run_child(args, True), run_child(args, False)
+  rows = []
+  for subject in ('policy.check', 'bench.noop'):
+    rows.append({
+      'handler': subject,
+      'off_us': round(off[subject] * 1e6, 2),
+      'on_us': round(on[subject] * 1e6, 2),
+      'overhead_us': round((on[subject] - off[subject]) * 1e6, 2),
+      'overhead_pct': f"{(on[subject] / off[subject] - 1) * 100:+.1f}%",
+    })
+  print(f"{args.messages} messages per run, best of {args.rounds}")
+  print_table(rows, ['handler', 'off_us', 'on_us', 'overhead_us', 'overhead_pct'])
+  cost = recording_cost(1_000_000)
+  print(f"\nrecording: begin+end {cost['begin_end_ns']} ns/message, record_publish {cost['record_publish_ns']} ns/publish; "
+        f"render {on['render_ms']:.2f} ms ({on['render_bytes']} bytes)")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--messages', type=int, default=20_000)
+  parser.add_argument('--rounds', type=int, default=5)
+  parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  child(args) if args.child else main(args)
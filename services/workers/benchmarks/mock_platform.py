@@ -0,0 +1,127 @@
+"""Local mock of the social platform APIs the connectors call.
+
+Serves the publish endpoints of every connector on one port with a fixed
+simulated latency and counts requests and distinct client connections, so
+connector HTTP behaviour can be benchmarked without network access:
+
+  python benchmarks/mock_platform.py --port 9900 --latency-ms 20 [--tls]
+  TWITTER_API_BASE_URL=http://127.0.0.1:9900 uvicorn app.main:app
+
+`--quota N` allows N requests per second per access token and answers the
+rest with 429 and `Retry-After`, to exercise connector rate limiting.
+
+`--tls` serves HTTPS with a throwaway self-signed certificate (needs the
+`openssl` CLI); point connectors at it with `<PLATFORM>_HTTP_VERIFY=0`.
+Uvicorn speaks HTTP/1.1 only, so HTTP/2 is negotiated down.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import tempfile
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+
+app = FastAPI(title="Mock Platform APIs")
+LATENCY = float(os.getenv('MOCK_LATENCY_MS', '20')) / 1000
+QUOTA = int(os.getenv('MOCK_QUOTA', '0'))  # requests per second per token; 0 = unlimited
+ids = itertools.count(1_000_000)
+stats = {'requests': 0, 'connections': set(), 'throttled': 0}
+windows: dict[str, list] = {}  # token -> [window second, count]
+
+
+@app.middleware('http')
+async def simulate(request: Request, call_next):
+  stats['requests'] += 1
+  if request.client:
+    stats['connections'].add((request.client.host, request.client.port))
+  if QUOTA and request.method == 'POST':
+    now = time.time()
+    window = windows.setdefault(request.headers.get('authorization', ''), [int(now), 0])
+    if window[0] != int(now):
+      window[:] = [int(now), 0]
+    window[1] += 1
+    if window[1] > QUOTA:
+      stats['throttled'] += 1
+      reset = window[0] + 1
+      return Response(status_code=429, headers={
+        'retry-after': str(max(1, round(reset - now))),
+        'x-rate-limit-remaining': '0',
+        'x-rate-limit-reset': str(reset),
+      })
+  if LATENCY:
+    await asyncio.sleep(LATENCY)
+  return await call_next(request)
+
+
+@app.get('/stats')
+async def get_stats():
+  return {'requests': stats['requests'], 'connections': len(stats['connections']), 'throttled': stats['throttled']}
+
+
+@app.post('/2/tweets')
+async def twitter():
+  return {'data': {'id': str(next(ids))}}
+
+
+@app.post('/v2/ugcPosts')
+async def linkedin(response: Response):
+  urn = f"urn:li:share:{next(ids)}"
+  response.headers['x-restli-id'] = urn
+  return {'id': urn}
+
+
+@app.post('/{node}/feed')
+@app.post('/{node}/media')
+@app.post('/{node}/media_publish')
+async def meta(node: str):
+  return {'id': f"{node}_{next(ids)}"}
+
+
+@app.post('/v2/post/publish/video/init/')
+async def tiktok():
+  return {'data': {'publish_id': f"v_pub_{next(ids)}"}}
+
+
+@app.post('/youtube/v3/videos')
+async def youtube():
+  return {'id': f"yt{next(ids)}"}
+
+
+@app.post('/v5/pins')
+async def pinterest():
+  return {'id': str(next(ids))}
+
+
+@app.post('/1/updates/create.json')
+async def buffer():
+  return {'success': True, 'updates': [{'id': f"bf{next(ids)}"}]}
+
+
+def self_signed_cert(directory: str) -> tuple[str, str]:
+  key, cert = os.path.join(directory, 'key.pem'), os.path.join(directory, 'cert.pem')
+  subprocess.run(
+    ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+     '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+    check=True, capture_output=True,
+  )
+  return key, cert
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=9900)
+  parser.add_argument('--latency-ms', type=float, default=LATENCY * 1000)
+  parser.add_argument('--quota', type=int, default=QUOTA, help="requests/s per access token (0 = unlimited)")
+  parser.add_argument('--tls', action='store_true')
+  args = parser.parse_args()
+  LATENCY = args.latency_ms / 1000
+  QUOTA = args.quota
+  with tempfile.TemporaryDirectory() as tmp:
+    tls = dict(zip(('ssl_keyfile', 'ssl_certfile'), self_signed_cert(tmp))) if args.tls else {}
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning', **tls)
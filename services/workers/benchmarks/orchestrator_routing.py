@@ -0,0 +1,86 @@
+"""publish-orchestrator: parse + re-encode forwarding vs zero-reparse routing.
+
+Times routing `--messages` publish.orchestrate envelopes the old way (json
+parse, pydantic model, `json.dumps(payload)`) against `app.routing.route`,
+which decodes only the routing fields (and the payload's request id) and
+forwards the payload bytes as received, and against header-routed messages
+whose body is the payload.
+Payload size grows with `--media` (media ids) and `--words` (post text).
+"""
+import argparse
+import json
+import random
+import time
+
+from pydantic import BaseModel
+
+from _common import print_table, summarize, use_worker
+
+use_worker('publish-orchestrator')
+
+from app.routing import CONNECTORS, route  # noqa: E402
+
+
+class OrchestrateRequest(BaseModel):
+  request_id: str
+  platform: str
+  payload: dict
+
+
+SUBJECT_MAP = {platform: f"publish.{connector}" for platform, connector in CONNECTORS.items()}
+
+
+def reparse(data: bytes, headers=None) -> tuple[str, bytes]:
+  req = OrchestrateRequest(**json.loads(data.decode()))
+  return SUBJECT_MAP[req.platform], json.dumps(req.payload).encode()
+
+
+def zero_reparse(data: bytes, headers=None) -> tuple[str, bytes]:
+  r = route(data, headers)
+  return f"publish.{r.connector}", r.data
+
+
+def timed(fn, messages: list[tuple[bytes, dict | None]]) -> dict:
+  latencies = []
+  t0 = time.perf_counter()
+  for data, headers in messages:
+    start = time.perf_counter()
+    fn(data, headers)
+    latencies.append(time.perf_counter() - start)
+  return summarize(latencies, time.perf_counter() - t0)
+
+
+def main(args):
+  rng = random.Random(7)
+  words = ['launch', 'summer', 'coffee', 'growth', 'team', 'design', 'today', 'new', 'story', 'brand']
+  envelopes, direct = [], []
+  for i in range(args.messages):
+    platform = rng.choice(['twitter', 'linkedin', 'instagram', 'tiktok', 'youtube', 'pinterest'])
+    payload = {
+      'request_id': f"r{i}",
+      'content': ' '.join(rng.choice(words) for _ in range(args.words)),
+      'media_ids': [f"media-{rng.randrange(10**9)}" for _ in range(args.media)],
+      'credentials': {'access_token': f"token-{rng.randrange(1000)}"},
+    }
+    envelopes.append((json.dumps({'request_id': f"r{i}", 'platform': platform, 'priority': 'now', 'payload': payload}).encode(), None))
+    direct.append((json.dumps(payload).encode(), {'Platform': platform, 'Request-Id': f"r{i}"}))
+
+  for (data, _), (body, _) in zip(envelopes[:100], direct):
+    assert json.loads(zero_reparse(data)[1]) == json.loads(reparse(data)[1]) == json.loads(body)
+
+  rows = [
+    {'routing': 'parse + re-encode', **timed(reparse, envelopes)},
+    {'routing': 'raw envelope', **timed(zero_reparse, envelopes)},
+    {'routing': 'headers', **timed(zero_reparse, direct)},
+  ]
+  size = sum(len(d) for d, _ in envelopes) / len(envelopes)
+  print(f"{args.messages} messages, mean envelope {size:.0f} bytes")
+  print_table(rows, ['routing', 'count', 'ops_per_s', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--messages', type=int, default=20000)
+  parser.add_argument('--words', type=int, default=60)
+  parser.add_argument('--media', type=int, default=4)
+  main(parser.parse_args())
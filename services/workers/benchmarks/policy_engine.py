@@ -0,0 +1,54 @@
+"""policy-check-worker: per-pattern re.search vs the compiled single-pass engine.
+
+Builds a ruleset of `--terms` synthetic banned phrases and times checking
+`--docs` variant-sized texts with the old approach (one `re.search` per term)
+against `CompiledRuleset.check`, and asserts both report the same issues.
+"""
+import argparse
+import random
+import re
+import time
+
+from _common import print_table, summarize, use_worker
+
+use_worker('policy-check-worker')
+
+from app.engine import CompiledRuleset, RuleSpec  # noqa: E402
+
+
+def per_pattern(terms: list[str], content: str) -> list[str]:
+  return [f"Contains banned term: {t}" for t in terms if re.search(re.escape(t), content, re.IGNORECASE)]
+
+
+def timed(fn, docs: list[str]) -> tuple[dict, list]:
+  latencies, results = [], []
+  t0 = time.perf_counter()
+  for doc in docs:
+    start = time.perf_counter()
+    results.append(fn(doc))
+    latencies.append(time.perf_counter() - start)
+  return summarize(latencies, time.perf_counter() - t0), results
+
+
+def main(args):
+  rng = random.Random(7)
+  vocab = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 9))) for _ in range(5000)]
+  terms = list(dict.fromkeys(' '.join(rng.sample(vocab, rng.randint(1, 3))) for _ in range(args.terms)))
+  docs = [' '.join(rng.choice(vocab) for _ in range(args.words)) for _ in range(args.docs)]
+
+  ruleset = CompiledRuleset(RuleSpec(terms=terms))
+  old, old_results = timed(lambda doc: per_pattern(terms, doc), docs)
+  new, new_results = timed(ruleset.check, docs)
+  assert old_results == new_results, 'engines disagree'
+
+  rows = [{'engine': 'per-pattern', **old}, {'engine': 'compiled', **new}]
+  print(f"{len(terms)} terms, {args.docs} docs of {args.words} words, {sum(map(bool, new_results))} flagged")
+  print_table(rows, ['engine', 'count', 'ops_per_s', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--terms', type=int, default=5000)
+  parser.add_argument('--docs', type=int, default=500)
+  parser.add_argument('--words', type=int, default=60)
+  main(parser.parse_args())
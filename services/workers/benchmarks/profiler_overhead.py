@@ -0,0 +1,80 @@
+"""Throughput cost of the on-demand profiler while it samples.
+
+Runs policy-check-worker's `policy.check` handler over the in-process
+MemoryBus with no profile running (the idle cost is nothing: no thread, no
+timer, no tracing) and again while `Profiler.sample` runs at each
+`--intervals` (ms), and while `Profiler.allocations` traces with tracemalloc,
+and reports microseconds per message and the slowdown against idle.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from _common import print_table, use_worker
+
+use_worker('policy-check-worker')
+
+from worker_common import MemoryBus  # noqa: E402
+from worker_common.profiler import Profiler  # noqa: E402
+from app import main as worker  # noqa: E402
+
+
+POST = 'Five ways to plan a week of posts without burning out. #productivity'
+
+
+async def drive(messages: int, profile=None) -> tuple[float, dict | None]:
+  """Seconds per message, with `profile()` (a coroutine factory) running alongside."""
+  bus = MemoryBus()
+  done = asyncio.Event()
+  seen = 0
+
+  async def on_reply(msg):
+    nonlocal seen
+    seen += 1
+    if seen == messages:
+      done.set()
+
+  for reply in ('policy.approved', 'policy.rejected'):
+    await bus.subscribe(reply, on_reply)
+  await worker.runtime.start(bus=bus)
+  data = [json.dumps({'request_id': str(i), 'platform': 'twitter', 'content': POST}).encode() for i in range(messages)]
+  job = asyncio.create_task(profile()) if profile else None
+  await asyncio.sleep(0)
+  t0 = time.perf_counter()
+  for body in data:
+    await bus.publish('policy.check', body)
+  await done.wait()
+  elapsed = time.perf_counter() - t0
+  result = await job if job else None
+  await worker.runtime.stop()
+  return elapsed / messages, result
+
+
+def main(args):
+  profiler = Profiler(max_seconds=3600)
+  # Long enough to cover the whole run; each sample returns when its window ends.
+  window = args.messages * 100e-6 + 1
+  modes = [('idle', None)]
+  modes += [(f"cpu {ms:g}ms", lambda ms=ms: profiler.sample(window, ms / 1000)) for ms in args.intervals]
+  modes.append(('alloc', lambda: profiler.allocations(window)))
+  asyncio.run(drive(args.messages))  # warm up
+  rows = []
+  idle = None
+  for name, profile in modes:
+    best, result = min((asyncio.run(drive(args.messages, profile)) for _ in range(args.rounds)), key=lambda r: r[0])
+    idle = idle or best
+    row = {'mode': name, 'us_per_msg': round(best * 1e6, 2), 'slowdown': f"{(best / idle - 1) * 100:+.1f}%"}
+    if result and 'thread_samples' in result:
+      row['samples'] = result['thread_samples']
+    rows.append(row)
+  print(f"{args.messages} messages per run, best of {args.rounds}")
+  print_table(rows, ['mode', 'us_per_msg', 'slowdown', 'samples'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--messages', type=int, default=20_000)
+  parser.add_argument('--rounds', type=int, default=3)
+  parser.add_argument('--intervals', type=lambda s: [float(v) for v in s.split(',')], default=[5, 1])
+  main(parser.parse_args())
@@ -0,0 +1,184 @@
+"""Throughput against process count for the CPU-bound workers.
+
+Starts each worker under `worker_common.supervisor` with every `--processes`
+count against a local NATS server (one is started with `nats-server -js` when
+`--nats-url` is not given), publishes the scenario's requests from
+`suite.py` as fast as possible and times them until every reply is in.
+Replicas split the subject through the worker's queue group (core NATS), or
+through the shared pull consumer with `--jetstream`. Reports messages/s and
+the speedup over one process; it cannot exceed the core count printed first.
+
+  python benchmarks/scaling.py --scenarios report,policy,generate --processes 1,2,4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from _common import WORKERS_DIR, print_table
+from suite import SCENARIOS
+
+
+DEFAULT_REQUESTS = {'report': 300, 'policy': 20_000, 'generate': 3_000}
+
+
+def free_port() -> int:
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+def start_nats(workdir: str) -> tuple[subprocess.Popen, str]:
+  binary = shutil.which('nats-server')
+  if binary is None:
+    sys.exit('nats-server not found; install it or pass --nats-url')
+  port = free_port()
+  proc = subprocess.Popen(
+    [binary, '-a', '127.0.0.1', '-p', str(port), '-js', '-sd', os.path.join(workdir, 'jetstream')],
+    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+  )
+  deadline = time.monotonic() + 10
+  while time.monotonic() < deadline:
+    try:
+      socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+      return proc, f"nats://127.0.0.1:{port}"
+    except OSError:
+      time.sleep(0.05)
+  proc.kill()
+  sys.exit('nats-server did not start')
+
+
+def start_worker(name: str, processes: int, args, workdir: str) -> subprocess.Popen:
+  """Run the scenario's worker under the supervisor; returns once every process is ready."""
+  scenario = SCENARIOS[name]
+  scratch = tempfile.mkdtemp(dir=workdir)
+  env = {
+    **os.environ,
+    'PYTHONPATH': str(WORKERS_DIR / 'worker-common'),
+    'NATS_URL': args.nats_url,
+    'WORKER_JETSTREAM': '1' if args.jetstream else '0',
+    'WORKER_STREAM': f"SCALING_{name.upper()}_{processes}",
+    'WORKER_STREAM_MAX_AGE': '600',
+    'WORKER_MAX_CONCURRENCY': str(args.concurrency),
+    'REPORT_STORE_DIR': os.path.join(scratch, 'reports'),
+    **scenario.env,
+  }
+  cmd = [
+    sys.executable, '-m', 'worker_common.supervisor', 'app.main:app',
+    '--processes', str(processes), '--port', '0', '--host', '127.0.0.1',
+    '--app-dir', str(WORKERS_DIR / scenario.worker), '--log-level', 'info',
+  ]
+  log = os.path.join(scratch, 'supervisor.log')
+  with open(log, 'w') as out:
+    proc = subprocess.Popen(cmd, env=env, cwd=scratch, stdout=out, stderr=subprocess.STDOUT)
+  while proc.poll() is None:
+    ready = re.search(r"(\d+) of \d+ processes ready", open(log).read())
+    if ready:
+      if int(ready.group(1)) != processes:
+        stop_worker(proc)
+        sys.exit(f"{scenario.worker}: only {ready.group(1)} of {processes} processes came up, see {log}")
+      return proc
+    time.sleep(0.1)
+  sys.exit(f"{scenario.worker} supervisor exited with {proc.returncode}:\n{open(log).read()}")
+
+
+def stop_worker(proc: subprocess.Popen):
+  proc.terminate()
+  try:
+    proc.wait(timeout=60)
+  except subprocess.TimeoutExpired:
+    proc.kill()
+    proc.wait()
+
+
+async def drive(name: str, requests: int, args) -> dict:
+  import nats
+
+  scenario = SCENARIOS[name]
+  nc = await nats.connect(args.nats_url)
+  rng = random.Random(args.seed)
+  run_id = f"{name}-{os.getpid()}-{time.time_ns()}"
+  payloads = [json.dumps(scenario.make(f"{run_id}-{i}", rng)).encode() for i in range(requests)]
+  pending = {f"{run_id}-{i}" for i in range(requests)}
+  failures = 0
+  done = asyncio.Event()
+
+  async def on_reply(msg):
+    nonlocal failures
+    try:
+      rid = scenario.reply_id(json.loads(msg.data))
+    except ValueError:
+      return
+    if rid in pending:
+      pending.discard(rid)
+      failures += msg.subject.endswith('.failed')
+      if not pending:
+        done.set()
+
+  for subject in scenario.replies:
+    await nc.subscribe(subject, cb=on_reply)
+  await nc.flush()
+  t0 = time.perf_counter()
+  for n, data in enumerate(payloads):
+    await nc.publish(scenario.subject, data)
+    if n % 256 == 0:
+      await nc.flush()
+  await nc.flush()
+  try:
+    await asyncio.wait_for(done.wait(), timeout=args.timeout)
+  except asyncio.TimeoutError:
+    pass
+  elapsed = time.perf_counter() - t0
+  await nc.close()
+  return {'requests': requests, 'elapsed_s': round(elapsed, 3), 'msgs_per_s': round((requests - len(pending)) / elapsed, 1),
+          'failures': failures, 'timeouts': len(pending)}
+
+
+def main(args):
+  with tempfile.TemporaryDirectory() as workdir:
+    server = None
+    if not args.nats_url:
+      server, args.nats_url = start_nats(workdir)
+    try:
+      print(f"{os.cpu_count()} cores, {'JetStream pull consumers' if args.jetstream else 'core NATS queue groups'}")
+      rows = []
+      for name in args.scenarios:
+        requests = args.requests or DEFAULT_REQUESTS.get(name, 1000)
+        base = None
+        for processes in args.processes:
+          worker = start_worker(name, processes, args, workdir)
+          try:
+            asyncio.run(drive(name, min(requests, 50), args))  # warm up every process
+            result = asyncio.run(drive(name, requests, args))
+          finally:
+            stop_worker(worker)
+          base = base or result['msgs_per_s']
+          rows.append({'scenario': name, 'processes': processes, **result, 'speedup': f"{result['msgs_per_s'] / base:.2f}x"})
+          print(f"  {name} x{processes}: {result['msgs_per_s']} msgs/s", file=sys.stderr)
+      print_table(rows, ['scenario', 'processes', 'requests', 'elapsed_s', 'msgs_per_s', 'speedup', 'failures', 'timeouts'])
+    finally:
+      if server is not None:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--scenarios', type=lambda s: s.split(','), default=['report', 'policy', 'generate'])
+  parser.add_argument('--processes', type=lambda s: [int(v) for v in s.split(',')],
+                      default=sorted({1, 2, 4, os.cpu_count() or 1}))
+  parser.add_argument('--requests', type=int, help='requests per run (default: per scenario)')
+  parser.add_argument('--concurrency', type=int, default=16, help='handler slots per process (WORKER_MAX_CONCURRENCY)')
+  parser.add_argument('--jetstream', action='store_true', help='consume through JetStream instead of core NATS')
+  parser.add_argument('--nats-url', help='use this server instead of starting nats-server')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--timeout', type=float, default=600)
+  main(parser.parse_args())
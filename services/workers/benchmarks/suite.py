@@ -0,0 +1,320 @@
+"""End-to-end benchmark suite for the Python workers.
+
+Each scenario starts one worker's handlers in its own subprocess, against the
+in-process MemoryBus (default) or a local NATS server (`--bus nats`), fires a
+synthetic request mix at the worker's subject and times every request until
+its reply arrives. Per worker it reports p50/p95/p99 latency, messages/s and
+peak RSS, and the whole run is written to JSON so runs can be compared across
+commits:
+
+  python benchmarks/suite.py --requests 500 --output results/$(git rev-parse --short HEAD).json
+  python benchmarks/suite.py --compare results/abc1234.json results/def5678.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from _common import WORKERS_DIR, print_table, summarize, use_worker
+
+
+PLATFORMS = ['twitter', 'linkedin', 'instagram', 'facebook', 'tiktok', 'youtube', 'pinterest']
+TOPICS = ['content marketing', 'social media growth', 'ai tools', 'small business seo', 'personal branding']
+
+
+@dataclass
+class Scenario:
+  worker: str
+  subject: str
+  make: Callable[[str, random.Random], dict]
+  replies: list[str]
+  # Pulls the correlation id out of a reply; most replies carry request_id.
+  reply_id: Callable[[dict], str | None] = lambda body: body.get('request_id')
+  env: dict = field(default_factory=dict)
+
+
+def gen_request(rid: str, rng: random.Random) -> dict:
+  return {
+    'request_id': rid,
+    'brief_id': f"brief-{rng.randint(1, 50)}",
+    'brand_id': 'brand-1',
+    'platforms': rng.sample(PLATFORMS, rng.randint(1, 3)),
+    'num_variants': rng.randint(1, 4),
+    'topic': f"{rng.choice(TOPICS)} {rng.randint(1, 1000)}",
+    'stream': rng.random() < 0.2,
+  }
+
+
+def policy_check(rid: str, rng: random.Random) -> dict:
+  clean = 'Five ways to plan a week of posts without burning out.'
+  flagged = 'Guaranteed results, click here http://x.co #growth ' + '#tag ' * rng.randint(0, 40)
+  return {'request_id': rid, 'platform': rng.choice(PLATFORMS), 'content': flagged if rng.random() < 0.3 else clean}
+
+
+def hashtag_request(rid: str, rng: random.Random) -> dict:
+  return {'request_id': rid, 'topic': rng.choice(TOPICS), 'max_tags': rng.choice([5, 10, 20])}
+
+
+def publish_request(rid: str, rng: random.Random) -> dict:
+  # Spread over many accounts so the per-account rate limit does not dominate.
+  account = rng.randrange(1000)
+  return {
+    'request_id': rid,
+    'content': f"Benchmark post {rid}",
+    'credentials': {'access_token': f"bench-{account}"},
+    'account_id': f"acct-{account}",
+  }
+
+
+def orchestrate_request(rid: str, rng: random.Random) -> dict:
+  return {'request_id': rid, 'platform': rng.choice(PLATFORMS), 'payload': publish_request(rid, rng)}
+
+
+def metrics_ingest(rid: str, rng: random.Random) -> dict:
+  return {
+    'request_id': rid,
+    'platform': rng.choice(PLATFORMS),
+    'external_post_id': f"post-{rid}",
+    'metrics': {
+      'likes': rng.randint(0, 500),
+      'comments': rng.randint(0, 50),
+      'shares': rng.randint(0, 20),
+      'impressions': rng.randint(0, 20000),
+      'clicks': rng.randint(0, 200),
+    },
+  }
+
+
+def report_generate(rid: str, rng: random.Random) -> dict:
+  posts = [
+    {
+      'post_id': f"p{i}",
+      'platform': rng.choice(PLATFORMS),
+      'published_at': f"2024-05-{1 + i % 28:02d}T12:00:00",
+      'impressions': rng.randint(0, 20000),
+      'clicks': rng.randint(0, 200),
+      'engagements': rng.randint(0, 500),
+    }
+    for i in range(rng.choice([10, 100, 1000]))
+  ]
+  return {
+    'request_id': rid,
+    'campaign_id': 'bench',
+    'format': rng.choice(['pdf', 'csv', 'json']),
+    'metrics': {},
+    'posts': posts,
+  }
+
+
+SCENARIOS: dict[str, Scenario] = {
+  'generate': Scenario(
+    'generate-worker', 'gen.request', gen_request, ['gen.complete', 'gen.failed'],
+    # Stub variants of similar topics are near-duplicates; don't measure regeneration rounds.
+    env={'GEN_DEDUPE_THRESHOLD': '2', 'GEN_DEDUPE_DIR': ''},
+  ),
+  'policy': Scenario('policy-check-worker', 'policy.check', policy_check, ['policy.approved', 'policy.rejected', 'policy.failed']),
+  'hashtag': Scenario('hashtag-worker', 'hashtag.request', hashtag_request, ['hashtag.complete', 'hashtag.failed']),
+  'orchestrate': Scenario(
+    'publish-orchestrator', 'publish.orchestrate', orchestrate_request,
+    ['publish.twitter', 'publish.linkedin', 'publish.meta', 'publish.tiktok', 'publish.youtube', 'publish.pinterest', 'publish.buffer'],
+    # No connectors reply here, so lift the in-flight caps out of the way.
+    env={'PUBLISH_MAX_IN_FLIGHT': '1000000'},
+  ),
+  'publish-twitter': Scenario('twitter-connector', 'publish.twitter', publish_request, ['publish.success', 'publish.failed']),
+  'metrics': Scenario('metrics-ingest-worker', 'metrics.ingest', metrics_ingest, ['metrics.processed', 'metrics.failed']),
+  'report': Scenario('report-worker', 'report.generate', report_generate, ['report.complete', 'report.failed']),
+}
+
+
+def peak_rss_mb() -> float:
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+async def run_scenario(name: str, args) -> dict:
+  """Runs inside the child process: start the worker, drive load, measure."""
+  scenario = SCENARIOS[name]
+  use_worker(scenario.worker)
+  from worker_common import MemoryBus, NatsBus
+  from app import main
+
+  runtime = main.runtime
+  runtime.config.max_concurrency = args.concurrency
+  if args.bus == 'nats':
+    runtime.config.stream = 'BENCH'
+    bus = NatsBus(args.nats_url, 'BENCH', stream_max_age=600)
+    await bus.connect()
+  else:
+    bus = MemoryBus(max_payload=8 * 2**20)
+
+  run_id = f"{name}-{os.getpid()}-{int(time.time())}"
+  started: dict[str, float] = {}
+  latencies: list[float] = []
+  failures = 0
+  expected = args.warmup + args.requests
+  done = asyncio.Event()
+
+  async def on_reply(msg):
+    nonlocal failures
+    try:
+      rid = scenario.reply_id(json.loads(msg.data))
+    except ValueError:
+      return
+    t0 = started.pop(rid, None)
+    if t0 is None:
+      return
+    if msg.subject.endswith('.failed'):
+      failures += 1
+    if not rid.startswith(f"{run_id}-warmup"):
+      latencies.append(time.perf_counter() - t0)
+    if not started and len(latencies) + args.warmup >= expected:
+      done.set()
+
+  for subject in scenario.replies:
+    await bus.subscribe(subject, cb=on_reply)
+  await runtime.start(bus=bus)
+
+  rng = random.Random(args.seed)
+  requests = [(f"{run_id}-warmup-{i}", scenario.make(f"{run_id}-warmup-{i}", rng)) for i in range(args.warmup)]
+  requests += [(f"{run_id}-{i}", scenario.make(f"{run_id}-{i}", rng)) for i in range(args.requests)]
+  payloads = [(rid, json.dumps(body).encode()) for rid, body in requests]
+
+  interval = 1 / args.rate if args.rate else 0
+  t_start = time.perf_counter()
+  for n, (rid, data) in enumerate(payloads):
+    if n == args.warmup:
+      t_start = time.perf_counter()
+    if interval:
+      delay = t_start + (n - args.warmup) * interval - time.perf_counter()
+      if delay > 0:
+        await asyncio.sleep(delay)
+    started[rid] = time.perf_counter()
+    await bus.publish(scenario.subject, data)
+    if n % 256 == 0:
+      await asyncio.sleep(0)
+  try:
+    await asyncio.wait_for(done.wait(), timeout=args.timeout)
+  except asyncio.TimeoutError:
+    pass
+  elapsed = time.perf_counter() - t_start
+  await runtime.stop()
+
+  return {
+    'scenario': name,
+    'worker': scenario.worker,
+    'subject': scenario.subject,
+    **summarize(latencies, elapsed),
+    'failures': failures,
+    'timeouts': len(started),
+    'peak_rss_mb': peak_rss_mb(),
+  }
+
+
+def git_commit() -> str | None:
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', 'HEAD'], cwd=WORKERS_DIR, capture_output=True, text=True, check=True,
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def spawn(name: str, args, scratch: str) -> dict:
+  scenario = SCENARIOS[name]
+  env = {
+    **os.environ,
+    'REPORT_STORE_DIR': os.path.join(scratch, 'reports'),
+    'LINK_DB_PATH': os.path.join(scratch, 'links.db'),
+    **scenario.env,
+  }
+  cmd = [
+    sys.executable, os.path.abspath(__file__), '--child', name,
+    '--requests', str(args.requests), '--warmup', str(args.warmup), '--rate', str(args.rate),
+    '--concurrency', str(args.concurrency), '--bus', args.bus, '--nats-url', args.nats_url,
+    '--seed', str(args.seed), '--timeout', str(args.timeout),
+  ]
+  proc = subprocess.run(cmd, env=env, cwd=scratch, capture_output=True, text=True)
+  if proc.returncode != 0:
+    sys.stderr.write(proc.stderr)
+    return {'scenario': name, 'worker': scenario.worker, 'error': proc.stderr.strip().splitlines()[-1:]}
+  return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+COLUMNS = ['scenario', 'count', 'ops_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'failures', 'timeouts', 'peak_rss_mb']
+
+
+def compare(old_path: str, new_path: str):
+  old = {r['scenario']: r for r in json.loads(Path(old_path).read_text())['results']}
+  new = {r['scenario']: r for r in json.loads(Path(new_path).read_text())['results']}
+  rows = []
+  for name in [n for n in new if n in old]:
+    row = {'scenario': name}
+    for metric in ('ops_per_s', 'p50_ms', 'p99_ms', 'peak_rss_mb'):
+      a, b = old[name].get(metric), new[name].get(metric)
+      change = f"{(b - a) / a:+.1%}" if a and b is not None else 'n/a'
+      row[metric] = f"{a} -> {b} ({change})"
+    rows.append(row)
+  print_table(rows, ['scenario', 'ops_per_s', 'p50_ms', 'p99_ms', 'peak_rss_mb'])
+
+
+def main(args):
+  if args.compare:
+    compare(*args.compare)
+    return
+  if args.child:
+    print(json.dumps(asyncio.run(run_scenario(args.child, args))))
+    return
+
+  names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+  unknown = [n for n in names if n not in SCENARIOS]
+  if unknown:
+    raise SystemExit(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+  results = []
+  with tempfile.TemporaryDirectory(prefix='worker-bench-') as scratch:
+    for name in names:
+      print(f"running {name} ...", file=sys.stderr)
+      results.append(spawn(name, args, scratch))
+  print_table(results, COLUMNS)
+
+  report = {
+    'commit': git_commit(),
+    'timestamp': datetime.now(timezone.utc).isoformat(),
+    'python': sys.version.split()[0],
+    'machine': platform.machine(),
+    'cpus': os.cpu_count(),
+    'config': {k: getattr(args, k) for k in ('bus', 'requests', 'warmup', 'rate', 'concurrency', 'seed')},
+    'results': results,
+  }
+  if args.output:
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(report, indent=2) + '\n')
+    print(f"results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--scenarios', help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+  parser.add_argument('--requests', type=int, default=500)
+  parser.add_argument('--warmup', type=int, default=20)
+  parser.add_argument('--rate', type=float, default=0, help='open-loop request rate per second (0 = as fast as possible)')
+  parser.add_argument('--concurrency', type=int, default=16, help='handler slots (WORKER_MAX_CONCURRENCY)')
+  parser.add_argument('--bus', choices=['memory', 'nats'], default='memory')
+  parser.add_argument('--nats-url', default=os.getenv('NATS_URL', 'nats://localhost:4222'))
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--timeout', type=float, default=300)
+  parser.add_argument('--output', help='write the run as JSON to this path')
+  parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two saved runs')
+  parser.add_argument('--child', help=argparse.SUPPRESS)
+  main(parser.parse_args())
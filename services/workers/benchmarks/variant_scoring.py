@@ -0,0 +1,70 @@
+"""generate-worker variant scoring: cost per variant by batch size.
+
+Scores synthetic variants (short tweets to long LinkedIn posts, with
+hashtags, links and the odd spammy phrase) with `score_batch`, one call per
+batch of `--sizes` variants, and reports microseconds per variant. Batch size
+1 is what scoring each variant on its own costs.
+"""
+import argparse
+import random
+import time
+
+from _common import print_table, summarize, use_worker
+
+use_worker('generate-worker')
+
+from app.scoring import PLATFORMS, score_batch  # noqa: E402
+
+
+def synthetic(rng: random.Random, n: int) -> tuple[list[str], list[str]]:
+  vocab = ("growth team launch customers insight strategy lesson engagement audience product "
+           "marketing simply build better every week thread story honestly learned measured results "
+           "conversion experiment community creators").split()
+  platforms = rng.choices(list(PLATFORMS), k=n)
+  contents = []
+  for platform in platforms:
+    sentences = [' '.join(rng.choices(vocab, k=rng.randint(5, 18))).capitalize() + rng.choice('.!?')
+                 for _ in range(rng.randint(1, 4 if platform in ('twitter', 'threads') else 12))]
+    tags = ' '.join('#' + rng.choice(vocab) for _ in range(rng.randint(0, 6)))
+    link = ' https://example.com/p' if rng.random() < 0.2 else ''
+    if rng.random() < 0.05:
+      sentences.insert(0, 'Click here, guaranteed results!!')
+    contents.append(' '.join(sentences) + link + ' ' + tags)
+  return contents, platforms
+
+
+def main(args):
+  rng = random.Random(19)
+  contents, platforms = synthetic(rng, max(args.sizes))
+  score_batch(contents[:10], platforms[:10])  # warm up
+  rows = []
+  for size in args.sizes:
+    latencies = []
+    t0 = time.perf_counter()
+    for _ in range(args.rounds):
+      for start in range(0, args.variants, size):
+        batch = [i % len(contents) for i in range(start, min(start + size, args.variants))]
+        began = time.perf_counter()
+        score_batch([contents[i] for i in batch], [platforms[i] for i in batch])
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - t0
+    stats = summarize(latencies, elapsed)
+    scored = args.variants * args.rounds
+    rows.append({
+      'batch': size,
+      'us_per_variant': round(elapsed / scored * 1e6, 2),
+      'variants_per_s': round(scored / elapsed),
+      'batch_p50_ms': stats['p50_ms'],
+      'batch_p99_ms': stats['p99_ms'],
+    })
+  print(f"{args.variants} variants × {args.rounds} rounds, mean length "
+        f"{sum(map(len, contents)) / len(contents):.0f} chars")
+  print_table(rows, ['batch', 'us_per_variant', 'variants_per_s', 'batch_p50_ms', 'batch_p99_ms'])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--variants', type=int, default=20_000)
+  parser.add_argument('--rounds', type=int, default=3)
+  parser.add_argument('--sizes', type=lambda s: [int(v) for v in s.split(',')], default=[1, 10, 100, 1000, 10_000])
+  main(parser.parse_args())
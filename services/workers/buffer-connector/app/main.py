@@ -1,25 +1,36 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
-import os
-import json
 import random
-from nats.aio.client import Client as NATS
+from worker_common import RetryLater, WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.http import PlatformHttp, bearer_headers
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
+from worker_common.ratelimit import RateLimiter, account_key
 
 
-class BufferPublishRequest(BaseModel):
+class BufferPublishRequest(Message, kw_only=True):
   request_id: str
+  brand_id: str | None = None  # echoed on publish.success for duplicate detection
   content: str
   profile_id: str
   credentials: dict
 
 
-class BufferPublishResponse(BaseModel):
+class BufferPublishResponse(Message):
   request_id: str
   external_id: str
+  connector: str = 'buffer'
+  brand_id: str | None = None
+  content: str | None = None
 
 
 app = FastAPI(title="Buffer/Hootsuite Connector", version="0.1.0")
+runtime = WorkerRuntime('buffer-connector')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+http = PlatformHttp('buffer')
+limiter = RateLimiter.from_env('buffer')
 
 
 @app.get('/health')
@@ -27,25 +38,46 @@ async def health():
   return {"status": "ok", "service": "buffer-connector"}
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    payload = json.loads(msg.data.decode())
-    req = BufferPublishRequest(**payload)
+async def publish_buffer(req: BufferPublishRequest) -> BufferPublishResponse:
+  if http.enabled:
+    form = {'profile_ids[]': req.profile_id, 'text': req.content, 'now': 'true'}
+    resp = await http.request('POST', '/1/updates/create.json', data=form, headers=bearer_headers(req.credentials))
+    resp.raise_for_status()
+    external_id = resp.json()['updates'][0]['id']
+  else:
     await asyncio.sleep(0.2)
-    resp = BufferPublishResponse(request_id=req.request_id, external_id=f"bf_{random.randint(1_000_000,9_999_999)}")
-    await nc.publish('publish.success', json.dumps(resp.model_dump()).encode())
-
-  await nc.subscribe('publish.buffer', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+    external_id = f"bf_{random.randint(1_000_000,9_999_999)}"
+  return BufferPublishResponse(request_id=req.request_id, external_id=external_id)
+
+
+@runtime.subscribe('publish.buffer', idempotent=True)
+async def handle_request(msg):
+  req = decode(msg.data, BufferPublishRequest)
+  try:
+    resp = await limiter.run(
+      account_key(req.credentials, req.profile_id),
+      lambda: publish_buffer(req),
+      attempt=runtime.attempt(msg),
+      attempts=runtime.config.max_deliver,
+    )
+  except RetryLater:
+    raise
+  except Exception as e:
+    await runtime.publish('publish.failed', encode({'request_id': req.request_id, 'connector': 'buffer', 'error': str(e)}))
+    return
+  if req.brand_id:
+    resp.brand_id, resp.content = req.brand_id, req.content
+  await runtime.publish('publish.success', encode(resp))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await http.start()
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  await http.close()
+  await limiter.close()
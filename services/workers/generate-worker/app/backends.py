@@ -0,0 +1,167 @@
+"""Generation backends and the micro-batcher that feeds them.
+
+Every variant to produce is a `VariantJob`. Handlers submit the jobs for one
+gen.request to the shared `MicroBatcher`, which coalesces jobs from all
+concurrent requests into a single `generate_batch()` call once the batch is
+full or the collection window closes, then routes each result back to the
+request that asked for it.
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class VariantJob:
+    platform: str
+    index: int
+    topic: str
+    language: str = "en"
+    tone: str | None = None
+    audience: str | None = None
+    voice_model_id: str | None = None
+
+
+class GenerationBackend:
+    """Produces the content for a batch of variant jobs, in order."""
+
+    name = "base"
+
+    async def generate_batch(self, jobs: list[VariantJob]) -> list[str]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StubBackend(GenerationBackend):
+    """Deterministic local backend with platform-tailored hooks.
+
+    `call_latency` and `item_latency` simulate the fixed round-trip cost of a
+    model call and the marginal cost per generated variant, so batching gains
+    can be measured without network access.
+    """
+
+    name = "stub"
+
+    hooks = {
+        "twitter": ["Quick tip:", "Thread:", "Hot take:", "Reminder:"],
+        "linkedin": ["Insight:", "Lesson learned:", "Worth knowing:", "Perspective:"],
+        "instagram": ["Did you know?", "Save this:", "Real talk:", "Swipe through:"],
+        "facebook": ["Update:", "Heads up:", "Good to know:", "Quick update:"],
+        "tiktok": ["Hot take:", "POV:", "Wait for it:", "Story time:"],
+        "youtube": ["Pro tip:", "In this video:", "Tutorial:", "Explained:"],
+        "threads": ["Thought:", "Hot take:", "Honestly:", "Question:"],
+        "pinterest": ["Idea:", "Inspiration:", "How to:", "Try this:"],
+    }
+
+    def __init__(self, call_latency: float = 0.0, item_latency: float = 0.0):
+        self.call_latency = call_latency
+        self.item_latency = item_latency
+        self.calls = 0
+
+    async def generate_batch(self, jobs: list[VariantJob]) -> list[str]:
+        self.calls += 1
+        delay = self.call_latency + self.item_latency * len(jobs)
+        if delay:
+            await asyncio.sleep(delay)
+        return [self._render(job) for job in jobs]
+
+    def _render(self, job: VariantJob) -> str:
+        options = self.hooks.get(job.platform, ["Note:"])
+        hook = options[job.index % len(options)]
+        return f"{hook} {job.topic}. Tailored for {job.platform}."
+
+
+BACKENDS: dict[str, type[GenerationBackend]] = {
+    StubBackend.name: StubBackend,
+}
+
+
+def get_backend(name: str | None = None) -> GenerationBackend:
+    name = name or os.getenv("GEN_BACKEND", StubBackend.name)
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown generation backend: {name}") from None
+
+
+class MicroBatcher:
+    """Coalesces jobs from concurrent requests into batched backend calls."""
+
+    def __init__(self, backend: GenerationBackend, max_batch: int = 32, window: float = 0.01, max_inflight: int = 4):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.window = window
+        self._pending: list[tuple[VariantJob, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.jobs = 0
+
+    @classmethod
+    def from_env(cls, backend: GenerationBackend | None = None) -> "MicroBatcher":
+        return cls(
+            backend or get_backend(),
+            max_batch=int(os.getenv("GEN_MAX_BATCH", "32")),
+            window=float(os.getenv("GEN_BATCH_WINDOW_MS", "10")) / 1000,
+            max_inflight=int(os.getenv("GEN_BACKEND_CONCURRENCY", "4")),
+        )
+
+    def enqueue(self, jobs: list[VariantJob]) -> list[asyncio.Future]:
+        """Queue `jobs` and return one future per job, resolved as its batch completes."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for job in jobs:
+            fut = loop.create_future()
+            self._pending.append((job, fut))
+            futures.append(fut)
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+        if self._pending and self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return futures
+
+    async def submit(self, jobs: list[VariantJob]) -> list[str]:
+        """Queue `jobs` and wait for their results, in submission order."""
+        return list(await asyncio.gather(*self.enqueue(jobs)))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[: self.max_batch]
+            del self._pending[: self.max_batch]
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[VariantJob, asyncio.Future]]):
+        async with self._inflight:
+            try:
+                results = await self.backend.generate_batch([job for job, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"backend returned {len(results)} results for {len(batch)} jobs")
+            except Exception as e:
+                logger.exception("generation batch of %d failed", len(batch))
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+        self.batches += 1
+        self.jobs += len(batch)
+        for (_, fut), content in zip(batch, results):
+            if not fut.done():
+                fut.set_result(content)
+
+    async def close(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.backend.close()
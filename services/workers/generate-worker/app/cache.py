@@ -0,0 +1,186 @@
+"""Content-addressed cache for generated variant content.
+
+Entries are stored per platform under a hash of the normalized request fields
+that influence generation, so a request for overlapping platforms reuses the
+platforms it shares with earlier requests. The in-process tier is an LRU with
+TTL and a byte budget; an optional SQLite file acts as a store shared by all
+worker processes on the host.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+
+ENTRY_OVERHEAD = 128  # rough per-entry cost of the key, tuple and list objects
+
+
+def _norm(value: str | None) -> str | None:
+    if value is None:
+        return None
+    return " ".join(value.split())
+
+
+def cache_key(
+    platform: str,
+    topic: str,
+    language: str,
+    num_variants: int,
+    tone: str | None = None,
+    audience: str | None = None,
+    voice_model_id: str | None = None,
+    constraints: dict | None = None,
+    backend: str = "",
+) -> str:
+    """Canonical hash of everything that changes the generated content for one platform."""
+    fields = {
+        "backend": backend,
+        "platform": platform.strip().lower(),
+        "topic": _norm(topic),
+        "language": language.strip().lower(),
+        "num_variants": num_variants,
+        "tone": (_norm(tone) or "").lower() or None,
+        "audience": _norm(audience),
+        "voice_model_id": voice_model_id,
+        "constraints": constraints or None,
+    }
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    shared_hits: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / total, 4) if total else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "hit_ratio": self.hit_ratio}
+
+
+class SqliteStore:
+    """Shared second tier: one SQLite file usable by every process on the host."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS gen_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("DELETE FROM gen_cache WHERE expires_at <= ?", (time.time(),))
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list[str], now: float) -> dict[str, list[str]]:
+        if not keys:
+            return {}
+        marks = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value FROM gen_cache WHERE key IN ({marks}) AND expires_at > ?", (*keys, now)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put_many(self, items: dict[str, list[str]], expires_at: float):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO gen_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(value), expires_at) for key, value in items.items()],
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+class GenerationCache:
+    """LRU + TTL cache of per-platform variant content with a memory budget."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600, store: SqliteStore | None = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, tuple[float, list[str], int]] = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "GenerationCache":
+        path = os.getenv("GEN_CACHE_SQLITE")
+        return cls(
+            max_bytes=int(os.getenv("GEN_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl=float(os.getenv("GEN_CACHE_TTL", "3600")),
+            store=SqliteStore(path) if path else None,
+        )
+
+    async def get_many(self, keys: list[str]) -> dict[str, list[str]]:
+        """Return cached content for the subset of `keys` that is present and fresh."""
+        now = time.time()
+        found: dict[str, list[str]] = {}
+        missing: list[str] = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._drop(key)
+                self.stats.expirations += 1
+                entry = None
+            if entry is None:
+                missing.append(key)
+                continue
+            self._entries.move_to_end(key)
+            found[key] = entry[1]
+
+        if missing and self.store is not None:
+            shared = await asyncio.to_thread(self.store.get_many, missing, now)
+            for key, value in shared.items():
+                self._insert(key, value, now + self.ttl)
+                found[key] = value
+            self.stats.shared_hits += len(shared)
+
+        self.stats.hits += len(found)
+        self.stats.misses += len(keys) - len(found)
+        return found
+
+    async def put_many(self, items: dict[str, list[str]]):
+        if not items:
+            return
+        expires_at = time.time() + self.ttl
+        for key, value in items.items():
+            self._insert(key, value, expires_at)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put_many, items, expires_at)
+
+    def _insert(self, key: str, value: list[str], expires_at: float):
+        size = ENTRY_OVERHEAD + sum(len(v) for v in value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (expires_at, value, size)
+        self.stats.bytes += size
+        self.stats.entries += 1
+        while self.stats.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.stats.evictions += 1
+
+    def _drop(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.stats.bytes -= size
+        self.stats.entries -= 1
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
@@ -0,0 +1,294 @@
+"""Near-duplicate detection for generated variants (MinHash + LSH per brand).
+
+Content is normalized (case-folded, punctuation dropped, whitespace
+collapsed) and shingled into word bigrams (character 5-grams for texts of
+fewer than five words). A MinHash signature of `permutations` 32-bit values
+estimates the Jaccard similarity of two shingle sets as the share of equal
+positions.
+
+Each brand has its own index of signatures for published posts and for
+variants generated earlier. Signatures are split into `bands` bands whose
+hashes go into one sorted key array (plus a small dict of recent inserts,
+merged once it grows), so a lookup is one vectorized binary search for all
+bands followed by an exact signature comparison of the few candidates.
+Generated entries carry a tag of the brief they were generated for and never
+count as history for that same brief, so retries and cache hits do not trip
+over their own output.
+
+Every brand index is an append-only file of (tag, signature) rows under
+`root`, loaded on first use; without a `root` the indexes live in memory.
+
+The default threshold of 0.95 only catches (near-)verbatim repeats: variants
+of one topic from the stub backend's platform templates differ in their
+opening hook and stay below it for topics of up to about 15 words.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+_PRIME = np.uint64((1 << 61) - 1)
+_WORD = re.compile(r"\w+")
+PUBLISHED = 0  # tag of published posts
+
+
+def shingles(text: str) -> set[str]:
+    words = _WORD.findall(text.casefold())
+    if len(words) >= 5:
+        return {f"{a} {b}" for a, b in zip(words, words[1:])}
+    joined = " ".join(words)
+    return {joined[i:i + 5] for i in range(max(len(joined) - 4, 1))}
+
+
+def tag_for(key: str | None) -> int:
+    """Non-zero 32-bit tag of a brief (0 is reserved for published posts)."""
+    if not key:
+        return 0xFFFFFFFF
+    return zlib.crc32(key.encode()) or 1
+
+
+class MinHasher:
+    def __init__(self, permutations: int = 64, bands: int = 16, seed: int = 1):
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+        self.permutations = permutations
+        self.bands = bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), size=(permutations, 1), dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=(permutations, 1), dtype=np.uint64)
+        rows = permutations // bands
+        self._mix = rng.integers(1, 1 << 63, size=(bands, rows), dtype=np.uint64) | np.uint64(1)
+        self._salt = rng.integers(0, 1 << 63, size=bands, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashed = np.fromiter((zlib.crc32(s.encode()) for s in shingles(text)), dtype=np.uint64)
+        if not len(hashed):
+            hashed = np.zeros(1, dtype=np.uint64)
+        # (a·x + b) mod (2^61 - 1) with the product wrapping at 2^64, truncated to 32 bits.
+        with np.errstate(over="ignore"):
+            values = (self._a * hashed + self._b) % _PRIME
+        return (values.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """One 32-bit key per band for each signature row (n × bands)."""
+        rows = signatures.reshape(len(signatures), self.bands, -1).astype(np.uint64)
+        with np.errstate(over="ignore"):
+            mixed = (rows * self._mix).sum(axis=2) + self._salt
+        return (mixed >> np.uint64(32)).astype(np.uint32)
+
+
+def similarity(signature: np.ndarray, signatures: np.ndarray) -> np.ndarray:
+    return (signatures == signature).mean(axis=1)
+
+
+class BrandIndex:
+    """Signatures of one brand with an LSH lookup."""
+
+    def __init__(self, hasher: MinHasher, path: Path | None = None, merge_min: int = 4096):
+        self.hasher = hasher
+        self.path = path
+        self.merge_min = merge_min
+        self._sigs = np.zeros((0, hasher.permutations), dtype=np.uint32)
+        self._tags = np.zeros(0, dtype=np.uint32)
+        self.size = 0
+        self._keys = np.zeros(0, dtype=np.uint32)  # sorted band keys
+        self._ids = np.zeros(0, dtype=np.uint32)  # entry of each key
+        self._recent: dict[int, list[int]] = {}
+        self._recent_count = 0
+        self._file = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._load()
+            self._file = open(path, "ab")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        width = self.hasher.permutations + 1
+        raw = np.fromfile(self.path, dtype=np.uint32)
+        complete = len(raw) // width * width
+        if complete < len(raw):
+            logger.warning("dedupe index %s: dropping a torn record", self.path)
+            with open(self.path, "r+b") as f:
+                f.truncate(complete * 4)
+        rows = raw[:complete].reshape(-1, width)
+        self._append(rows[:, 0], rows[:, 1:])
+        self._merge()
+
+    def _append(self, tags: np.ndarray, signatures: np.ndarray) -> np.ndarray:
+        n = len(tags)
+        if self.size + n > len(self._tags):
+            capacity = max(1024, self.size + n + self.size // 2)
+            sigs = np.zeros((capacity, self.hasher.permutations), dtype=np.uint32)
+            sigs[:self.size] = self._sigs[:self.size]
+            tags_ = np.zeros(capacity, dtype=np.uint32)
+            tags_[:self.size] = self._tags[:self.size]
+            self._sigs, self._tags = sigs, tags_
+        ids = np.arange(self.size, self.size + n, dtype=np.uint32)
+        self._sigs[self.size:self.size + n] = signatures
+        self._tags[self.size:self.size + n] = tags
+        self.size += n
+        return ids
+
+    def _merge(self):
+        """Rebuild the sorted key array from every entry."""
+        keys = self.hasher.band_keys(self._sigs[:self.size]).ravel()
+        ids = np.repeat(np.arange(self.size, dtype=np.uint32), self.hasher.bands)
+        order = np.argsort(keys, kind="stable")
+        self._keys, self._ids = keys[order], ids[order]
+        self._recent.clear()
+        self._recent_count = 0
+
+    def add_many(self, signatures: np.ndarray, tags: list[int], persist: bool = True):
+        if not len(signatures):
+            return
+        tags = np.asarray(tags, dtype=np.uint32)
+        ids = self._append(tags, signatures)
+        if self._recent_count + len(ids) > max(self.merge_min, self.size // 8):
+            self._merge()
+        else:
+            for entry, keys in zip(ids.tolist(), self.hasher.band_keys(signatures).tolist()):
+                for key in keys:
+                    self._recent.setdefault(key, []).append(entry)
+            self._recent_count += len(ids)
+        if persist and self._file is not None:
+            self._file.write(np.column_stack([tags, signatures]).astype(np.uint32).tobytes())
+            self._file.flush()
+
+    def nearest(self, signature: np.ndarray, threshold: float, ignore_tag: int | None = None) -> tuple[int, float] | None:
+        """Closest entry with estimated Jaccard ≥ threshold, skipping entries tagged `ignore_tag`."""
+        keys = self.hasher.band_keys(signature[None, :])[0]
+        lo = np.searchsorted(self._keys, keys, side="left")
+        hi = np.searchsorted(self._keys, keys, side="right")
+        parts = [self._ids[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a]
+        for key in keys.tolist():
+            recent = self._recent.get(key)
+            if recent:
+                parts.append(np.asarray(recent, dtype=np.uint32))
+        if not parts:
+            return None
+        candidates = np.unique(np.concatenate(parts))
+        if ignore_tag is not None:
+            candidates = candidates[self._tags[candidates] != ignore_tag]
+            if not len(candidates):
+                return None
+        scores = similarity(signature, self._sigs[candidates])
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        return int(candidates[best]), float(scores[best])
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class DuplicateIndex:
+    """Brand indexes under `root`, opened on first use."""
+
+    def __init__(self, root: str | Path | None, threshold: float = 0.95, permutations: int = 64, bands: int = 16):
+        self.root = Path(root) if root else None
+        self.threshold = threshold
+        self.hasher = MinHasher(permutations, bands)
+        self._brands: dict[str, BrandIndex] = {}
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "DuplicateIndex":
+        return cls(
+            os.getenv("GEN_DEDUPE_DIR", ""),
+            threshold=float(os.getenv("GEN_DEDUPE_THRESHOLD", "0.95")),
+            permutations=int(os.getenv("GEN_DEDUPE_PERMUTATIONS", "64")),
+            bands=int(os.getenv("GEN_DEDUPE_BANDS", "16")),
+        )
+
+    def _path(self, brand_id: str) -> Path | None:
+        if self.root is None:
+            return None
+        name = brand_id if re.fullmatch(r"[\w.-]{1,64}", brand_id) and not brand_id.startswith(".") else \
+            hashlib.blake2b(brand_id.encode(), digest_size=12).hexdigest()
+        return self.root / f"{name}.p{self.hasher.permutations}b{self.hasher.bands}.sig"
+
+    def brand(self, brand_id: str) -> BrandIndex:
+        with self._lock:
+            index = self._brands.get(brand_id)
+            if index is None:
+                index = self._brands[brand_id] = BrandIndex(self.hasher, self._path(brand_id))
+            return index
+
+    def signature(self, text: str) -> np.ndarray:
+        return self.hasher.signature(text)
+
+    def add(self, brand_id: str, texts: list[str], tag: int = PUBLISHED, persist: bool = True):
+        if texts:
+            signatures = np.stack([self.hasher.signature(text) for text in texts])
+            self.brand(brand_id).add_many(signatures, [tag] * len(texts), persist)
+
+    def stats(self) -> dict:
+        return {
+            "brands": len(self._brands),
+            "entries": sum(index.size for index in self._brands.values()),
+            "checked": self.checked,
+            "rejected": self.rejected,
+        }
+
+    def close(self):
+        for index in self._brands.values():
+            index.close()
+
+
+class RequestDeduper:
+    """Checks the variants of one request against the other variants for the
+    same platform and against the brand's history."""
+
+    def __init__(self, index: DuplicateIndex, brand_id: str, brief_id: str):
+        self.index = index
+        self.brand = index.brand(brand_id)
+        self.tag = tag_for(brief_id)
+        self.threshold = index.threshold
+        self.rejected = 0
+        self._siblings: dict[str, list[np.ndarray]] = {}
+        self._unique: list[np.ndarray] = []
+
+    def check(self, platform: str, content: str) -> tuple[np.ndarray, float]:
+        """Signature of `content` and its highest estimated similarity to the
+        variants kept for `platform` and to the brand's history."""
+        signature = self.index.signature(content)
+        self.index.checked += 1
+        score = 0.0
+        siblings = self._siblings.get(platform)
+        if siblings:
+            score = float(similarity(signature, np.stack(siblings)).max())
+        if score < self.threshold:
+            nearest = self.brand.nearest(signature, score, ignore_tag=self.tag)
+            if nearest is not None:
+                score = max(score, nearest[1])
+        return signature, score
+
+    def keep(self, platform: str, signature: np.ndarray, duplicate: bool = False):
+        """Count a variant as kept; later variants for `platform` are compared with it."""
+        self._siblings.setdefault(platform, []).append(signature)
+        if not duplicate:
+            self._unique.append(signature)
+
+    def reject(self):
+        self.rejected += 1
+        self.index.rejected += 1
+
+    def commit(self):
+        """Record the variants kept as unique as generated history of this brief."""
+        # Re-runs of a brief produce the same content; keep one copy of it.
+        new = [s for s in self._unique if self.brand.nearest(s, 1.0) is None]
+        if new:
+            self.brand.add_many(np.stack(new), [self.tag] * len(new))
@@ -1,15 +1,24 @@
 from fastapi import FastAPI
-from pydantic import BaseModel, Field
 import asyncio
 import os
-import json
+from collections.abc import AsyncIterator
+from dataclasses import replace
 from datetime import datetime
-from nats.aio.client import Client as NATS
 import re
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode, replace as replace_message
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
+from worker_common.voice import VoiceModel, VoiceModels
 
+from app.backends import MicroBatcher, VariantJob
+from app.cache import GenerationCache, cache_key
+from app.dedupe import DuplicateIndex, RequestDeduper
+from app.scoring import score_batch
 
-class GenerateRequest(BaseModel):
-    request_id: str = Field(..., description="Correlation/request ID")
+
+class GenerateRequest(Message, kw_only=True):
+    request_id: str  # correlation/request ID
     brief_id: str
     brand_id: str
     voice_model_id: str | None = None
@@ -20,24 +29,59 @@ class GenerateRequest(BaseModel):
     audience: str | None = None
     tone: str | None = None
     constraints: dict | None = None
+    stream: bool = False  # publish each variant on gen.partial as soon as it is ready
 
 
-class Variant(BaseModel):
+class Variant(Message):
     platform: str
     content: str
     language: str
     hashtags: list[str] = []
     score: dict = {}
+    # Similarity to earlier content when no distinct variant was generated in time.
+    near_duplicate: float | None = None
 
 
-class GenerateResponse(BaseModel):
+class GenerateResponse(Message):
     request_id: str
     brief_id: str
     variants: list[Variant]
     generated_at: str
+    # Streaming summaries carry no variants; oversized responses are split
+    # into parts that all carry total_variants.
+    streamed: bool = False
+    total_variants: int | None = None
+    part: int | None = None
+    parts: int | None = None
+    duplicates_rejected: int | None = None
+    duplicates_kept: int | None = None
+
+
+class PublishedPost(Message):
+    """The fields of a publish.success message the dedupe index needs."""
+    brand_id: str | None = None
+    content: str | None = None
+
+
+class GeneratePartial(Message):
+    request_id: str
+    brief_id: str
+    seq: int
+    variant: Variant
 
 
 app = FastAPI(title="Generate Worker", version="0.1.0")
+runtime = WorkerRuntime("generate-worker")
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+batcher = MicroBatcher.from_env()
+cache = GenerationCache.from_env()
+voices = VoiceModels.from_env()
+dedupe = DuplicateIndex.from_env()
+DEDUPE_RETRIES = int(os.getenv("GEN_DEDUPE_RETRIES", "2"))
+
+# Room left in max_payload for the subject, headers and protocol framing.
+PAYLOAD_HEADROOM = 4096
 
 
 @app.get("/health")
@@ -45,77 +89,314 @@ async def health():
     return {"status": "ok", "service": "generate-worker"}
 
 
-async def start_nats_loop():
-    nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-    nc = NATS()
-    await nc.connect(servers=[nats_url])
-
-    async def handle_gen_request(msg):
-        try:
-            payload = json.loads(msg.data.decode())
-            req = GenerateRequest(**payload)
-
-            # Stub generation: create simple variants with platform-tailored hooks
-            hooks = {
-                "twitter": "Quick tip:",
-                "linkedin": "Insight:",
-                "instagram": "Did you know?",
-                "facebook": "Update:",
-                "tiktok": "Hot take:",
-                "youtube": "Pro tip:",
-                "threads": "Thought:",
-                "pinterest": "Idea:",
-            }
-
-            variants: list[Variant] = []
-            for platform in req.platforms:
-                for i in range(req.num_variants):
-                    hook = hooks.get(platform, "Note:")
-                    content = f"{hook} {req.topic}. Tailored for {platform}."
-                    # naive hashtag extraction
-                    hashtags = [t.strip('#') for t in re.findall(r"#(\w+)", content)]
-                    # basic scoring (keep in sync with TS scoring heuristics at high level)
-                    score = {
-                        "brandFit": 0.8,
-                        "readability": 0.85,
-                        "policyRisk": 0.9,
-                        "overall": 0.85,
-                    }
-                    variants.append(
-                        Variant(
-                            platform=platform,
-                            content=content,
-                            language=req.language,
-                            hashtags=hashtags,
-                            score=score,
-                        )
-                    )
-
-            resp = GenerateResponse(
+@app.get("/cache/stats")
+async def cache_stats():
+    return cache.stats.as_dict()
+
+
+@app.get("/dedupe/stats")
+async def dedupe_stats():
+    return dedupe.stats()
+
+
+def build_variants(
+    req: GenerateRequest,
+    items: list[tuple[str, str]],
+    voice: VoiceModel | None = None,
+    duplicates: list[float | None] | None = None,
+) -> list[Variant]:
+    """Variants for (platform, content) pairs, scored together in one batch."""
+    fits = [voice.score(content) for _, content in items] if voice is not None else None
+    scores = score_batch(
+        [content for _, content in items],
+        [platform for platform, _ in items],
+        [fit["brandFit"] for fit in fits] if fits is not None else None,
+    )
+    variants = []
+    for i, ((platform, content), score) in enumerate(zip(items, scores)):
+        if fits is not None:
+            score["voice"] = fits[i]
+        variants.append(Variant(
+            platform=platform,
+            content=content,
+            language=req.language,
+            # naive hashtag extraction
+            hashtags=[t.strip('#') for t in re.findall(r"#(\w+)", content)],
+            score=score,
+            near_duplicate=duplicates[i] if duplicates is not None else None,
+        ))
+    return variants
+
+
+def split_response(resp: GenerateResponse, limit: int) -> list[GenerateResponse]:
+    """Split `resp` into parts whose encoded size stays under `limit` bytes."""
+    envelope = replace_message(resp, variants=[], total_variants=10**9, part=10**9, parts=10**9)
+    budget = limit - len(encode(envelope))
+    chunks: list[list[Variant]] = [[]]
+    used = 0
+    for variant in resp.variants:
+        size = len(encode(variant)) + 1
+        if chunks[-1] and used + size > budget:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(variant)
+        used += size
+    return [
+        replace_message(resp, variants=chunk, total_variants=len(resp.variants), part=i, parts=len(chunks))
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+async def publish_response(resp: GenerateResponse):
+    data = encode(resp)
+    limit = runtime.max_payload - PAYLOAD_HEADROOM
+    if len(data) <= limit:
+        await runtime.publish("gen.complete", data)
+        return
+    for part in split_response(resp, limit):
+        await runtime.publish("gen.complete", encode(part))
+
+
+def retry_job(req: GenerateRequest, job: VariantJob) -> VariantJob | None:
+    """The job regenerating a rejected variant, or None once retries are used up."""
+    if job.index // req.num_variants >= DEDUPE_RETRIES:
+        return None
+    return replace(job, index=job.index + req.num_variants)
+
+
+async def unique_variants(
+    req: GenerateRequest,
+    platforms: list[str],
+    ready: dict[str, list[str]],
+    jobs: list[VariantJob],
+    deduper: RequestDeduper | None,
+    raw: dict[VariantJob, str | None],
+) -> AsyncIterator[tuple[str, int, str, float | None]]:
+    """Yield `(platform, slot, content, duplicate)` for every variant slot.
+
+    Cached content comes first, then backend output as its batches complete.
+    A near-duplicate is regenerated (the next job index) while retries last;
+    after that the least similar candidate of its slot is kept anyway, with
+    `duplicate` set to its similarity, so every slot yields exactly once.
+    Backend output for the jobs in `raw` is recorded there (see `cacheable`).
+    """
+    candidates: dict[tuple[str, int], tuple[float, str, object]] = {}
+
+    def settle(job: VariantJob, content: str):
+        """The variant for `job`'s slot, or the job regenerating it."""
+        slot = job.index % req.num_variants
+        if deduper is None:
+            return (job.platform, slot, content, None), None
+        signature, score = deduper.check(job.platform, content)
+        if score < deduper.threshold:
+            deduper.keep(job.platform, signature)
+            return (job.platform, slot, content, None), None
+        deduper.reject()
+        key = (job.platform, slot)
+        if key not in candidates or score < candidates[key][0]:
+            candidates[key] = (score, content, signature)
+        retry = retry_job(req, job)
+        if retry is not None:
+            return None, retry
+        score, content, signature = candidates.pop(key)
+        deduper.keep(job.platform, signature, duplicate=True)
+        return (job.platform, slot, content, round(score, 4)), None
+
+    jobs = list(jobs)
+    for platform in platforms:
+        for i, content in enumerate(ready.get(platform, [])):
+            variant, retry = settle(new_job(req, platform, i), content)
+            if variant is not None:
+                yield variant
+            if retry is not None:
+                jobs.append(retry)
+
+    pending = dict(zip(batcher.enqueue(jobs), jobs))
+    position = {fut: i for i, fut in enumerate(pending)}
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        retries = []
+        for fut in sorted(done, key=position.get):
+            job = pending.pop(fut)
+            content = fut.result()
+            if job in raw:
+                raw[job] = content
+            variant, retry = settle(job, content)
+            if variant is not None:
+                yield variant
+            if retry is not None:
+                retries.append(retry)
+        for fut, job in zip(batcher.enqueue(retries), retries):
+            pending[fut] = job
+            position[fut] = len(position)
+
+
+async def stream_variants(
+    req: GenerateRequest,
+    platforms: list[str],
+    ready: dict[str, list[str]],
+    jobs: list[VariantJob],
+    voice: VoiceModel | None = None,
+    deduper: RequestDeduper | None = None,
+) -> tuple[int, int, dict[str, list[str]]]:
+    """Publish cached variants, then fresh ones as their batches complete.
+
+    Returns the number of variants streamed, how many of them are kept
+    near-duplicates, and the backend output for `jobs` (see `cacheable`).
+    """
+    seq = duplicates = 0
+    raw = {job: None for job in jobs}
+    async for platform, _, content, duplicate in unique_variants(req, platforms, ready, jobs, deduper, raw):
+        partial = GeneratePartial(
+            request_id=req.request_id,
+            brief_id=req.brief_id,
+            seq=seq,
+            variant=build_variants(req, [(platform, content)], voice, [duplicate])[0],
+        )
+        seq += 1
+        duplicates += duplicate is not None
+        await runtime.publish("gen.partial", encode(partial))
+    return seq, duplicates, cacheable(raw)
+
+
+async def generate_unique(
+    req: GenerateRequest,
+    platforms: list[str],
+    ready: dict[str, list[str]],
+    jobs: list[VariantJob],
+    deduper: RequestDeduper | None = None,
+) -> tuple[list[tuple[str, str, float | None]], dict[str, list[str]]]:
+    """`(platform, content, duplicate)` for every variant slot, in platform and
+    slot order, and the backend output for `jobs` (see `cacheable`)."""
+    raw = {job: None for job in jobs}
+    slots = {}
+    async for platform, slot, content, duplicate in unique_variants(req, platforms, ready, jobs, deduper, raw):
+        slots[platform, slot] = (platform, content, duplicate)
+    order = {platform: i for i, platform in enumerate(platforms)}
+    return [slots[key] for key in sorted(slots, key=lambda key: (order[key[0]], key[1]))], cacheable(raw)
+
+
+def cacheable(raw: dict[VariantJob, str | None]) -> dict[str, list[str]]:
+    """Backend output per platform as generated, before dedupe and regeneration.
+
+    The cache key leaves out the brief, so what is cached must not depend on
+    it: entries hold the first-round output for a platform, and every request
+    dedupes them against its own brief again.
+    """
+    by_platform: dict[str, dict[int, str]] = {}
+    for job, content in raw.items():
+        if content is not None:
+            by_platform.setdefault(job.platform, {})[job.index] = content
+    return {p: [by_index[i] for i in sorted(by_index)] for p, by_index in by_platform.items()}
+
+
+def new_job(req: GenerateRequest, platform: str, index: int) -> VariantJob:
+    return VariantJob(
+        platform=platform,
+        index=index,
+        topic=" ".join(req.topic.split()),
+        language=req.language,
+        tone=req.tone,
+        audience=req.audience,
+        voice_model_id=req.voice_model_id,
+    )
+
+
+@runtime.subscribe("gen.request", idempotent=True)
+async def handle_gen_request(msg):
+    try:
+        req = decode(msg.data, GenerateRequest)
+        platforms = list(dict.fromkeys(req.platforms))
+        voice = voices.get(req.voice_model_id)
+        deduper = RequestDeduper(dedupe, req.brand_id, req.brief_id)
+
+        keys = {
+            platform: cache_key(
+                platform,
+                topic=req.topic,
+                language=req.language,
+                num_variants=req.num_variants,
+                tone=req.tone,
+                audience=req.audience,
+                voice_model_id=req.voice_model_id,
+                constraints=req.constraints,
+                backend=batcher.backend.name,
+            )
+            for platform in platforms
+        }
+        cached = await cache.get_many(list(keys.values()))
+        ready = {p: cached[k] for p, k in keys.items() if k in cached}
+
+        jobs = [
+            new_job(req, platform, i)
+            for platform in platforms
+            if platform not in ready
+            for i in range(req.num_variants)
+        ]
+
+        if req.stream:
+            total, duplicates, fresh = await stream_variants(req, platforms, ready, jobs, voice, deduper)
+            deduper.commit()
+            await cache.put_many({keys[p]: contents for p, contents in fresh.items()})
+            summary = GenerateResponse(
                 request_id=req.request_id,
                 brief_id=req.brief_id,
-                variants=variants,
+                variants=[],
                 generated_at=datetime.utcnow().isoformat(),
+                streamed=True,
+                total_variants=total,
+                duplicates_rejected=deduper.rejected,
+                duplicates_kept=duplicates,
             )
+            await runtime.publish("gen.complete", encode(summary))
+            return
+
+        items, fresh = await generate_unique(req, platforms, ready, jobs, deduper)
+        deduper.commit()
+        await cache.put_many({keys[p]: contents for p, contents in fresh.items()})
 
-            await nc.publish("gen.complete", json.dumps(resp.model_dump()).encode())
+        variants = build_variants(
+            req,
+            [(platform, content) for platform, content, _ in items],
+            voice,
+            [duplicate for _, _, duplicate in items],
+        )
+        resp = GenerateResponse(
+            request_id=req.request_id,
+            brief_id=req.brief_id,
+            variants=variants,
+            generated_at=datetime.utcnow().isoformat(),
+            duplicates_rejected=deduper.rejected,
+            duplicates_kept=sum(duplicate is not None for _, _, duplicate in items),
+        )
+        await publish_response(resp)
 
-        except Exception as e:
-            err = {
-                "error": str(e),
-                "payload": msg.data.decode(errors="ignore"),
-            }
-            await nc.publish("gen.failed", json.dumps(err).encode())
+    except Exception as e:
+        err = {
+            "error": str(e),
+            "payload": msg.data.decode(errors="ignore"),
+        }
+        await runtime.publish("gen.failed", encode(err))
 
-    await nc.subscribe("gen.request", cb=handle_gen_request)
 
-    # Keep running
-    while True:
-        await asyncio.sleep(3600)
+# Every process keeps the whole published history in memory, so this fans out;
+# the first process of the host appends it to the shared signature files.
+@runtime.subscribe("publish.success", durable=False)
+async def handle_published(msg):
+    # Connectors echo brand_id and content for posts that carry a brand.
+    post = decode(msg.data, PublishedPost)
+    if post.brand_id and post.content:
+        dedupe.add(post.brand_id, [post.content], persist=os.getenv("WORKER_PROCESS_INDEX", "0") == "0")
 
 
 @app.on_event("startup")
 async def on_startup():
-    asyncio.create_task(start_nats_loop())
+    await runtime.start()
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await runtime.stop()
+    await batcher.close()
+    cache.close()
+    dedupe.close()
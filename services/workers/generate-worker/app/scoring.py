@@ -0,0 +1,206 @@
+"""Batched variant scoring.
+
+`score_batch` scores every variant of a request in one pass. All texts are
+joined into one byte array and classified with shared precomputed 256-entry
+lookup tables; words, vowel groups (syllables), sentence ends, hashtags,
+links and shouting are found with shifted array comparisons, aggregated per
+word and per text with `bincount`, and turned into scores with NumPy array
+arithmetic over the whole batch. No Python code runs per word or per
+character, so the cost per variant shrinks as batches grow.
+
+Scores (all 0..1, higher is better):
+
+- readability: Flesch reading ease from words per sentence and syllables per
+  word, mapped from 0..100
+- lengthFit: 1 inside the platform's ideal length range, falling off
+  linearly towards zero length and towards the hard limit, 0 beyond it
+- hashtagFit: 1 inside the platform's ideal hashtag count, lower for more or
+  fewer and for hashtag-stuffed text, 0 above the platform maximum
+- policyRisk: 1 - risk, where spammy phrases, links, excess hashtags,
+  shouting and exclamation runs add risk (as in packages/shared scoring.ts)
+- overall: weighted like `computeOverallScore` in packages/shared scoring.ts
+"""
+import string
+
+import numpy as np
+
+
+# (ideal min chars, ideal max chars, hard limit, ideal min hashtags, ideal max hashtags, max hashtags)
+PLATFORMS: dict[str, tuple[int, int, int, int, int, int]] = {
+    "twitter": (70, 200, 280, 1, 2, 3),
+    "linkedin": (150, 1300, 3000, 1, 3, 5),
+    "instagram": (100, 1000, 2200, 3, 11, 30),
+    "facebook": (40, 250, 63206, 0, 2, 10),
+    "tiktok": (50, 300, 2200, 2, 5, 100),
+    "youtube": (200, 2000, 5000, 1, 3, 15),
+    "threads": (50, 300, 500, 0, 2, 10),
+    "pinterest": (100, 300, 500, 2, 5, 20),
+}
+DEFAULT_PLATFORM = (50, 500, 2200, 0, 3, 10)
+
+PLATFORM_IDS = {name: i for i, name in enumerate(PLATFORMS)}
+_TABLE = np.array(list(PLATFORMS.values()) + [DEFAULT_PLATFORM], dtype=np.float64)
+
+SPAM_PHRASES = [p.encode() for p in ("free money", "click here", "guaranteed", "buy now", "act now", "limited time", "100% free", "risk free")]
+
+# Character classes of every byte as bits of one lookup table, placed so that
+# the per-byte word features below come out of a few shifts and masks. UTF-8
+# lead and continuation bytes (>= 0x80) continue words so accented words stay
+# whole; only ASCII letters make a token count as a word.
+_VOWEL, _E, _LETTER, _UPPER, _SILENT_AFTER, _WORDISH = 1, 2, 4, 8, 64, 128
+
+
+def _classes() -> np.ndarray:
+    table = np.zeros(256, dtype=np.uint8)
+    for chars, bits in (
+        (string.ascii_letters, _LETTER | _WORDISH),
+        (string.ascii_uppercase, _UPPER),
+        ("aeiouyAEIOUY", _VOWEL),
+        ("eE", _E),
+        ("bcdfghjkmnpqrstvwxzBCDFGHJKMNPQRSTVWXZ", _SILENT_AFTER),  # a final e after these is silent
+        ("'", _WORDISH),
+    ):
+        table[list(chars.encode())] |= bits
+    table[128:] |= _WORDISH
+    return table
+
+
+_CLASSES = _classes()
+# Per-byte word features (vowel-group start, silent e, letter, uppercase: bits
+# 0-3 of the feature code) as 16-bit fields of one integer, so a single
+# reduceat sums all four per word.
+_FIELDS = np.array([sum(((code >> i) & 1) << (16 * i) for i in range(4)) for code in range(16)], dtype=np.uint64)
+_TAG_CHAR = np.zeros(256, dtype=bool)
+_TAG_CHAR[list((string.ascii_letters + string.digits + "_").encode())] = True
+_TAG_CHAR[128:] = True
+_BREAK = np.zeros(256, dtype=bool)
+_BREAK[list(b" \t\r\n\0")] = True
+
+
+def _find_all(haystack: bytes, needle: bytes) -> list[int]:
+    found, at = [], haystack.find(needle)
+    while at >= 0:
+        found.append(at)
+        at = haystack.find(needle, at + 1)
+    return found
+
+
+def _clip(values: np.ndarray) -> np.ndarray:
+    return np.clip(values, 0.0, 1.0)
+
+
+def text_stats(contents: list[str]) -> dict[str, np.ndarray]:
+    """Per-text counts for a batch, computed over one byte array of all texts."""
+    n = len(contents)
+    encoded = [text.encode() for text in contents]
+    joined = b"\0".join(encoded)
+    ends = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=n) + 1)
+    raw = np.frombuffer(b"\0" + joined + b"\0", dtype=np.uint8)
+    cls = _CLASSES.take(raw)
+    cur, prev, nxt = cls[1:-1], cls[:-2], cls[2:]
+
+    def per_text(positions) -> np.ndarray:
+        return np.bincount(np.searchsorted(ends, positions, side="right"), minlength=n).astype(np.float64)
+
+    def positions(*chars: str) -> np.ndarray:
+        """Positions in `joined` of any of `chars` (each shifted by one in `raw`)."""
+        mask = raw == ord(chars[0])
+        for char in chars[1:]:
+            mask |= raw == ord(char)
+        return np.flatnonzero(mask) - 1
+
+    # Words, with the vowel groups and silent final e that estimate syllables.
+    starts = np.flatnonzero(cur & ~prev & _WORDISH)
+    code = (cur & ~prev & _VOWEL) | (cur & (prev >> 5) & ~(nxt >> 6) & _E) | (cur & (_LETTER | _UPPER))
+    fields = np.add.reduceat(_FIELDS.take(code), starts) if len(starts) else np.zeros(0, dtype=np.uint64)
+    groups, silent, letters, upper = ((fields >> np.uint64(16 * i)) & np.uint64(0xFFFF) for i in range(4))
+    syllables = np.maximum(groups.astype(np.int64) - silent * (groups > 1), 1)
+    real = letters > 0
+    word_text = np.searchsorted(ends, starts, side="right")
+    shouting = real & (upper == letters) & (letters >= 4)
+
+    # Sparse features: find the few candidate bytes, then check their neighbours.
+    ends_at = positions(".", "!", "?")
+    ends_at = ends_at[(raw[ends_at + 2] != ord(".")) & (raw[ends_at + 2] != ord("!")) & (raw[ends_at + 2] != ord("?"))]
+    sentence_ends = ends_at[_BREAK[raw[ends_at + 2]]]
+    newlines = positions("\n")
+    newline_runs = newlines[~np.isin(raw[newlines], np.frombuffer(b"\n.!?", dtype=np.uint8))]
+    hashes = positions("#")
+    bangs = positions("!", "?")
+    bang_after = (raw[bangs + 2] == ord("!")) | (raw[bangs + 2] == ord("?"))
+    bang_before = (raw[bangs] == ord("!")) | (raw[bangs] == ord("?"))
+
+    # Phrases are searched with bytes.find, which is much faster than a regex
+    # alternation; each phrase counts once per text.
+    lowered = joined.lower()
+    spam = np.zeros(n)
+    for phrase in SPAM_PHRASES:
+        found = _find_all(lowered, phrase)
+        if found:
+            spam[np.unique(np.searchsorted(ends, found, side="right"))] += 1
+
+    return {
+        "chars": np.fromiter(map(len, contents), dtype=np.float64, count=n),
+        "words": np.bincount(word_text[real], minlength=n).astype(np.float64),
+        "syllables": np.bincount(word_text[real], weights=syllables[real], minlength=n),
+        "sentences": per_text(sentence_ends) + per_text(newline_runs),
+        "hashtags": per_text(hashes[_TAG_CHAR[raw[hashes + 2]]]),
+        "urls": per_text(_find_all(lowered, b"http://") + _find_all(lowered, b"https://")),
+        "shouting": np.bincount(word_text[shouting], minlength=n).astype(np.float64),
+        "bang_runs": per_text(bangs[bang_after & ~bang_before]),
+        "spam": spam,
+    }
+
+
+def score_batch(contents: list[str], platforms: list[str], brand_fit: list[float] | None = None) -> list[dict]:
+    """Score breakdown for each (content, platform) pair."""
+    n = len(contents)
+    if not n:
+        return []
+    stats = text_stats(contents)
+    word_counts, hashtags, length = stats["words"], stats["hashtags"], stats["chars"]
+    table = _TABLE[np.fromiter((PLATFORM_IDS.get(p, len(PLATFORMS)) for p in platforms), dtype=np.int64, count=n)]
+    ideal_lo, ideal_hi, limit, tags_lo, tags_hi, tags_max = table.T
+
+    w = np.maximum(word_counts, 1)
+    flesch = 206.835 - 1.015 * (w / np.maximum(stats["sentences"], 1)) - 84.6 * (stats["syllables"] / w)
+    readability = _clip(flesch / 100)
+    readability[word_counts == 0] = 0.0
+
+    length_fit = np.where(
+        length < ideal_lo,
+        length / np.maximum(ideal_lo, 1),
+        np.where(length <= ideal_hi, 1.0, 1 - (length - ideal_hi) / np.maximum(limit - ideal_hi, 1)),
+    )
+    length_fit = _clip(np.where(length > limit, 0.0, length_fit))
+
+    tag_fit = np.where(
+        hashtags < tags_lo,
+        1 - 0.25 * (tags_lo - hashtags),
+        np.where(hashtags <= tags_hi, 1.0, 1 - (hashtags - tags_hi) / np.maximum(tags_max - tags_hi + 1, 1)),
+    )
+    density = hashtags / np.maximum(word_counts, 1)
+    tag_fit = _clip(np.where(hashtags > tags_max, 0.0, tag_fit - np.maximum(density - 0.3, 0)))
+
+    risk = (
+        stats["spam"] * 0.3
+        + stats["urls"] * 0.1
+        + np.maximum(hashtags - 10, 0) * 0.02
+        + stats["shouting"] * 0.05
+        + stats["bang_runs"] * 0.05
+    )
+    policy = _clip(1 - risk)
+
+    brand = np.full(n, 0.8) if brand_fit is None else np.asarray(brand_fit, dtype=np.float64)
+    overall = brand * 0.32 + readability * 0.24 + policy * 0.24 + length_fit * 0.2
+
+    columns = {
+        "brandFit": brand,
+        "readability": readability,
+        "policyRisk": policy,
+        "lengthFit": length_fit,
+        "hashtagFit": tag_fit,
+        "overall": overall,
+    }
+    rounded = {name: np.round(values, 4).tolist() for name, values in columns.items()}
+    return [dict(zip(rounded, row)) for row in zip(*rounded.values())]
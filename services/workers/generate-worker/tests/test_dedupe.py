@@ -0,0 +1,92 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from worker_common import MemoryBus
+
+from app import main
+from app.backends import MicroBatcher, StubBackend
+from app.cache import GenerationCache
+from app.dedupe import DuplicateIndex
+
+
+TOPIC = "AI tools for small business marketing"
+
+
+@pytest.fixture
+def published(monkeypatch):
+    messages: list[tuple[str, dict]] = []
+
+    async def publish(subject, data, headers=None):
+        messages.append((subject, json.loads(data)))
+
+    monkeypatch.setattr(main.runtime, "bus", MemoryBus())
+    monkeypatch.setattr(main.runtime, "publish", publish)
+    monkeypatch.setattr(main, "batcher", MicroBatcher(StubBackend(), window=0))
+    monkeypatch.setattr(main, "cache", GenerationCache())
+    monkeypatch.setattr(main, "dedupe", DuplicateIndex(None))
+    return messages
+
+
+def generate(brief_id: str, **fields) -> SimpleNamespace:
+    request = {
+        "request_id": f"req-{brief_id}",
+        "brief_id": brief_id,
+        "brand_id": "brand-1",
+        "platforms": ["twitter", "linkedin"],
+        "num_variants": 3,
+        "topic": TOPIC,
+        **fields,
+    }
+    return SimpleNamespace(subject="gen.request", data=json.dumps(request).encode())
+
+
+def per_platform(variants: list[dict]) -> dict[str, int]:
+    counts: dict[str, int] = {}
+    for variant in variants:
+        counts[variant["platform"]] = counts.get(variant["platform"], 0) + 1
+    return counts
+
+
+def test_stub_templates_are_not_duplicates(published):
+    asyncio.run(main.handle_gen_request(generate("brief-1")))
+    [(subject, resp)] = published
+    assert subject == "gen.complete"
+    assert per_platform(resp["variants"]) == {"twitter": 3, "linkedin": 3}
+    assert resp["duplicates_rejected"] == 0
+    assert all(v["near_duplicate"] is None for v in resp["variants"])
+
+
+def test_repeated_topic_keeps_variant_count(published):
+    asyncio.run(main.handle_gen_request(generate("brief-1")))
+    asyncio.run(main.handle_gen_request(generate("brief-2")))
+    subject, resp = published[-1]
+    assert subject == "gen.complete"
+    assert per_platform(resp["variants"]) == {"twitter": 3, "linkedin": 3}
+    # The first brief used the same templates, so most slots exhaust their retries.
+    marked = [v for v in resp["variants"] if v["near_duplicate"] is not None]
+    assert marked and resp["duplicates_kept"] == len(marked)
+    assert all(v["near_duplicate"] >= main.dedupe.threshold for v in marked)
+
+
+def test_exhausted_retries_keep_least_similar_candidate(published, monkeypatch):
+    monkeypatch.setattr(main, "dedupe", DuplicateIndex(None, threshold=0.0))
+    asyncio.run(main.handle_gen_request(generate("brief-1", platforms=["twitter"])))
+    [(_, resp)] = published
+    assert len(resp["variants"]) == 3
+    assert resp["duplicates_kept"] == 3
+    # Every candidate is rejected; the first one had nothing to resemble yet.
+    assert resp["variants"][0]["near_duplicate"] == 0.0
+    assert resp["duplicates_rejected"] == 3 * (main.DEDUPE_RETRIES + 1)
+
+
+def test_streaming_keeps_variant_count(published, monkeypatch):
+    monkeypatch.setattr(main, "dedupe", DuplicateIndex(None, threshold=0.0))
+    asyncio.run(main.handle_gen_request(generate("brief-1", stream=True)))
+    partials = [body for subject, body in published if subject == "gen.partial"]
+    [summary] = [body for subject, body in published if subject == "gen.complete"]
+    assert per_platform([p["variant"] for p in partials]) == {"twitter": 3, "linkedin": 3}
+    assert [p["seq"] for p in partials] == list(range(6))
+    assert summary["total_variants"] == 6
+    assert summary["duplicates_kept"] == 6
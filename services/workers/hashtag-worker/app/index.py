@@ -0,0 +1,197 @@
+"""In-memory hashtag index over a local corpus file.
+
+The corpus is a TSV of `tag<TAB>count<TAB>last_seen` lines (`count` and the
+epoch-seconds `last_seen` are optional). Tags are stored once, in id order, with
+their counters in flat arrays; a trigram index maps every 3-character slice to
+the sorted ids of the tags containing it. A query keeps the tags that contain
+every topic token: the rarest trigrams of the tokens narrow the candidates and
+a substring check confirms them. When fewer than `k` tags cover the whole
+topic, partial matches fill the remaining slots. Candidates are ranked with a heap-based top-k
+over a blend of popularity, recency and relevance.
+"""
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from itertools import combinations
+from pathlib import Path
+
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / 'data' / 'hashtags.tsv'
+
+STOPWORDS = frozenset('a an and are as at be by for from how in is it of on or the to with your'.split())
+
+# Trigram postings intersected per query; the rest is left to the substring check.
+MAX_PROBES = 3
+# Topic tokens considered when backing off to partial matches.
+MAX_BACKOFF_TOKENS = 6
+
+_NON_WORD = re.compile(r'\W+')
+
+
+def normalize_tag(tag: str) -> str:
+  return _NON_WORD.sub('', tag.lower())
+
+
+def topic_tokens(topic: str) -> list[str]:
+  tokens = []
+  for token in re.findall(r'\w+', topic.lower()):
+    if token in STOPWORDS:
+      continue
+    # Crude singular so "startups" still finds #startuptips.
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+      token = token[:-1]
+    tokens.append(token)
+  return list(dict.fromkeys(tokens))
+
+
+def trigrams(text: str) -> set[str]:
+  return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class HashtagIndex:
+  """Trigram-indexed hashtags with popularity and recency counters."""
+
+  def __init__(self, half_life: float = 7 * 86400, weights: tuple[float, float, float] = (0.5, 0.3, 0.2)):
+    self.half_life = half_life
+    self.w_popularity, self.w_relevance, self.w_recency = weights
+    self.tags: list[str] = []
+    self.ids: dict[str, int] = {}
+    self.counts = array('Q')
+    self.last_seen = array('d')
+    self.postings: dict[str, array] = {}
+    self.max_count = 0
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_env(cls) -> 'HashtagIndex':
+    index = cls(half_life=float(os.getenv('HASHTAG_RECENCY_HALF_LIFE_DAYS', '7')) * 86400)
+    path = Path(os.getenv('HASHTAG_CORPUS') or DEFAULT_CORPUS)
+    if path.exists():
+      index.load(path)
+    return index
+
+  def __len__(self) -> int:
+    return len(self.tags)
+
+  def load(self, path: str | Path):
+    """Add every corpus line to the index; repeated tags accumulate."""
+    with open(path, encoding='utf-8') as f, self._lock:
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        count = int(fields[1]) if len(fields) > 1 and fields[1] else 1
+        seen = float(fields[2]) if len(fields) > 2 and fields[2] else 0.0
+        self._add(normalize_tag(fields[0]), count, seen)
+
+  def save(self, path: str | Path):
+    """Write the current counters back out in corpus format, atomically."""
+    tmp = Path(f"{path}.tmp")
+    with self._lock, open(tmp, 'w', encoding='utf-8') as f:
+      for i, tag in enumerate(self.tags):
+        f.write(f"{tag}\t{self.counts[i]}\t{int(self.last_seen[i])}\n")
+    os.replace(tmp, path)
+
+  def observe(self, tag: str, count: int = 1, seen: float | None = None) -> int | None:
+    """Record `count` uses of `tag` at `seen` (default now); returns its id."""
+    tag = normalize_tag(tag)
+    if not tag:
+      return None
+    with self._lock:
+      return self._add(tag, count, time.time() if seen is None else seen)
+
+  def _add(self, tag: str, count: int, seen: float) -> int | None:
+    if not tag:
+      return None
+    tag_id = self.ids.get(tag)
+    if tag_id is None:
+      tag_id = len(self.tags)
+      self.tags.append(tag)
+      self.ids[tag] = tag_id
+      self.counts.append(count)
+      self.last_seen.append(seen)
+      # Ids only grow, so appending keeps every posting list sorted.
+      postings = self.postings
+      for gram in trigrams(tag):
+        ids = postings.get(gram)
+        if ids is None:
+          ids = postings[gram] = array('I')
+        ids.append(tag_id)
+    else:
+      self.counts[tag_id] += count
+      if seen > self.last_seen[tag_id]:
+        self.last_seen[tag_id] = seen
+    if self.counts[tag_id] > self.max_count:
+      self.max_count = self.counts[tag_id]
+    return tag_id
+
+  def candidates(self, tokens: list[str]) -> list[int]:
+    """Ids of the tags that contain every token."""
+    if not tokens:
+      return []
+    grams = set().union(*(trigrams(t) for t in tokens))
+    if not grams:
+      # Only short tokens: the best we can do without a full scan is an exact tag.
+      tag_id = self.ids.get(''.join(tokens))
+      return [] if tag_id is None else [tag_id]
+
+    lists = []
+    for gram in grams:
+      postings = self.postings.get(gram)
+      if postings is None:
+        return []
+      lists.append(postings)
+    lists.sort(key=len)
+    found = set(lists[0])
+    for postings in lists[1:MAX_PROBES]:
+      found.intersection_update(postings)
+      if not found:
+        return []
+    tags = self.tags
+    return [i for i in found if all(t in tags[i] for t in tokens)]
+
+  def top(self, topic: str, k: int, now: float | None = None) -> list[dict]:
+    """The `k` best tags for `topic` by blended score, best first."""
+    if k <= 0:
+      return []
+    tokens = topic_tokens(topic)
+    ids = self.candidates(tokens)
+    if len(ids) < k and len(tokens) > 1:
+      # Not enough tags cover the whole topic: fill up with the best partial
+      # matches, largest token subsets first. Relevance ranks them lower.
+      seen = set(ids)
+      head = tokens[:MAX_BACKOFF_TOKENS]
+      for size in range(min(len(tokens) - 1, len(head)), 0, -1):
+        for subset in combinations(head, size):
+          for i in self.candidates(list(subset)):
+            if i not in seen:
+              seen.add(i)
+              ids.append(i)
+        if len(ids) >= k:
+          break
+    now = time.time() if now is None else now
+    norm = math.log1p(self.max_count) or 1.0
+    tags, counts, last_seen = self.tags, self.counts, self.last_seen
+    decay = math.log(2) / self.half_life
+
+    def scored(i: int) -> tuple[float, float, float, float, int]:
+      popularity = math.log1p(counts[i]) / norm
+      tag = tags[i]
+      relevance = min(1.0, sum(len(t) for t in tokens if t in tag) / len(tag))
+      recency = math.exp(-decay * max(0.0, now - last_seen[i])) if last_seen[i] else 0.0
+      score = self.w_popularity * popularity + self.w_relevance * relevance + self.w_recency * recency
+      return score, popularity, relevance, recency, i
+
+    best = heapq.nlargest(k, map(scored, ids))
+    return [
+      {
+        "tag": tags[i],
+        "popularity": round(popularity, 2),
+        "relevance": round(relevance, 2),
+        "recency": round(recency, 2),
+        "score": round(score, 2),
+      }
+      for score, popularity, relevance, recency, i in best
+    ]
@@ -1,12 +1,16 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
 import os
-import json
-from nats.aio.client import Client as NATS
+import time
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.index import HashtagIndex
 
-class HashtagRequest(BaseModel):
+
+class HashtagRequest(Message):
   request_id: str
   topic: str
   competitors: list[str] | None = None
@@ -15,12 +19,22 @@ class HashtagRequest(BaseModel):
   max_tags: int = 10
 
 
-class HashtagResponse(BaseModel):
+class HashtagResponse(Message):
   request_id: str
   hashtags: list[dict]
 
 
+class HashtagObservation(Message):
+  tags: list[str]
+  count: int = 1
+  observed_at: float | None = None
+
+
 app = FastAPI(title="Hashtag Worker", version="0.1.0")
+runtime = WorkerRuntime('hashtag-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+index = HashtagIndex.from_env()
 
 
 @app.get('/health')
@@ -28,54 +42,44 @@ async def health():
   return {"status": "ok", "service": "hashtag-worker"}
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    try:
-      payload = json.loads(msg.data.decode())
-      req = HashtagRequest(**payload)
-
-      # Stub ranking: topic word variants and simple popularity heuristic
-      base = req.topic.lower().split()[0]
-      candidates = [
-        base,
-        f"{base}tips",
-        f"{base}strategy",
-        f"{base}growth",
-        f"{base}101",
-        f"{base}guide",
-        f"{base}marketing",
-        f"{base}content",
-        f"{base}ai",
-        f"{base}trends",
-      ]
-      seen = set()
-      ranked = []
-      for i, tag in enumerate(candidates):
-        if tag in seen: continue
-        seen.add(tag)
-        popularity = max(0.1, 1 - i * 0.08)
-        relevance = max(0.2, 1 - i * 0.05)
-        score = round((popularity * 0.6 + relevance * 0.4), 2)
-        ranked.append({"tag": tag, "popularity": round(popularity, 2), "relevance": round(relevance, 2), "score": score})
-
-      ranked = sorted(ranked, key=lambda x: x["score"], reverse=True)[: req.max_tags]
-      resp = HashtagResponse(request_id=req.request_id, hashtags=ranked)
-      await nc.publish("hashtag.complete", json.dumps(resp.model_dump()).encode())
-
-    except Exception as e:
-      await nc.publish("hashtag.failed", json.dumps({"error": str(e)}).encode())
-
-  await nc.subscribe("hashtag.request", cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@app.get('/index/stats')
+async def index_stats():
+  return {"tags": len(index), "trigrams": len(index.postings), "max_count": index.max_count}
+
+
+@runtime.subscribe("hashtag.request")
+async def handle_request(msg):
+  try:
+    req = decode(msg.data, HashtagRequest)
+
+    ranked = index.top(req.topic, req.max_tags)
+    resp = HashtagResponse(request_id=req.request_id, hashtags=ranked)
+    await runtime.publish("hashtag.complete", encode(resp))
+
+  except Exception as e:
+    await runtime.publish("hashtag.failed", encode({"error": str(e)}))
+
+
+# Every process keeps the whole corpus, so observations fan out to all of them.
+@runtime.subscribe("hashtag.observed", durable=False)
+async def handle_observed(msg):
+  # Incremental corpus updates, e.g. hashtags seen in published posts.
+  obs = decode(msg.data, HashtagObservation)
+  seen = obs.observed_at or time.time()
+  for tag in obs.tags:
+    index.observe(tag, obs.count, seen)
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  path = os.getenv('HASHTAG_CORPUS')
+  # Processes under the supervisor hold the same corpus; the first one writes it.
+  primary = os.getenv('WORKER_PROCESS_INDEX', '0') == '0'
+  if path and primary and os.getenv('HASHTAG_CORPUS_SAVE', '').lower() in ('1', 'true', 'yes'):
+    await asyncio.to_thread(index.save, path)
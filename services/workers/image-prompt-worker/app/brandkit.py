@@ -0,0 +1,293 @@
+"""Preprocessed brand kits for image prompts.
+
+A brand kit is built once per brand version from the brand's colors, fonts
+and guidelines: the palette is normalized (hex colors upper-cased to
+`#RRGGBB`, duplicates dropped), font and guideline hints are cut down to what
+fits in a prompt, and the brand's part of the prompt is pre-joined so a
+request only concatenates topic, style and platform pieces.
+
+Kits live in an LRU cache in front of a SQLite table of the raw brands, fed
+by `brand.updated` events (and by requests that still embed the brand), so
+requests only carry a `brand_id` and a restarted worker keeps its brands.
+Every replica hears `brand.updated` over core NATS, so events sent while it
+was down are lost: a stored brand is only used for `ttl` seconds after it was
+last received (older rows are pruned on start), and an embedded brand with a
+newer `updated_at` replaces the stored one. SQLite is only touched from worker
+threads.
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+MAX_COLORS = 3
+MAX_FONTS = 2
+MAX_GUIDELINES = 160
+
+_HEX = re.compile(r"#?([0-9a-fA-F]{3}|[0-9a-fA-F]{6})")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+# Aspect ratios per platform (first is the default) and their pixel sizes.
+PLATFORM_FORMATS: dict[str, list[tuple[str, str]]] = {
+  'instagram': [('1:1', '1080x1080'), ('4:5', '1080x1350'), ('9:16', '1080x1920')],
+  'twitter': [('16:9', '1600x900'), ('1:1', '1080x1080')],
+  'linkedin': [('1.91:1', '1200x627'), ('1:1', '1080x1080')],
+  'facebook': [('1.91:1', '1200x630'), ('1:1', '1080x1080'), ('4:5', '1080x1350')],
+  'tiktok': [('9:16', '1080x1920')],
+  'youtube': [('16:9', '1280x720')],
+  'threads': [('4:5', '1080x1350'), ('1:1', '1080x1080')],
+  'pinterest': [('2:3', '1000x1500'), ('1:1', '1080x1080')],
+}
+SIZES = {ratio: size for formats in PLATFORM_FORMATS.values() for ratio, size in formats}
+
+
+def platform_hint(platform: str | None, aspect_ratio: str | None = None) -> str:
+  if not platform:
+    return ''
+  if not aspect_ratio:
+    return f" Platform: {platform}."
+  size = SIZES.get(aspect_ratio)
+  return f" Platform: {platform}, {aspect_ratio} ({size})." if size else f" Platform: {platform}, {aspect_ratio}."
+
+
+# Every known platform/aspect-ratio hint, built once.
+PLATFORM_HINTS = {
+  (platform, ratio): platform_hint(platform, ratio)
+  for platform, formats in PLATFORM_FORMATS.items()
+  for ratio, _ in formats
+}
+
+
+def normalize_color(color: str) -> str:
+  color = color.strip()
+  match = _HEX.fullmatch(color)
+  if not match:
+    return color.lower()
+  digits = match.group(1)
+  if len(digits) == 3:
+    digits = ''.join(c * 2 for c in digits)
+  return '#' + digits.upper()
+
+
+def guideline_snippet(guidelines: str) -> str:
+  """Leading sentences of the guidelines that fit in MAX_GUIDELINES chars."""
+  snippet = ''
+  for sentence in _SENTENCE.split(' '.join(guidelines.split())):
+    if snippet and len(snippet) + 1 + len(sentence) > MAX_GUIDELINES:
+      break
+    snippet = f"{snippet} {sentence}".strip()
+  return snippet[:MAX_GUIDELINES]
+
+
+@dataclass
+class BrandKit:
+  brand_id: str
+  name: str
+  palette: list[str]
+  fonts: list[str]
+  guidelines: str
+  hint: str  # brand part of every prompt
+  updated_at: float = 0.0  # brand version
+  expires_at: float = float('inf')
+  _styled: dict[str | None, str] = field(default_factory=dict, repr=False)
+
+  @classmethod
+  def build(cls, brand_id: str, brand: dict, updated_at: float = 0.0, expires_at: float = float('inf')) -> 'BrandKit':
+    palette = list(dict.fromkeys(normalize_color(c) for c in brand.get('colors') or [] if c and c.strip()))
+    fonts = list(dict.fromkeys(f.strip() for f in brand.get('fonts') or [] if f and f.strip()))
+    guidelines = guideline_snippet(brand.get('guidelines') or '')
+    hint = ''
+    if palette:
+      hint += f" Use brand colors: {', '.join(palette[:MAX_COLORS])}."
+    if fonts:
+      hint += f" Typography in the style of {', '.join(fonts[:MAX_FONTS])}."
+    if guidelines:
+      hint += f" Brand guidelines: {guidelines}"
+    return cls(brand_id, brand.get('name') or '', palette, fonts, guidelines, hint, updated_at, expires_at)
+
+  def styled(self, style: str | None) -> str:
+    """Brand and style hints, joined once per style."""
+    hint = self._styled.get(style)
+    if hint is None:
+      hint = self._styled[style] = self.hint + (f" Style: {style}." if style else '')
+    return hint
+
+
+class BrandStore:
+  """Raw brands in SQLite, so kits survive restarts."""
+
+  def __init__(self, path: str):
+    self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("PRAGMA synchronous=NORMAL")
+    self._conn.execute(
+      "CREATE TABLE IF NOT EXISTS brands ("
+      " brand_id TEXT PRIMARY KEY, brand TEXT NOT NULL, updated_at REAL NOT NULL,"
+      " stored_at REAL NOT NULL DEFAULT 0)"
+    )
+    columns = {row[1] for row in self._conn.execute("PRAGMA table_info(brands)")}
+    if 'stored_at' not in columns:
+      # Brands stored before TTLs existed are of unknown age: expire them.
+      self._conn.execute("ALTER TABLE brands ADD COLUMN stored_at REAL NOT NULL DEFAULT 0")
+    self._lock = threading.Lock()
+
+  def get(self, brand_id: str) -> tuple[dict, float, float] | None:
+    """(brand, updated_at, stored_at) of `brand_id`."""
+    with self._lock:
+      row = self._conn.execute(
+        "SELECT brand, updated_at, stored_at FROM brands WHERE brand_id = ?", (brand_id,),
+      ).fetchone()
+    return (json.loads(row[0]), row[1], row[2]) if row else None
+
+  def put(self, brand_id: str, brand: dict, updated_at: float, stored_at: float):
+    with self._lock:
+      self._conn.execute(
+        "INSERT INTO brands (brand_id, brand, updated_at, stored_at) VALUES (?, ?, ?, ?)"
+        " ON CONFLICT (brand_id) DO UPDATE SET"
+        " brand = excluded.brand, updated_at = excluded.updated_at, stored_at = excluded.stored_at"
+        " WHERE excluded.updated_at >= brands.updated_at",
+        (brand_id, json.dumps(brand), updated_at, stored_at),
+      )
+
+  def prune(self, before: float) -> int:
+    """Delete brands last stored before `before`; returns how many."""
+    with self._lock:
+      return self._conn.execute("DELETE FROM brands WHERE stored_at < ?", (before,)).rowcount
+
+  def delete(self, brand_id: str):
+    with self._lock:
+      self._conn.execute("DELETE FROM brands WHERE brand_id = ?", (brand_id,))
+
+  def close(self):
+    self._conn.close()
+
+
+class BrandKitCache:
+  """LRU of built kits over an optional BrandStore."""
+
+  def __init__(self, store: BrandStore | None = None, max_entries: int = 1024, ttl: float = 86400.0):
+    self.store = store
+    self.max_entries = max_entries
+    self.ttl = ttl  # seconds a brand is used after it was stored; 0 keeps brands forever
+    self._kits: OrderedDict[str, BrandKit] = OrderedDict()
+    # (brand, updated_at, stored_at) when there is no store
+    self._brands: dict[str, tuple[dict, float, float]] = {}
+    self._invalidated = 0  # bumped on every invalidation, so a slow load does not cache a replaced brand
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.builds = 0
+    self.invalidations = 0
+    self.expirations = 0
+
+  @classmethod
+  def from_env(cls) -> 'BrandKitCache':
+    path = os.getenv('IMAGE_BRANDKIT_PATH', 'brand-kits.db')
+    if path:
+      Path(path).parent.mkdir(parents=True, exist_ok=True)
+    return cls(
+      BrandStore(path) if path else None,
+      max_entries=int(os.getenv('IMAGE_BRANDKIT_CACHE', '1024')),
+      ttl=float(os.getenv('IMAGE_BRANDKIT_TTL', '86400')),
+    )
+
+  def _expires_at(self, stored_at: float) -> float:
+    return stored_at + self.ttl if self.ttl > 0 else float('inf')
+
+  async def get(self, brand_id: str) -> BrandKit | None:
+    now = time.time()
+    with self._lock:
+      kit = self._kits.get(brand_id)
+      if kit is not None and kit.expires_at > now:
+        self._kits.move_to_end(brand_id)
+        self.hits += 1
+        return kit
+      if kit is not None:
+        del self._kits[brand_id]
+        self.expirations += 1
+      self.misses += 1
+      invalidated = self._invalidated
+    if self.store is not None:
+      row = await asyncio.to_thread(self.store.get, brand_id)
+    else:
+      row = self._brands.get(brand_id)
+    if row is None:
+      return None
+    brand, updated_at, stored_at = row
+    if self._expires_at(stored_at) <= now:
+      return None
+    return self._remember(BrandKit.build(brand_id, brand, updated_at, self._expires_at(stored_at)), invalidated)
+
+  def _remember(self, kit: BrandKit, invalidated: int) -> BrandKit:
+    with self._lock:
+      self.builds += 1
+      if invalidated != self._invalidated:
+        return kit  # a brand changed while this one loaded; it may be stale
+      self._kits[kit.brand_id] = kit
+      self._kits.move_to_end(kit.brand_id)
+      while len(self._kits) > self.max_entries:
+        self._kits.popitem(last=False)
+    return kit
+
+  async def put(self, brand_id: str, brand: dict, updated_at: float | None = None):
+    """Store a brand version; older versions than the stored one are ignored."""
+    stored_at = time.time()
+    updated_at = stored_at if updated_at is None else updated_at
+    if self.store is not None:
+      await asyncio.to_thread(self.store.put, brand_id, brand, updated_at, stored_at)
+    else:
+      with self._lock:
+        current = self._brands.get(brand_id)
+        if current is not None and updated_at < current[1]:
+          return
+        self._brands[brand_id] = (brand, updated_at, stored_at)
+    self.invalidate(brand_id)
+
+  async def delete(self, brand_id: str):
+    if self.store is not None:
+      await asyncio.to_thread(self.store.delete, brand_id)
+    with self._lock:
+      self._brands.pop(brand_id, None)
+    self.invalidate(brand_id)
+
+  async def prune(self) -> int:
+    """Drop brands whose TTL has run out; returns how many."""
+    if self.ttl <= 0:
+      return 0
+    before = time.time() - self.ttl
+    if self.store is not None:
+      return await asyncio.to_thread(self.store.prune, before)
+    with self._lock:
+      expired = [brand_id for brand_id, (_, _, stored_at) in self._brands.items() if stored_at < before]
+      for brand_id in expired:
+        del self._brands[brand_id]
+    return len(expired)
+
+  def invalidate(self, brand_id: str):
+    with self._lock:
+      self._invalidated += 1
+      if self._kits.pop(brand_id, None) is not None:
+        self.invalidations += 1
+
+  def stats(self) -> dict:
+    lookups = self.hits + self.misses
+    return {
+      'entries': len(self._kits),
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+      'builds': self.builds,
+      'invalidations': self.invalidations,
+      'expirations': self.expirations,
+    }
+
+  def close(self):
+    if self.store is not None:
+      self.store.close()
@@ -1,25 +1,60 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
-import asyncio
-import os
-import json
-from nats.aio.client import Client as NATS
+from datetime import datetime
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.brandkit import PLATFORM_FORMATS, PLATFORM_HINTS, BrandKit, BrandKitCache, platform_hint
 
-class ImagePromptRequest(BaseModel):
+
+class ImagePromptRequest(Message):
   request_id: str
   topic: str
-  brand: dict | None = None  # { name, colors, fonts, guidelines }
+  brand_id: str | None = None
+  brand: dict | None = None  # { name, colors, fonts, guidelines, updated_at }; prefer brand_id
   style: str | None = None
   platform: str | None = None
+  # Multi-platform mode: one prompt per platform and aspect ratio (every
+  # format of the platform unless aspect_ratios is given).
+  platforms: list[str] | None = None
+  aspect_ratios: list[str] | None = None
+
+
+# None fields are left out of responses.
+class PlatformPrompt(Message, kw_only=True, omit_defaults=True):
+  platform: str
+  aspect_ratio: str | None = None
+  size: str | None = None
+  prompt: str
 
 
-class ImagePromptResponse(BaseModel):
+class ImagePromptResponse(Message, kw_only=True, omit_defaults=True):
   request_id: str
   prompt: str
+  brand_id: str | None = None
+  brand_applied: bool
+  prompts: list[PlatformPrompt] | None = None
+
+
+class BrandUpdated(Message):
+  brand_id: str
+  deleted: bool = False
+  name: str | None = None
+  colors: list[str] | None = None
+  fonts: list[str] | None = None
+  guidelines: str | None = None
+  updated_at: str | None = None  # ISO 8601
 
 
 app = FastAPI(title="Image Prompt Worker", version="0.1.0")
+runtime = WorkerRuntime('image-prompt-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+brands = BrandKitCache.from_env()
+
+PROMPT_HEAD = "Create a high-contrast thumbnail about '"
+PROMPT_TAIL = " Include legible text overlay and ample whitespace."
 
 
 @app.get('/health')
@@ -27,34 +62,101 @@ async def health():
   return {"status": "ok", "service": "image-prompt-worker"}
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    try:
-      payload = json.loads(msg.data.decode())
-      req = ImagePromptRequest(**payload)
-      brand_hint = ''
-      if req.brand:
-        colors = ', '.join(req.brand.get('colors', [])[:3])
-        brand_hint = f" Use brand colors: {colors}."
-      style_hint = f" Style: {req.style}." if req.style else ''
-      platform_hint = f" Platform: {req.platform}." if req.platform else ''
-      prompt = f"Create a high-contrast thumbnail about '{req.topic}'.{brand_hint}{style_hint}{platform_hint} Include legible text overlay and ample whitespace."
-      resp = ImagePromptResponse(request_id=req.request_id, prompt=prompt)
-      await nc.publish('imageprompt.complete', json.dumps(resp.model_dump()).encode())
-    except Exception as e:
-      await nc.publish('imageprompt.failed', json.dumps({'error': str(e)}).encode())
-
-  await nc.subscribe('imageprompt.request', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@app.get('/brandkits/stats')
+async def brandkit_stats():
+  return brands.stats()
+
+
+def brand_version(updated_at: str | None) -> float | None:
+  return datetime.fromisoformat(updated_at).timestamp() if updated_at else None
+
+
+async def resolve_kit(req: ImagePromptRequest) -> BrandKit | None:
+  kit = await brands.get(req.brand_id) if req.brand_id else None
+  if not req.brand:
+    return kit
+  # An embedded brand without updated_at is version 0, so any brand.updated event wins over it.
+  updated_at = brand_version(req.brand.get('updated_at')) or 0.0
+  if kit is not None and kit.updated_at >= updated_at:
+    return kit
+  if req.brand_id:
+    await brands.put(req.brand_id, req.brand, updated_at=updated_at)
+  return BrandKit.build(req.brand_id or '', req.brand, updated_at)
+
+
+def brand_style(kit: BrandKit | None, style: str | None) -> str:
+  if kit is not None:
+    return kit.styled(style)
+  return f" Style: {style}." if style else ''
+
+
+def build_prompts(req: ImagePromptRequest, kit: BrandKit | None) -> list[PlatformPrompt]:
+  head = f"{PROMPT_HEAD}{req.topic}'."
+  styled = brand_style(kit, req.style)
+  prompts = []
+  for platform in dict.fromkeys(req.platforms):
+    formats = PLATFORM_FORMATS.get(platform, [])
+    sizes = dict(formats)
+    ratios = req.aspect_ratios or [ratio for ratio, _ in formats] or [None]
+    for ratio in ratios:
+      hint = PLATFORM_HINTS.get((platform, ratio)) or platform_hint(platform, ratio)
+      prompts.append(PlatformPrompt(
+        platform=platform,
+        aspect_ratio=ratio,
+        size=sizes.get(ratio),
+        prompt=f"{head}{styled}{hint}{PROMPT_TAIL}",
+      ))
+  return prompts
+
+
+@runtime.subscribe('imageprompt.request')
+async def handle_request(msg):
+  try:
+    req = decode(msg.data, ImagePromptRequest)
+    kit = await resolve_kit(req)
+    if req.platforms:
+      prompts = build_prompts(req, kit)
+      prompt = prompts[0].prompt
+    else:
+      prompts = None
+      prompt = f"{PROMPT_HEAD}{req.topic}'.{brand_style(kit, req.style)}{platform_hint(req.platform)}{PROMPT_TAIL}"
+    resp = ImagePromptResponse(
+      request_id=req.request_id,
+      prompt=prompt,
+      brand_id=req.brand_id,
+      brand_applied=kit is not None,
+      prompts=prompts,
+    )
+    await runtime.publish('imageprompt.complete', encode(resp))
+  except Exception as e:
+    await runtime.publish('imageprompt.failed', encode({'error': str(e)}))
+
+
+# Every replica keeps its own kits, so invalidations fan out over core NATS;
+# events missed while a replica is down are covered by the brand TTL.
+@runtime.subscribe('brand.updated', durable=False)
+async def handle_brand_updated(msg):
+  try:
+    body = decode(msg.data, BrandUpdated)
+    if body.deleted:
+      await brands.delete(body.brand_id)
+      return
+    await brands.put(
+      body.brand_id,
+      {'name': body.name, 'colors': body.colors, 'fonts': body.fonts, 'guidelines': body.guidelines},
+      brand_version(body.updated_at),
+    )
+  except Exception as e:
+    await runtime.publish('imageprompt.failed', encode({'error': f"brand.updated: {e}"}))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await brands.prune()
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  brands.close()
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from app import main
+from app.brandkit import MAX_GUIDELINES, BrandKit, BrandKitCache, BrandStore, normalize_color
+
+
+BRAND = {'name': 'Acme', 'colors': ['#fa0', ' #FFAA00 ', 'ffaa00', '#123abc', 'navy'], 'fonts': [' Inter ', 'Inter', '']}
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+  store = BrandStore(str(tmp_path / 'brands.db')) if request.param == 'sqlite' else None
+  cache = BrandKitCache(store, ttl=60)
+  yield cache
+  cache.close()
+
+
+@pytest.mark.parametrize('color, normalized', [
+  ('#fa0', '#FFAA00'), ('FFAA00', '#FFAA00'), (' #12ab9C ', '#12AB9C'), ('Navy', 'navy'), ('#12345', '#12345'),
+])
+def test_normalize_color(color, normalized):
+  assert normalize_color(color) == normalized
+
+
+def test_build_normalizes_and_dedupes():
+  kit = BrandKit.build('b1', {**BRAND, 'guidelines': 'Be bold.  Be kind! ' + 'x' * 300})
+  assert kit.palette == ['#FFAA00', '#123ABC', 'navy']
+  assert kit.fonts == ['Inter']
+  assert kit.guidelines == 'Be bold. Be kind!'
+  assert len(BrandKit.build('b1', {'guidelines': 'y' * 500}).guidelines) == MAX_GUIDELINES
+  assert kit.hint.startswith(' Use brand colors: #FFAA00, #123ABC, navy.')
+
+
+def test_older_versions_are_ignored(cache):
+  async def scenario():
+    await cache.put('b1', {'name': 'v2'}, updated_at=200)
+    await cache.put('b1', {'name': 'v1'}, updated_at=100)
+    assert (await cache.get('b1')).name == 'v2'
+    await cache.put('b1', {'name': 'v3'}, updated_at=300)
+    kit = await cache.get('b1')
+    assert (kit.name, kit.updated_at) == ('v3', 300)
+    await cache.delete('b1')
+    assert await cache.get('b1') is None
+
+  asyncio.run(scenario())
+
+
+def test_brands_expire_after_ttl(cache, monkeypatch):
+  now = 1_000_000.0
+  monkeypatch.setattr('app.brandkit.time.time', lambda: now)
+
+  async def scenario():
+    nonlocal now
+    await cache.put('b1', {'name': 'Acme'}, updated_at=1)
+    assert (await cache.get('b1')).name == 'Acme'
+    now += 61
+    assert await cache.get('b1') is None
+    assert cache.stats()['expirations'] == 1
+    assert await cache.prune() == 1
+
+  asyncio.run(scenario())
+
+
+def test_store_expires_rows_without_stored_at(tmp_path):
+  path = str(tmp_path / 'brands.db')
+  conn = sqlite3.connect(path)
+  conn.execute("CREATE TABLE brands (brand_id TEXT PRIMARY KEY, brand TEXT NOT NULL, updated_at REAL NOT NULL)")
+  conn.execute("INSERT INTO brands VALUES ('b1', ?, 5)", (json.dumps({'name': 'old'}),))
+  conn.commit()
+  conn.close()
+  cache = BrandKitCache(BrandStore(path), ttl=60)
+  assert asyncio.run(cache.get('b1')) is None
+  assert asyncio.run(cache.prune()) == 1
+  cache.close()
+
+
+def test_embedded_brand_refreshes_older_kit(monkeypatch):
+  monkeypatch.setattr(main, 'brands', BrandKitCache(ttl=60))
+
+  def request(**brand) -> main.ImagePromptRequest:
+    return main.ImagePromptRequest(request_id='r', topic='t', brand_id='b1', brand=brand or None)
+
+  async def scenario():
+    await main.brands.put('b1', {'name': 'stored'}, updated_at=main.brand_version('2026-01-01T00:00:00+00:00'))
+    assert (await main.resolve_kit(request(name='stale', updated_at='2025-12-01T00:00:00+00:00'))).name == 'stored'
+    assert (await main.resolve_kit(request(name='unversioned'))).name == 'stored'
+    assert (await main.resolve_kit(request(name='newer', updated_at='2026-02-01T00:00:00+00:00'))).name == 'newer'
+    assert (await main.resolve_kit(request())).name == 'newer'
+
+  asyncio.run(scenario())
+
+
+def test_brand_updated_event_orders_by_version(monkeypatch):
+  monkeypatch.setattr(main, 'brands', BrandKitCache(ttl=60))
+
+  def event(name: str, updated_at: str) -> SimpleNamespace:
+    body = {'brand_id': 'b1', 'name': name, 'updated_at': updated_at}
+    return SimpleNamespace(subject='brand.updated', data=json.dumps(body).encode())
+
+  async def scenario():
+    await main.handle_brand_updated(event('new', '2026-02-01T00:00:00+00:00'))
+    await main.handle_brand_updated(event('old', '2026-01-01T00:00:00+00:00'))  # arrived late
+    return await main.brands.get('b1')
+
+  assert asyncio.run(scenario()).name == 'new'
@@ -1,14 +1,15 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-import asyncio
-import os
-import json
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import RedirectResponse
 from urllib.parse import urlencode, urlparse, parse_qsl, urlunparse
-from nats.aio.client import Client as NATS
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.shortener import Shortener
 
-class LinkRequest(BaseModel):
-  request_id: str
+
+class LinkSpec(Message, kw_only=True):
   url: str
   utm_source: str = "social"
   utm_medium: str = "organic"
@@ -17,13 +18,44 @@ class LinkRequest(BaseModel):
   shorten: bool = False
 
 
-class LinkResponse(BaseModel):
+class LinkRequest(LinkSpec, kw_only=True):
+  request_id: str
+
+
+class LinkResponse(Message):
+  request_id: str
+  url: str
+  short_url: str | None = None
+
+
+class LinkBatchRequest(Message):
   request_id: str
+  links: list[LinkSpec]
+
+
+class LinkResult(Message):
   url: str
   short_url: str | None = None
 
 
+class LinkBatchResponse(Message):
+  request_id: str
+  links: list[LinkResult]
+  # Offset of `links` in the request; large batches are split into parts.
+  offset: int = 0
+  total: int = 0
+  part: int = 0
+  parts: int = 1
+
+
 app = FastAPI(title="Link Worker", version="0.1.0")
+runtime = WorkerRuntime('link-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+shortener = Shortener.from_env()
+
+# Room left in max_payload for the subject, headers and protocol framing.
+PAYLOAD_HEADROOM = 4096
 
 
 @app.get('/health')
@@ -31,6 +63,19 @@ async def health():
   return {"status": "ok", "service": "link-worker"}
 
 
+@app.get('/links/stats')
+async def link_stats():
+  return shortener.stats()
+
+
+@app.get('/r/{code}')
+async def redirect(code: str):
+  url = await shortener.resolve(code)
+  if url is None:
+    raise HTTPException(status_code=404, detail="Unknown short link")
+  return RedirectResponse(url, status_code=302)
+
+
 def add_utm(url: str, params: dict) -> str:
   parsed = urlparse(url)
   q = dict(parse_qsl(parsed.query))
@@ -39,39 +84,69 @@ def add_utm(url: str, params: dict) -> str:
   return urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    try:
-      payload = json.loads(msg.data.decode())
-      req = LinkRequest(**payload)
-      with_utm = add_utm(req.url, {
-        'utm_source': req.utm_source,
-        'utm_medium': req.utm_medium,
-        'utm_campaign': req.utm_campaign,
-        **({'utm_content': req.utm_content} if req.utm_content else {}),
-      })
-
-      short = None
-      # Stub shortener
-      if req.shorten:
-        short = with_utm if len(with_utm) < 60 else with_utm[:60] + '...'
-
-      resp = LinkResponse(request_id=req.request_id, url=with_utm, short_url=short)
-      await nc.publish('link.complete', json.dumps(resp.model_dump()).encode())
-    except Exception as e:
-      await nc.publish('link.failed', json.dumps({'error': str(e)}).encode())
-
-  await nc.subscribe('link.request', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+def tracked_url(spec: LinkSpec) -> str:
+  return add_utm(spec.url, {
+    'utm_source': spec.utm_source,
+    'utm_medium': spec.utm_medium,
+    'utm_campaign': spec.utm_campaign,
+    **({'utm_content': spec.utm_content} if spec.utm_content else {}),
+  })
+
+
+async def build_links(specs: list[LinkSpec]) -> list[LinkResult]:
+  """UTM-tagged URLs for `specs`, shortening the requested ones in one store round trip."""
+  urls = [tracked_url(spec) for spec in specs]
+  wanted = [url for spec, url in zip(specs, urls) if spec.shorten]
+  shorts = iter(await shortener.shorten_many(wanted) if wanted else [])
+  return [LinkResult(url=url, short_url=next(shorts) if spec.shorten else None) for spec, url in zip(specs, urls)]
+
+
+def split_batch(request_id: str, links: list[LinkResult], limit: int) -> list[LinkBatchResponse]:
+  """Group `links` into responses whose encoded size stays under `limit` bytes."""
+  envelope = len(encode(LinkBatchResponse(request_id=request_id, links=[], offset=10**9, total=10**9, part=10**9, parts=10**9)))
+  chunks: list[tuple[int, list[LinkResult]]] = [(0, [])]
+  used = envelope
+  for i, link in enumerate(links):
+    size = len(encode(link)) + 1
+    if chunks[-1][1] and used + size > limit:
+      chunks.append((i, []))
+      used = envelope
+    chunks[-1][1].append(link)
+    used += size
+  return [
+    LinkBatchResponse(request_id=request_id, links=chunk, offset=offset, total=len(links), part=n, parts=len(chunks))
+    for n, (offset, chunk) in enumerate(chunks)
+  ]
+
+
+@runtime.subscribe('link.request')
+async def handle_request(msg):
+  try:
+    req = decode(msg.data, LinkRequest)
+    link, = await build_links([req])
+    resp = LinkResponse(request_id=req.request_id, url=link.url, short_url=link.short_url)
+    await runtime.publish('link.complete', encode(resp))
+  except Exception as e:
+    await runtime.publish('link.failed', encode({'error': str(e)}))
+
+
+@runtime.subscribe('link.request.batch')
+async def handle_batch(msg):
+  try:
+    req = decode(msg.data, LinkBatchRequest)
+    links = await build_links(req.links)
+    for part in split_batch(req.request_id, links, runtime.max_payload - PAYLOAD_HEADROOM):
+      await runtime.publish('link.batch.complete', encode(part))
+  except Exception as e:
+    await runtime.publish('link.failed', encode({'error': str(e)}))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  shortener.close()
@@ -0,0 +1,159 @@
+"""Persistent base62 link shortener.
+
+Each URL gets a row in a SQLite table; its rowid is run through a fixed
+bijective permutation of [0, 62**CODE_LENGTH) and base62-encoded, so codes are
+collision-free by construction, fixed-length and not guessable in sequence.
+Resolving inverts the permutation back to the rowid, so lookups go straight to
+the primary key. Hot codes are served from an in-process LRU.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(ALPHABET)
+CODE_LENGTH = 7
+SPACE = BASE ** CODE_LENGTH
+# Multiplier must be coprime with 62 for the permutation to be a bijection.
+MULTIPLIER = 1_580_030_173
+OFFSET = 1_209_753_911
+INVERSE = pow(MULTIPLIER, -1, SPACE)
+
+_DIGITS = {ch: i for i, ch in enumerate(ALPHABET)}
+
+
+def encode(n: int) -> str:
+  chars = []
+  for _ in range(CODE_LENGTH):
+    n, rem = divmod(n, BASE)
+    chars.append(ALPHABET[rem])
+  return ''.join(reversed(chars))
+
+
+def decode(code: str) -> int:
+  n = 0
+  for ch in code:
+    n = n * BASE + _DIGITS[ch]
+  return n
+
+
+def code_for(row_id: int) -> str:
+  return encode((row_id * MULTIPLIER + OFFSET) % SPACE)
+
+
+def row_id_for(code: str) -> int | None:
+  if len(code) != CODE_LENGTH or any(ch not in _DIGITS for ch in code):
+    return None
+  return (decode(code) - OFFSET) * INVERSE % SPACE
+
+
+class LinkStore:
+  """URL table in SQLite; identical URLs share one row and therefore one code."""
+
+  def __init__(self, path: str):
+    self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("PRAGMA synchronous=NORMAL")
+    self._conn.execute(
+      "CREATE TABLE IF NOT EXISTS links (id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, created_at REAL NOT NULL)"
+    )
+    self._lock = threading.Lock()
+
+  def shorten_many(self, urls: list[str]) -> list[str]:
+    """Codes for `urls`, in order, inserting the ones not seen before in one transaction."""
+    unique = list(dict.fromkeys(urls))
+    ids: dict[str, int] = {}
+    with self._lock:
+      for start in range(0, len(unique), 500):
+        chunk = unique[start:start + 500]
+        marks = ','.join('?' * len(chunk))
+        ids.update((url, row_id) for row_id, url in self._conn.execute(
+          f"SELECT id, url FROM links WHERE url IN ({marks})", chunk
+        ))
+      missing = [url for url in unique if url not in ids]
+      if missing:
+        now = time.time()
+        self._conn.execute("BEGIN")
+        try:
+          for url in missing:
+            ids[url] = self._conn.execute(
+              "INSERT INTO links (url, created_at) VALUES (?, ?)", (url, now)
+            ).lastrowid
+          self._conn.execute("COMMIT")
+        except BaseException:
+          self._conn.execute("ROLLBACK")
+          raise
+    return [code_for(ids[url]) for url in urls]
+
+  def resolve(self, code: str) -> str | None:
+    row_id = row_id_for(code)
+    if row_id is None:
+      return None
+    with self._lock:
+      row = self._conn.execute("SELECT url FROM links WHERE id = ?", (row_id,)).fetchone()
+    return row[0] if row else None
+
+  def count(self) -> int:
+    with self._lock:
+      return self._conn.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+
+  def close(self):
+    self._conn.close()
+
+
+class Shortener:
+  """`LinkStore` behind an LRU of resolved codes."""
+
+  def __init__(self, store: LinkStore, base_url: str, cache_size: int = 10_000):
+    self.store = store
+    self.base_url = base_url.rstrip('/')
+    self.cache_size = cache_size
+    self.hits = 0
+    self.misses = 0
+    self._cache: OrderedDict[str, str] = OrderedDict()
+
+  @classmethod
+  def from_env(cls) -> 'Shortener':
+    return cls(
+      LinkStore(os.getenv('LINK_DB_PATH', 'links.db')),
+      base_url=os.getenv('LINK_BASE_URL', 'http://localhost:8000/r'),
+      cache_size=int(os.getenv('LINK_CACHE_SIZE', '10000')),
+    )
+
+  def short_url(self, code: str) -> str:
+    return f"{self.base_url}/{code}"
+
+  async def shorten_many(self, urls: list[str]) -> list[str]:
+    """Short URLs for `urls`, in order."""
+    codes = await asyncio.to_thread(self.store.shorten_many, urls)
+    for code, url in zip(codes, urls):
+      self._remember(code, url)
+    return [self.short_url(code) for code in codes]
+
+  async def resolve(self, code: str) -> str | None:
+    url = self._cache.get(code)
+    if url is not None:
+      self._cache.move_to_end(code)
+      self.hits += 1
+      return url
+    self.misses += 1
+    url = await asyncio.to_thread(self.store.resolve, code)
+    if url is not None:
+      self._remember(code, url)
+    return url
+
+  def _remember(self, code: str, url: str):
+    self._cache[code] = url
+    self._cache.move_to_end(code)
+    while len(self._cache) > self.cache_size:
+      self._cache.popitem(last=False)
+
+  def stats(self) -> dict:
+    return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+  def close(self):
+    self.store.close()
@@ -1,14 +1,17 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
-import os
-import json
 import random
-from nats.aio.client import Client as NATS
+from worker_common import RetryLater, WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.http import PlatformHttp, bearer_headers
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
+from worker_common.ratelimit import RateLimiter, account_key
 
 
-class MetaPublishRequest(BaseModel):
+class MetaPublishRequest(Message, kw_only=True):
   request_id: str
+  brand_id: str | None = None  # echoed on publish.success for duplicate detection
   page_id: str | None = None
   ig_account_id: str | None = None
   content: str
@@ -16,13 +19,21 @@ class MetaPublishRequest(BaseModel):
   credentials: dict
 
 
-class MetaPublishResponse(BaseModel):
+class MetaPublishResponse(Message):
   request_id: str
   external_id: str
   url: str | None = None
+  connector: str = 'meta'
+  brand_id: str | None = None
+  content: str | None = None
 
 
 app = FastAPI(title="Meta Connector", version="0.1.0")
+runtime = WorkerRuntime('meta-connector')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+http = PlatformHttp('meta')
+limiter = RateLimiter.from_env('meta')
 
 
 @app.get('/health')
@@ -31,40 +42,54 @@ async def health():
 
 
 async def publish_meta(req: MetaPublishRequest) -> MetaPublishResponse:
-  await asyncio.sleep(0.2)
-  external_id = f"meta_{random.randint(1_000_000, 9_999_999)}"
+  if http.enabled:
+    headers = bearer_headers(req.credentials)
+    if req.ig_account_id:
+      # Instagram publishes in two steps: create a media container, then publish it.
+      container = {'caption': req.content}
+      if req.media_ids:
+        container['image_url'] = req.media_ids[0]
+      resp = await http.request('POST', f"/{req.ig_account_id}/media", json=container, headers=headers)
+      resp.raise_for_status()
+      resp = await http.request('POST', f"/{req.ig_account_id}/media_publish", json={'creation_id': resp.json()['id']}, headers=headers)
+    else:
+      resp = await http.request('POST', f"/{req.page_id}/feed", json={'message': req.content}, headers=headers)
+    resp.raise_for_status()
+    external_id = resp.json()['id']
+  else:
+    await asyncio.sleep(0.2)
+    external_id = f"meta_{random.randint(1_000_000, 9_999_999)}"
   return MetaPublishResponse(request_id=req.request_id, external_id=external_id, url=None)
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    payload = json.loads(msg.data.decode())
-    req = MetaPublishRequest(**payload)
-    retries = 3
-    backoff = 0.5
-    for attempt in range(1, retries + 1):
-      try:
-        resp = await publish_meta(req)
-        await nc.publish('publish.success', json.dumps(resp.model_dump()).encode())
-        return
-      except Exception as e:
-        if attempt == retries:
-          await nc.publish('publish.failed', json.dumps({'request_id': req.request_id, 'error': str(e)}).encode())
-        else:
-          await asyncio.sleep(backoff)
-          backoff *= 2
-
-  await nc.subscribe('publish.meta', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@runtime.subscribe('publish.meta', idempotent=True)
+async def handle_request(msg):
+  req = decode(msg.data, MetaPublishRequest)
+  try:
+    resp = await limiter.run(
+      account_key(req.credentials, req.ig_account_id, req.page_id),
+      lambda: publish_meta(req),
+      attempt=runtime.attempt(msg),
+      attempts=runtime.config.max_deliver,
+    )
+  except RetryLater:
+    raise
+  except Exception as e:
+    await runtime.publish('publish.failed', encode({'request_id': req.request_id, 'connector': 'meta', 'error': str(e)}))
+    return
+  if req.brand_id:
+    resp.brand_id, resp.content = req.brand_id, req.content
+  await runtime.publish('publish.success', encode(resp))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await http.start()
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  await http.close()
+  await limiter.close()
@@ -0,0 +1,158 @@
+"""Columnar normalization for metrics.ingest.batch.
+
+Raw records are turned into one NumPy column per canonical metric, using the
+aliases for each record's platform, and the derived rates are computed over
+whole columns at once. A field takes the first of its aliases present in the
+record, even when its value is 0, the same rule `normalize_metrics()` uses,
+so the counts match the single-record path for the generic aliases
+(reactions→likes, views→impressions). Like `raw.get('likes') or ...` there,
+a 0 or null `likes` falls through to the next alias.
+"""
+import numpy as np
+
+
+COUNT_FIELDS = ['likes', 'comments', 'shares', 'saves', 'impressions', 'clicks']
+
+# Aliases in priority order; platform entries are tried after the generic ones.
+ALIASES: dict[str, list[str]] = {
+  'likes': ['likes', 'reactions'],
+  'comments': ['comments'],
+  'shares': ['shares'],
+  'saves': ['saves'],
+  'impressions': ['impressions', 'views'],
+  'clicks': ['clicks'],
+}
+
+PLATFORM_ALIASES: dict[str, dict[str, list[str]]] = {
+  'twitter': {
+    'likes': ['favorites', 'like_count'],
+    'comments': ['replies', 'reply_count'],
+    'shares': ['retweets', 'retweet_count', 'quote_count'],
+    'saves': ['bookmarks', 'bookmark_count'],
+    'impressions': ['impression_count'],
+    'clicks': ['url_link_clicks', 'link_clicks'],
+  },
+  'linkedin': {
+    'likes': ['likeCount', 'numLikes'],
+    'comments': ['commentCount', 'numComments'],
+    'shares': ['shareCount', 'reposts'],
+    'impressions': ['impressionCount'],
+    'clicks': ['clickCount'],
+  },
+  'facebook': {
+    'likes': ['post_reactions_by_type_total'],
+    'impressions': ['post_impressions', 'reach'],
+    'clicks': ['post_clicks'],
+  },
+  'instagram': {
+    'likes': ['like_count'],
+    'comments': ['comments_count'],
+    'saves': ['saved'],
+    'impressions': ['reach', 'plays'],
+  },
+  'tiktok': {
+    'likes': ['digg_count', 'like_count'],
+    'comments': ['comment_count'],
+    'shares': ['share_count'],
+    'saves': ['collect_count'],
+    'impressions': ['play_count', 'view_count'],
+  },
+  'youtube': {
+    'likes': ['likeCount'],
+    'comments': ['commentCount'],
+    'shares': ['shareCount'],
+    'saves': ['favoriteCount'],
+    'impressions': ['viewCount', 'impressions_count'],
+  },
+  'pinterest': {
+    'likes': ['reactions_count'],
+    'saves': ['save', 'saves_count'],
+    'impressions': ['impression'],
+    'clicks': ['outbound_click', 'pin_click'],
+  },
+}
+
+
+# Aliases that count as absent when 0 or null, as `normalize_metrics()`'s `or` does.
+FALLS_THROUGH_WHEN_EMPTY = {'likes'}
+
+
+def aliases_for(platform: str) -> dict[str, list[str]]:
+  extra = PLATFORM_ALIASES.get(platform.lower(), {})
+  return {field: names + extra.get(field, []) for field, names in ALIASES.items()}
+
+
+def _number(value) -> float:
+  if isinstance(value, (int, float)):
+    return value
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return 0.0
+
+
+def _column(records: list[dict], name: str) -> np.ndarray:
+  n = len(records)
+  try:
+    return np.fromiter((r.get(name) or 0 for r in records), dtype=np.float64, count=n)
+  except (TypeError, ValueError):
+    return np.fromiter((_number(r.get(name) or 0) for r in records), dtype=np.float64, count=n)
+
+
+def _present(records: list[dict], name: str) -> np.ndarray:
+  n = len(records)
+  if name in FALLS_THROUGH_WHEN_EMPTY:
+    return np.fromiter((bool(r.get(name)) for r in records), dtype=bool, count=n)
+  return np.fromiter((name in r for r in records), dtype=bool, count=n)
+
+
+def extract(records: list[dict], aliases: dict[str, list[str]]) -> dict[str, np.ndarray]:
+  """One float column per canonical field, taken from the first alias each record has."""
+  n = len(records)
+  columns = {}
+  for field, names in aliases.items():
+    column = np.zeros(n, dtype=np.float64)
+    missing = np.ones(n, dtype=bool)
+    for name in names:
+      take = missing & _present(records, name)
+      if take.any():
+        column[take] = _column(records, name)[take]
+        missing &= ~take
+        if not missing.any():
+          break
+    columns[field] = column
+  return columns
+
+
+def safe_rate(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+  """numerator / denominator rounded to 4 places, 0 where the denominator is 0.
+
+  `np.round` scales before rounding, so a rate can differ from `round(x, 4)` in
+  the last place when it sits on a tie.
+  """
+  out = np.zeros_like(numerator, dtype=np.float64)
+  np.divide(numerator, denominator, out=out, where=denominator != 0)
+  return np.round(out, 4)
+
+
+def normalize_batch(platforms: list[str], raw: list[dict]) -> dict[str, np.ndarray]:
+  """Normalize `raw[i]` (reported by `platforms[i]`) into columnar arrays."""
+  n = len(raw)
+  by_platform: dict[str, list[int]] = {}
+  for i, platform in enumerate(platforms):
+    by_platform.setdefault(platform.lower(), []).append(i)
+  if len(by_platform) == 1:
+    columns = extract(raw, aliases_for(next(iter(by_platform))))
+  else:
+    columns = {field: np.zeros(n, dtype=np.float64) for field in ALIASES}
+    for platform, idx in by_platform.items():
+      group = extract([raw[i] for i in idx], aliases_for(platform))
+      positions = np.asarray(idx)
+      for field, values in group.items():
+        columns[field][positions] = values
+
+  engagements = columns['likes'] + columns['comments'] + columns['shares'] + columns['saves']
+  out = {field: columns[field].astype(np.int64) for field in COUNT_FIELDS}
+  out['ctr'] = safe_rate(columns['clicks'], columns['impressions'])
+  out['engagement_rate'] = safe_rate(engagements, columns['impressions'])
+  return out
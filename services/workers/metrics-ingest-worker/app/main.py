@@ -1,24 +1,66 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
-import asyncio
 import os
-import json
-from nats.aio.client import Client as NATS
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.batch import normalize_batch
 
-class MetricsIngestRequest(BaseModel):
+
+class MetricsIngestRequest(Message):
   request_id: str
   platform: str
   external_post_id: str
   metrics: dict  # raw metrics from platform
+  published_at: str | None = None  # ISO 8601; feeds schedule-worker heatmaps
+  region: str | None = None
 
 
-class MetricsIngestResponse(BaseModel):
+class MetricsIngestResponse(Message):
   request_id: str
   normalized: dict
+  platform: str | None = None
+  external_post_id: str | None = None
+  published_at: str | None = None
+  region: str | None = None
+
+
+class MetricsRecord(Message, kw_only=True):
+  external_post_id: str
+  platform: str | None = None  # defaults to the batch platform
+  metrics: dict
+  published_at: str | None = None
+  region: str | None = None
+
+
+class MetricsIngestBatchRequest(Message, kw_only=True):
+  request_id: str
+  platform: str | None = None
+  records: list[MetricsRecord]
+
+
+class MetricsProcessedBatch(Message):
+  """Columnar results: `columns[field][i]` belongs to `external_post_ids[i]`."""
+  request_id: str
+  offset: int
+  count: int
+  total: int
+  external_post_ids: list[str]
+  platforms: list[str]
+  columns: dict[str, list]
+  published_at: list[str | None] | None = None
+  regions: list[str | None] | None = None
 
 
 app = FastAPI(title="Metrics Ingest Worker", version="0.1.0")
+runtime = WorkerRuntime('metrics-ingest-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+
+BATCH_CHUNK = int(os.getenv('METRICS_BATCH_CHUNK', '5000'))
+# Room left in max_payload for the subject, headers and protocol framing.
+PAYLOAD_HEADROOM = 4096
 
 
 @app.get('/health')
@@ -46,25 +88,66 @@ def normalize_metrics(raw: dict) -> dict:
   }
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    payload = json.loads(msg.data.decode())
-    req = MetricsIngestRequest(**payload)
-    normalized = normalize_metrics(req.metrics)
-    resp = MetricsIngestResponse(request_id=req.request_id, normalized=normalized)
-    await nc.publish('metrics.processed', json.dumps(resp.model_dump()).encode())
-
-  await nc.subscribe('metrics.ingest', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@runtime.subscribe('metrics.ingest')
+async def handle_request(msg):
+  req = decode(msg.data, MetricsIngestRequest)
+  normalized = normalize_metrics(req.metrics)
+  resp = MetricsIngestResponse(
+    request_id=req.request_id,
+    normalized=normalized,
+    platform=req.platform,
+    external_post_id=req.external_post_id,
+    published_at=req.published_at,
+    region=req.region,
+  )
+  await runtime.publish('metrics.processed', encode(resp))
+
+
+async def publish_columns(request_id: str, ids: list[str], platforms: list[str], columns: dict, offset: int, end: int,
+                          published_at: list | None = None, regions: list | None = None):
+  """Publish rows [offset, end) as one metrics.processed.batch, halving until it fits."""
+  chunk = MetricsProcessedBatch(
+    request_id=request_id,
+    offset=offset,
+    count=end - offset,
+    total=len(ids),
+    external_post_ids=ids[offset:end],
+    platforms=platforms[offset:end],
+    columns={field: values[offset:end].tolist() for field, values in columns.items()},
+    published_at=published_at[offset:end] if published_at else None,
+    regions=regions[offset:end] if regions else None,
+  )
+  data = encode(chunk)
+  if len(data) > runtime.max_payload - PAYLOAD_HEADROOM and end - offset > 1:
+    mid = (offset + end) // 2
+    await publish_columns(request_id, ids, platforms, columns, offset, mid, published_at, regions)
+    await publish_columns(request_id, ids, platforms, columns, mid, end, published_at, regions)
+    return
+  await runtime.publish('metrics.processed.batch', data)
+
+
+@runtime.subscribe('metrics.ingest.batch')
+async def handle_batch(msg):
+  try:
+    req = decode(msg.data, MetricsIngestBatchRequest)
+    ids = [r.external_post_id for r in req.records]
+    platforms = [r.platform or req.platform or '' for r in req.records]
+    columns = normalize_batch(platforms, [r.metrics for r in req.records])
+    # Only carried when the records have them, to keep the batches small.
+    published_at = [r.published_at for r in req.records] if any(r.published_at for r in req.records) else None
+    regions = [r.region for r in req.records] if any(r.region for r in req.records) else None
+    for offset in range(0, len(ids), BATCH_CHUNK):
+      end = min(offset + BATCH_CHUNK, len(ids))
+      await publish_columns(req.request_id, ids, platforms, columns, offset, end, published_at, regions)
+  except Exception as e:
+    await runtime.publish('metrics.failed', encode({'error': str(e)}))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
@@ -0,0 +1,44 @@
+import pytest
+
+from app.batch import COUNT_FIELDS, normalize_batch
+from app.main import normalize_metrics
+
+
+RECORDS = [
+  {'likes': 10, 'comments': 2, 'shares': 1, 'saves': 3, 'impressions': 400, 'clicks': 9},
+  {'reactions': 7, 'views': 300, 'clicks': 4},
+  {'likes': 0, 'reactions': 5, 'impressions': 80, 'clicks': 1},
+  {'likes': 6, 'reactions': 50, 'impressions': 0, 'views': 900, 'clicks': 2},
+  {'likes': None, 'reactions': 3, 'views': 120},
+  {'impressions': 250, 'views': 0, 'clicks': 0},
+  {'comments': 4},
+  {},
+]
+
+
+@pytest.mark.parametrize('platform', ['', 'twitter', 'facebook'])
+def test_batch_matches_single_record(platform):
+  columns = normalize_batch([platform] * len(RECORDS), RECORDS)
+  for i, raw in enumerate(RECORDS):
+    single = normalize_metrics(raw)
+    assert {field: int(columns[field][i]) for field in COUNT_FIELDS} == {field: single[field] for field in COUNT_FIELDS}
+    # np.round may differ from round() in the last place on a tie.
+    assert columns['ctr'][i] == pytest.approx(single['ctr'], abs=1e-4)
+
+
+def test_mixed_platforms_match_single_record():
+  platforms = ['twitter', 'linkedin', 'youtube', 'tiktok'] * 2
+  columns = normalize_batch(platforms, RECORDS)
+  for i, raw in enumerate(RECORDS):
+    single = normalize_metrics(raw)
+    assert {field: int(columns[field][i]) for field in COUNT_FIELDS} == {field: single[field] for field in COUNT_FIELDS}
+
+
+def test_platform_aliases_apply_after_generic_ones():
+  columns = normalize_batch(['twitter'] * 3, [
+    {'like_count': 8, 'impression_count': 200},
+    {'likes': 0, 'like_count': 8, 'impressions': 0, 'impression_count': 200},
+    {'likes': 2, 'like_count': 8, 'views': 50, 'impression_count': 200},
+  ])
+  assert columns['likes'].tolist() == [8, 8, 2]
+  assert columns['impressions'].tolist() == [200, 0, 50]
@@ -1,14 +1,17 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
-import os
-import json
 import random
-from nats.aio.client import Client as NATS
+from worker_common import RetryLater, WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.http import PlatformHttp, bearer_headers
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
+from worker_common.ratelimit import RateLimiter, account_key
 
 
-class PinterestPublishRequest(BaseModel):
+class PinterestPublishRequest(Message, kw_only=True):
   request_id: str
+  brand_id: str | None = None  # echoed on publish.success for duplicate detection
   board_id: str
   title: str
   description: str
@@ -17,13 +20,21 @@ class PinterestPublishRequest(BaseModel):
   credentials: dict
 
 
-class PinterestPublishResponse(BaseModel):
+class PinterestPublishResponse(Message):
   request_id: str
   external_id: str
   url: str | None = None
+  connector: str = 'pinterest'
+  brand_id: str | None = None
+  content: str | None = None
 
 
 app = FastAPI(title="Pinterest Connector", version="0.1.0")
+runtime = WorkerRuntime('pinterest-connector')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+http = PlatformHttp('pinterest')
+limiter = RateLimiter.from_env('pinterest')
 
 
 @app.get('/health')
@@ -32,40 +43,49 @@ async def health():
 
 
 async def publish_pinterest(req: PinterestPublishRequest) -> PinterestPublishResponse:
-  await asyncio.sleep(0.2)
-  external_id = f"pin_{random.randint(1_000_000, 9_999_999)}"
+  if http.enabled:
+    body = {'board_id': req.board_id, 'title': req.title, 'description': req.description}
+    if req.link:
+      body['link'] = req.link
+    if req.image_url:
+      body['media_source'] = {'source_type': 'image_url', 'url': req.image_url}
+    resp = await http.request('POST', '/v5/pins', json=body, headers=bearer_headers(req.credentials))
+    resp.raise_for_status()
+    external_id = resp.json()['id']
+  else:
+    await asyncio.sleep(0.2)
+    external_id = f"pin_{random.randint(1_000_000, 9_999_999)}"
   return PinterestPublishResponse(request_id=req.request_id, external_id=external_id, url=None)
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    payload = json.loads(msg.data.decode())
-    req = PinterestPublishRequest(**payload)
-    retries = 3
-    backoff = 0.5
-    for attempt in range(1, retries + 1):
-      try:
-        resp = await publish_pinterest(req)
-        await nc.publish('publish.success', json.dumps(resp.model_dump()).encode())
-        return
-      except Exception as e:
-        if attempt == retries:
-          await nc.publish('publish.failed', json.dumps({'request_id': req.request_id, 'error': str(e)}).encode())
-        else:
-          await asyncio.sleep(backoff)
-          backoff *= 2
-
-  await nc.subscribe('publish.pinterest', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@runtime.subscribe('publish.pinterest', idempotent=True)
+async def handle_request(msg):
+  req = decode(msg.data, PinterestPublishRequest)
+  try:
+    resp = await limiter.run(
+      account_key(req.credentials),
+      lambda: publish_pinterest(req),
+      attempt=runtime.attempt(msg),
+      attempts=runtime.config.max_deliver,
+    )
+  except RetryLater:
+    raise
+  except Exception as e:
+    await runtime.publish('publish.failed', encode({'request_id': req.request_id, 'connector': 'pinterest', 'error': str(e)}))
+    return
+  if req.brand_id:
+    resp.brand_id, resp.content = req.brand_id, req.description
+  await runtime.publish('publish.success', encode(resp))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await http.start()
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  await http.close()
+  await limiter.close()
@@ -0,0 +1,167 @@
+"""Compiled, hot-reloadable policy rulesets.
+
+Rules live in JSON files under POLICY_RULES_DIR: `default.json` applies to every
+platform and `<platform>.json` extends it (term/pattern lists are appended,
+scalar settings override). Each platform's rules are compiled once into a
+single regex: literal terms become one trie-shaped alternation and regex
+patterns are appended as extra alternatives, so the content is scanned once
+per check no matter how many terms a platform has.
+"""
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+DEFAULT_RULES_DIR = Path(__file__).resolve().parent.parent / 'rules'
+
+
+def trie_pattern(terms: list[str]) -> str:
+  """Regex for an alternation of literal `terms`, factored as a trie.
+
+  `["buy now", "buy it"]` becomes `buy\\ (?:now|it)`, so the regex engine walks
+  shared prefixes once instead of trying every term at every position.
+  """
+  trie: dict = {}
+  for term in terms:
+    node = trie
+    for ch in term:
+      node = node.setdefault(ch, {})
+    node[''] = {}
+
+  def build(node: dict) -> str:
+    end = '' in node
+    branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+      return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    return f"(?:{body})?" if end else body
+
+  return build(trie)
+
+
+@dataclass
+class RuleSpec:
+  terms: list[str] = field(default_factory=list)
+  patterns: list[str] = field(default_factory=list)
+  inline_links: bool = True
+  max_hashtags: int | None = None
+
+  def extend(self, data: dict) -> 'RuleSpec':
+    return RuleSpec(
+      terms=self.terms + list(data.get('terms', [])),
+      patterns=self.patterns + list(data.get('patterns', [])),
+      inline_links=data.get('inline_links', self.inline_links),
+      max_hashtags=data.get('max_hashtags', self.max_hashtags),
+    )
+
+
+class CompiledRuleset:
+  """One platform's rules compiled into a single-pass matcher."""
+
+  def __init__(self, spec: RuleSpec):
+    self.spec = spec
+    # Issue order follows rule definition order: terms, then patterns.
+    self._term_index: dict[str, int] = {}
+    self._labels: list[str] = []
+    for term in spec.terms:
+      key = term.lower()
+      if key and key not in self._term_index:
+        self._term_index[key] = len(self._labels)
+        self._labels.append(term)
+    self._term_lengths = sorted({len(t) for t in self._term_index}, reverse=True)
+    self._patterns = [re.compile(p, re.IGNORECASE) for p in spec.patterns]
+
+    alternatives = []
+    if self._term_index:
+      alternatives.append(f"(?P<term>{trie_pattern(list(self._term_index))})")
+    alternatives.extend(f"(?:{p})" for p in spec.patterns)
+    if not spec.inline_links:
+      alternatives.append('(?-i:http)')
+    if spec.max_hashtags is not None:
+      alternatives.append('#')
+    self._scanner = re.compile('|'.join(alternatives), re.IGNORECASE) if alternatives else None
+
+  def check(self, content: str) -> list[str]:
+    found: set[int] = set()
+    has_link = False
+    hashtags = 0
+    scanner = self._scanner
+    n_terms = len(self._labels)
+    pos = 0
+    while scanner is not None:
+      m = scanner.search(content, pos)
+      if m is None:
+        break
+      start = m.start()
+      term = m.group('term') if n_terms else None
+      if term:
+        matched = term.lower()
+        found.add(self._term_index[matched])
+        # Shorter terms that are prefixes of the longest match at this position.
+        for length in self._term_lengths:
+          if length < len(matched):
+            idx = self._term_index.get(matched[:length])
+            if idx is not None:
+              found.add(idx)
+      for i, pat in enumerate(self._patterns):
+        if pat.match(content, start):
+          found.add(n_terms + i)
+      if content.startswith('http', start):
+        has_link = True
+      elif content[start] == '#':
+        hashtags += 1
+      pos = start + 1
+
+    labels = self._labels + self.spec.patterns
+    issues = [f"Contains banned term: {labels[i]}" for i in sorted(found)]
+    if not self.spec.inline_links and has_link:
+      issues.append("Inline links discouraged on this platform")
+    if self.spec.max_hashtags is not None and hashtags > self.spec.max_hashtags:
+      issues.append("Too many hashtags")
+    return issues
+
+
+class PolicyEngine:
+  """Per-platform compiled rulesets loaded from a directory, reloaded on change."""
+
+  def __init__(self, rules_dir: str | Path | None = None):
+    self.rules_dir = Path(rules_dir or os.getenv('POLICY_RULES_DIR') or DEFAULT_RULES_DIR)
+    self._rulesets: dict[str, CompiledRuleset] = {}
+    self._default = CompiledRuleset(RuleSpec())
+    self._mtimes: dict[str, float] = {}
+    self._lock = threading.Lock()
+    self.version = 0
+
+  def _scan(self) -> dict[str, float]:
+    return {p.name: p.stat().st_mtime for p in self.rules_dir.glob('*.json')}
+
+  def load(self):
+    """Read and compile every ruleset, then swap them in at once."""
+    with self._lock:
+      mtimes = self._scan()
+      raw = {name[:-len('.json')]: json.loads((self.rules_dir / name).read_text()) for name in mtimes}
+      base = RuleSpec().extend(raw.pop('default', {}))
+      rulesets = {platform: CompiledRuleset(base.extend(data)) for platform, data in raw.items()}
+      self._default = CompiledRuleset(base)
+      self._rulesets = rulesets
+      self._mtimes = mtimes
+      self.version += 1
+
+  def reload_if_changed(self) -> bool:
+    if self._scan() == self._mtimes:
+      return False
+    self.load()
+    return True
+
+  @property
+  def platforms(self) -> list[str]:
+    return sorted(self._rulesets)
+
+  def ruleset(self, platform: str) -> CompiledRuleset:
+    return self._rulesets.get(platform.lower(), self._default)
+
+  def check(self, platform: str, content: str) -> list[str]:
+    return self.ruleset(platform).check(content)
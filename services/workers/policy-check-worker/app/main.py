@@ -1,26 +1,66 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
+import logging
 import os
-import json
-import re
-from nats.aio.client import Client as NATS
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.engine import PolicyEngine
 
-class PolicyRequest(BaseModel):
+
+logger = logging.getLogger(__name__)
+
+
+class PolicyRequest(Message):
   request_id: str
   platform: str
   content: str
 
 
-class PolicyResponse(BaseModel):
+class PolicyResponse(Message):
   request_id: str
   platform: str
   approved: bool
   issues: list[str]
 
 
+class PolicyBatchItem(Message, kw_only=True):
+  id: str | None = None
+  platform: str
+  content: str
+
+
+class PolicyBatchRequest(Message):
+  request_id: str
+  items: list[PolicyBatchItem]
+
+
+class PolicyBatchResult(Message, kw_only=True):
+  id: str | None = None
+  platform: str
+  approved: bool
+  issues: list[str]
+
+
+class PolicyBatchResponse(Message):
+  request_id: str
+  results: list[PolicyBatchResult]
+  approved: int
+  rejected: int
+  rules_version: int
+
+
 app = FastAPI(title="Policy Check Worker", version="0.1.0")
+runtime = WorkerRuntime('policy-check-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+engine = PolicyEngine()
+engine.load()
+
+RELOAD_INTERVAL = float(os.getenv('POLICY_RELOAD_INTERVAL', '5'))
+_reload_task: asyncio.Task | None = None
 
 
 @app.get('/health')
@@ -28,42 +68,79 @@ async def health():
   return {"status": "ok", "service": "policy-check-worker"}
 
 
+@app.get('/rules')
+async def rules():
+  return {
+    "version": engine.version,
+    "rules_dir": str(engine.rules_dir),
+    "platforms": engine.platforms,
+  }
+
+
 def check_policy(platform: str, content: str) -> list[str]:
-  issues: list[str] = []
-  banned = [r"free money", r"guaranteed", r"buy now", r"click here", r"\bDM\b"]
-  for pat in banned:
-    if re.search(pat, content, re.IGNORECASE):
-      issues.append(f"Contains banned term: {pat}")
-  if platform in ("instagram", "tiktok") and "http" in content:
-    issues.append("Inline links discouraged on this platform")
-  if content.count('#') > 30:
-    issues.append("Too many hashtags")
-  return issues
-
-
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    try:
-      payload = json.loads(msg.data.decode())
-      req = PolicyRequest(**payload)
-      issues = check_policy(req.platform, req.content)
-      resp = PolicyResponse(request_id=req.request_id, platform=req.platform, approved=len(issues) == 0, issues=issues)
-      subject = 'policy.approved' if resp.approved else 'policy.rejected'
-      await nc.publish(subject, json.dumps(resp.model_dump()).encode())
-    except Exception as e:
-      await nc.publish('policy.failed', json.dumps({'error': str(e)}).encode())
-
-  await nc.subscribe('policy.check', cb=handle_request)
+  return engine.check(platform, content)
+
+
+async def reload_rules_periodically():
   while True:
-    await asyncio.sleep(3600)
+    await asyncio.sleep(RELOAD_INTERVAL)
+    try:
+      if await asyncio.to_thread(engine.reload_if_changed):
+        logger.info("policy rules reloaded (version %d)", engine.version)
+    except Exception:
+      # Keep serving the last good rulesets until the files are fixed.
+      logger.exception("policy rules reload failed")
+
+
+@runtime.subscribe('policy.check')
+async def handle_request(msg):
+  try:
+    req = decode(msg.data, PolicyRequest)
+    issues = check_policy(req.platform, req.content)
+    resp = PolicyResponse(request_id=req.request_id, platform=req.platform, approved=len(issues) == 0, issues=issues)
+    subject = 'policy.approved' if resp.approved else 'policy.rejected'
+    await runtime.publish(subject, encode(resp))
+  except Exception as e:
+    await runtime.publish('policy.failed', encode({'error': str(e)}))
+
+
+@runtime.subscribe('policy.check.batch')
+async def handle_batch(msg):
+  try:
+    req = decode(msg.data, PolicyBatchRequest)
+    results = []
+    for item in req.items:
+      issues = check_policy(item.platform, item.content)
+      results.append(PolicyBatchResult(id=item.id, platform=item.platform, approved=not issues, issues=issues))
+    approved = sum(r.approved for r in results)
+    resp = PolicyBatchResponse(
+      request_id=req.request_id,
+      results=results,
+      approved=approved,
+      rejected=len(results) - approved,
+      rules_version=engine.version,
+    )
+    await runtime.publish('policy.batch.complete', encode(resp))
+  except Exception as e:
+    await runtime.publish('policy.failed', encode({'error': str(e)}))
+
+
+@runtime.subscribe('policy.rules.reload', durable=False)
+async def handle_reload(msg):
+  await asyncio.to_thread(engine.load)
+  logger.info("policy rules reloaded on request (version %d)", engine.version)
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  global _reload_task
+  await runtime.start()
+  if RELOAD_INTERVAL > 0:
+    _reload_task = asyncio.create_task(reload_rules_periodically())
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  if _reload_task is not None:
+    _reload_task.cancel()
+  await runtime.stop()
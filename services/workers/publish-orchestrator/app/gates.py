@@ -0,0 +1,134 @@
+"""Per-connector in-flight caps with priority lanes.
+
+A post counts as in flight from the moment it is forwarded to its connector
+until the connector reports `publish.success` / `publish.failed` for it (or
+`ttl` passes, in case the reply is lost). While a connector is at its cap,
+waiting posts are admitted lowest priority rank first, FIFO within a rank, so
+scheduled-now posts overtake backfill.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+
+
+class Gate:
+  """In-flight slots of one connector."""
+
+  def __init__(self, cap: int, ttl: float):
+    self.cap = cap
+    self.ttl = ttl
+    self._in_flight: dict[str, deque[float]] = {}  # request_id -> admission times
+    self._count = 0
+    self._waiters: list[tuple[int, int, asyncio.Future]] = []
+    self._seq = itertools.count()
+
+  @property
+  def in_flight(self) -> int:
+    return self._count
+
+  @property
+  def waiting(self) -> int:
+    return sum(1 for *_, fut in self._waiters if not fut.done())
+
+  def _record(self, request_id: str):
+    self._in_flight.setdefault(request_id, deque()).append(time.monotonic())
+
+  def _expire(self):
+    cutoff = time.monotonic() - self.ttl
+    for request_id in [r for r, times in self._in_flight.items() if times[0] < cutoff]:
+      times = self._in_flight[request_id]
+      while times and times[0] < cutoff:
+        times.popleft()
+        self._count -= 1
+      if not times:
+        del self._in_flight[request_id]
+
+  async def acquire(self, request_id: str, priority: int, timeout: float | None = None) -> bool:
+    """Take a slot for `request_id`; False if none frees up within `timeout`."""
+    if self._count >= self.cap:
+      self._expire()
+    if self._count < self.cap and not self._waiters:
+      self._count += 1
+      self._record(request_id)
+      return True
+    fut = asyncio.get_running_loop().create_future()
+    heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+    self._wake()
+    if not fut.done():
+      try:
+        await asyncio.wait_for(asyncio.shield(fut), timeout)
+      except asyncio.TimeoutError:
+        if not fut.done():
+          fut.cancel()
+          return False
+      except asyncio.CancelledError:
+        if fut.done() and not fut.cancelled():
+          self._count -= 1  # admitted just as we were cancelled: hand the slot on
+          self._wake()
+        fut.cancel()
+        raise
+    self._record(request_id)
+    return True
+
+  def release(self, request_id: str) -> bool:
+    times = self._in_flight.get(request_id)
+    if not times:
+      return False
+    times.popleft()
+    if not times:
+      del self._in_flight[request_id]
+    self._count -= 1
+    self._wake()
+    return True
+
+  def _wake(self):
+    # A woken waiter holds its slot from here on; `acquire` records its request id.
+    while self._waiters and self._count < self.cap:
+      *_, fut = heapq.heappop(self._waiters)
+      if not fut.done():
+        fut.set_result(None)
+        self._count += 1
+
+
+class Gates:
+  """One `Gate` per connector, sized from the environment.
+
+  `PUBLISH_MAX_IN_FLIGHT` (default 64) caps every connector unless
+  `PUBLISH_MAX_IN_FLIGHT_<CONNECTOR>` overrides it; `PUBLISH_IN_FLIGHT_TTL`
+  (seconds, default 600) forgets posts whose reply never arrived.
+  """
+
+  def __init__(self, default_cap: int = 64, ttl: float = 600.0, caps: dict[str, int] | None = None):
+    self.default_cap = default_cap
+    self.ttl = ttl
+    self.caps = caps or {}
+    self._gates: dict[str, Gate] = {}
+
+  @classmethod
+  def from_env(cls) -> 'Gates':
+    prefix = 'PUBLISH_MAX_IN_FLIGHT_'
+    caps = {name[len(prefix):].lower(): int(value) for name, value in os.environ.items() if name.startswith(prefix) and value}
+    return cls(
+      default_cap=int(os.getenv('PUBLISH_MAX_IN_FLIGHT', '64')),
+      ttl=float(os.getenv('PUBLISH_IN_FLIGHT_TTL', '600')),
+      caps=caps,
+    )
+
+  def gate(self, connector: str) -> Gate:
+    gate = self._gates.get(connector)
+    if gate is None:
+      gate = self._gates[connector] = Gate(self.caps.get(connector, self.default_cap), self.ttl)
+    return gate
+
+  def release(self, connector: str, request_id: str) -> bool:
+    gate = self._gates.get(connector)
+    return gate.release(request_id) if gate else False
+
+  def stats(self) -> dict:
+    return {
+      name: {'cap': gate.cap, 'in_flight': gate.in_flight, 'waiting': gate.waiting}
+      for name, gate in sorted(self._gates.items())
+    }
@@ -1,18 +1,29 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
 import os
-import json
-from nats.aio.client import Client as NATS
+from worker_common import RetryLater, WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.gates import Gates
+from app.routing import Route, fan_out, request_id_of, route
 
-class OrchestrateRequest(BaseModel):
-  request_id: str
-  platform: str
-  payload: dict
 
+class Reply(Message):
+  """The fields of a publish.success/failed message that free a connector slot."""
+  connector: str | None = None
+  request_id: str | None = None
 
 app = FastAPI(title="Publish Orchestrator", version="0.1.0")
+# Posts waiting for a connector slot are parked futures, so allow many handlers.
+runtime = WorkerRuntime('publish-orchestrator', max_concurrency=256, fetch_batch=64)
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+gates = Gates.from_env()
+
+# How long a post may wait for its connector before going back to JetStream.
+MAX_WAIT = float(os.getenv('PUBLISH_MAX_WAIT', '10'))
 
 
 @app.get('/health')
@@ -20,36 +31,78 @@ async def health():
   return {"status": "ok", "service": "publish-orchestrator"}
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    payload = json.loads(msg.data.decode())
-    req = OrchestrateRequest(**payload)
-    subject_map = {
-      'twitter': 'publish.twitter',
-      'linkedin': 'publish.linkedin',
-      'facebook': 'publish.meta',
-      'instagram': 'publish.meta',
-      'tiktok': 'publish.tiktok',
-      'youtube': 'publish.youtube',
-      'pinterest': 'publish.pinterest',
-      'buffer': 'publish.buffer',
-      'hootsuite': 'publish.buffer',
-    }
-    subject = subject_map.get(req.platform)
-    if subject:
-      await nc.publish(subject, json.dumps(req.payload).encode())
-
-  await nc.subscribe('publish.orchestrate', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@app.get('/inflight')
+async def inflight():
+  return gates.stats()
+
+
+async def fail(request_id: str, platform: str, error: str):
+  await runtime.publish('publish.failed', encode({'request_id': request_id, 'platform': platform, 'error': error}))
+
+
+async def forward(r: Route, timeout: float | None = MAX_WAIT):
+  connector = r.connector
+  if connector is None:
+    await fail(r.request_id, r.platform, f"unknown platform: {r.platform}")
+    return
+  gate = gates.gate(connector)
+  if not await gate.acquire(r.request_id, r.priority, timeout=timeout):
+    # Backfill goes back to the stream for longer than scheduled-now posts.
+    raise RetryLater(MAX_WAIT / 4 * (1 + max(0, r.priority)), f"{connector} at its in-flight cap")
+  try:
+    await runtime.publish(f"publish.{connector}", r.data)
+  except Exception:
+    gate.release(r.request_id)
+    raise
+
+
+@runtime.subscribe('publish.orchestrate')
+async def handle_request(msg):
+  try:
+    r = route(msg.data, msg.headers)
+  except ValueError as e:
+    # A redelivery cannot fix a malformed message.
+    await fail(request_id_of(msg.data, msg.headers), '', f"malformed publish request: {e}")
+    return
+  await forward(r)
+
+
+@runtime.subscribe('publish.orchestrate.batch')
+async def handle_batch(msg):
+  """Fan out to every platform, waiting for slots as long as needed.
+
+  A partly forwarded batch cannot be redelivered without duplicating posts, so
+  the message is kept alive while platforms wait instead of being retried.
+  """
+  try:
+    routes = fan_out(msg.data, msg.headers)
+  except ValueError as e:
+    await fail(request_id_of(msg.data, msg.headers), '', f"malformed publish batch: {e}")
+    return
+  jobs = [asyncio.ensure_future(forward(r, timeout=None)) for r in routes]
+  pending = set(jobs)
+  while pending:
+    _, pending = await asyncio.wait(pending, timeout=runtime.config.ack_wait / 2)
+    if pending and runtime.config.jetstream:
+      await msg.in_progress()
+  for r, job in zip(routes, jobs):
+    if job.exception() is not None:
+      await fail(r.request_id, r.platform, str(job.exception()))
+
+
+@runtime.subscribe('publish.success', durable=False)
+@runtime.subscribe('publish.failed', durable=False)
+async def handle_reply(msg):
+  reply = decode(msg.data, Reply)
+  if reply.connector and reply.request_id:
+    gates.release(reply.connector, reply.request_id)
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
@@ -0,0 +1,150 @@
+"""Routing of publish.orchestrate messages without re-encoding the payload.
+
+A message is routed either by NATS headers, in which case the body is the
+connector payload itself and is forwarded as-is:
+
+  Platform: twitter
+  Request-Id: r-1
+  Priority: now            (optional)
+
+or by the JSON envelope `{"request_id", "platform", "payload", "priority"}`.
+The envelope is decoded with `payload` kept as `msgspec.Raw`, so only the
+routing fields are parsed and the payload bytes are forwarded untouched.
+
+A route's `request_id` is the payload's own `request_id`, the one connectors
+echo on publish.success/failed, so the in-flight slot it takes is released
+under the same id; the header or envelope id is only a fallback for payloads
+without one. Messages that cannot be routed raise `ValueError`.
+
+Batches (`publish.orchestrate.batch`) fan one payload out to several
+platforms, with optional per-platform payloads:
+
+  {"request_id": "r-1", "platforms": ["twitter", "linkedin"],
+   "payload": {...}, "payloads": {"linkedin": {...}}, "priority": "backfill"}
+"""
+from dataclasses import dataclass
+
+import msgspec
+
+
+# platform -> connector; the connector consumes `publish.<connector>`.
+CONNECTORS: dict[str, str] = {
+  'twitter': 'twitter',
+  'x': 'twitter',
+  'linkedin': 'linkedin',
+  'facebook': 'meta',
+  'instagram': 'meta',
+  'meta': 'meta',
+  'tiktok': 'tiktok',
+  'youtube': 'youtube',
+  'pinterest': 'pinterest',
+  'buffer': 'buffer',
+  'hootsuite': 'buffer',
+}
+
+# Lower runs first. Unknown names fall back to `normal`.
+PRIORITIES: dict[str, int] = {
+  'now': 0,
+  'high': 0,
+  'normal': 1,
+  'scheduled': 1,
+  'backfill': 2,
+  'low': 2,
+}
+DEFAULT_PRIORITY = PRIORITIES['normal']
+
+
+class Envelope(msgspec.Struct):
+  request_id: str
+  platform: str
+  payload: msgspec.Raw
+  priority: str | int | None = None
+
+
+class BatchEnvelope(msgspec.Struct):
+  platforms: list[str]
+  request_id: str | None = None
+  payload: msgspec.Raw = msgspec.Raw()
+  payloads: dict[str, msgspec.Raw] = {}
+  priority: str | int | None = None
+
+
+class _RequestId(msgspec.Struct):
+  request_id: str | None = None
+
+
+_envelope = msgspec.json.Decoder(Envelope)
+_batch = msgspec.json.Decoder(BatchEnvelope)
+_request_id = msgspec.json.Decoder(_RequestId)
+
+
+@dataclass
+class Route:
+  request_id: str
+  platform: str
+  priority: int
+  data: bytes
+
+  @property
+  def connector(self) -> str | None:
+    return CONNECTORS.get(self.platform)
+
+
+def rank(priority: str | int | None) -> int:
+  if priority is None:
+    return DEFAULT_PRIORITY
+  if isinstance(priority, int):
+    return priority
+  priority = priority.strip().lower()
+  if priority.lstrip('-').isdigit():
+    return int(priority)
+  return PRIORITIES.get(priority, DEFAULT_PRIORITY)
+
+
+def _header(headers: dict | None, name: str) -> str | None:
+  if not headers:
+    return None
+  return headers.get(name) or headers.get(name.lower())
+
+
+def _payload_request_id(payload: bytes, fallback: str | None) -> str:
+  """The request id a connector replies with for `payload`."""
+  return _request_id.decode(payload).request_id or fallback or ''
+
+
+def request_id_of(data: bytes, headers: dict | None = None) -> str:
+  """Best-effort request id of a message that could not be routed, for its publish.failed."""
+  try:
+    return _header(headers, 'Request-Id') or _request_id.decode(data).request_id or ''
+  except msgspec.MsgspecError:
+    return ''
+
+
+def route(data: bytes, headers: dict | None = None) -> Route:
+  """Routing fields of one publish.orchestrate message plus the bytes to forward."""
+  platform = _header(headers, 'Platform')
+  if platform:
+    request_id = _payload_request_id(data, _header(headers, 'Request-Id'))
+    return Route(request_id, platform.lower(), rank(_header(headers, 'Priority')), data)
+  env = _envelope.decode(data)
+  payload = bytes(env.payload)
+  return Route(_payload_request_id(payload, env.request_id), env.platform.lower(), rank(env.priority), payload)
+
+
+def fan_out(data: bytes, headers: dict | None = None) -> list[Route]:
+  """One route per platform of a publish.orchestrate.batch message."""
+  env = _batch.decode(data)
+  priority = rank(_header(headers, 'Priority') or env.priority)
+  payloads = {platform.lower(): payload for platform, payload in env.payloads.items()}
+  routes, seen = [], set()
+  for platform in dict.fromkeys(p.lower() for p in env.platforms):
+    payload = bytes(payloads.get(platform, env.payload))
+    if not payload:
+      raise ValueError(f"no payload for {platform}")
+    # facebook + instagram share a connector: send an identical payload once.
+    key = (CONNECTORS.get(platform, platform), payload)
+    if key in seen:
+      continue
+    seen.add(key)
+    routes.append(Route(_payload_request_id(payload, env.request_id), platform, priority, payload))
+  return routes
@@ -0,0 +1,67 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app import main
+from app.gates import Gates
+from app.routing import fan_out, route
+
+
+PAYLOAD = {'request_id': 'post-1', 'content': 'hello', 'credentials': {'access_token': 't'}}
+
+
+@pytest.fixture
+def published(monkeypatch):
+  messages: list[tuple[str, bytes]] = []
+
+  async def publish(subject, data, headers=None):
+    messages.append((subject, data))
+
+  monkeypatch.setattr(main.runtime, 'publish', publish)
+  monkeypatch.setattr(main, 'gates', Gates(default_cap=1))
+  return messages
+
+
+def msg(subject: str, body, headers: dict | None = None) -> SimpleNamespace:
+  data = body if isinstance(body, bytes) else json.dumps(body).encode()
+  return SimpleNamespace(subject=subject, data=data, headers=headers)
+
+
+def test_routes_key_on_the_payload_request_id():
+  envelope = {'request_id': 'envelope-1', 'platform': 'twitter', 'payload': PAYLOAD}
+  assert route(json.dumps(envelope).encode()).request_id == 'post-1'
+  headers = {'Platform': 'twitter', 'Request-Id': 'header-1'}
+  assert route(json.dumps(PAYLOAD).encode(), headers).request_id == 'post-1'
+  batch = {'request_id': 'batch-1', 'platforms': ['twitter', 'linkedin'], 'payload': PAYLOAD}
+  assert [r.request_id for r in fan_out(json.dumps(batch).encode())] == ['post-1', 'post-1']
+  without = {'request_id': 'envelope-1', 'platform': 'twitter', 'payload': {'content': 'hello'}}
+  assert route(json.dumps(without).encode()).request_id == 'envelope-1'
+
+
+def test_connector_reply_releases_the_slot(published):
+  envelope = {'request_id': 'envelope-1', 'platform': 'twitter', 'payload': PAYLOAD}
+
+  async def scenario():
+    await main.handle_request(msg('publish.orchestrate', envelope))
+    assert main.gates.gate('twitter').in_flight == 1
+    await main.handle_reply(msg('publish.success', {'request_id': 'post-1', 'connector': 'twitter'}))
+    assert main.gates.gate('twitter').in_flight == 0
+
+  asyncio.run(scenario())
+  assert [subject for subject, _ in published] == ['publish.twitter']
+
+
+@pytest.mark.parametrize('handler, subject, body', [
+  (main.handle_request, 'publish.orchestrate', b'not json'),
+  (main.handle_request, 'publish.orchestrate', {'request_id': 'r-1', 'payload': PAYLOAD}),
+  (main.handle_batch, 'publish.orchestrate.batch', {'request_id': 'r-1', 'platforms': ['twitter']}),
+])
+def test_malformed_messages_fail_without_retry(published, handler, subject, body):
+  asyncio.run(handler(msg(subject, body)))  # returns instead of raising, so the message is acked
+  [(reply_subject, data)] = published
+  assert reply_subject == 'publish.failed'
+  failure = json.loads(data)
+  assert failure['request_id'] == ('' if body == b'not json' else 'r-1')
+  assert failure['error'].startswith('malformed publish')
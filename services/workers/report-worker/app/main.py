@@ -1,28 +1,54 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import FileResponse
 import asyncio
 import os
-import json
-from nats.aio.client import Client as NATS
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import csv
-import io
+from concurrent.futures import ProcessPoolExecutor
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.render import render_report
+from app.store import LocalObjectStore
 
-class ReportRequest(BaseModel):
+
+class ReportRequest(Message):
     request_id: str
     campaign_id: str
     format: str  # pdf, csv, json
     metrics: dict
+    posts: list[dict] = []  # per-post rows: post_id, platform, published_at, impressions, clicks, engagements
+    daily: list[dict] | None = None  # per-day rows; aggregated from posts when omitted
+    title: str | None = None
 
 
-class ReportResponse(BaseModel):
+class ReportResponse(Message):
     request_id: str
     report_url: str
+    format: str | None = None
+    size_bytes: int | None = None
 
 
 app = FastAPI(title="Report Worker", version="0.1.0")
+runtime = WorkerRuntime('report-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+store = LocalObjectStore.from_env()
+
+# Under the supervisor every worker process gets its share of the cores.
+RENDER_PROCESSES = int(os.getenv('REPORT_PROCESSES', str(max(1, (os.cpu_count() or 2) // int(os.getenv('WORKER_PROCESSES', '1'))))))
+RENDER_CONCURRENCY = int(os.getenv('REPORT_MAX_CONCURRENCY', str(RENDER_PROCESSES)))
+FORMATS = {'pdf', 'csv', 'json'}
+
+_pool: ProcessPoolExecutor | None = None
+_render_slots = asyncio.Semaphore(RENDER_CONCURRENCY)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES)
+    return _pool
 
 
 @app.get('/health')
@@ -30,55 +56,61 @@ async def health():
     return {"status": "ok", "service": "report-worker"}
 
 
-def generate_pdf_report(metrics: dict) -> bytes:
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    p.drawString(100, 750, "Campaign Report")
-    p.drawString(100, 700, f"Total Impressions: {metrics.get('impressions', 0)}")
-    p.drawString(100, 680, f"Total Clicks: {metrics.get('clicks', 0)}")
-    p.drawString(100, 660, f"CTR: {metrics.get('ctr', 0):.2%}")
-    p.showPage()
-    p.save()
-    return buffer.getvalue()
-
-
-def generate_csv_report(metrics: dict) -> str:
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Metric', 'Value'])
-    writer.writerow(['Impressions', metrics.get('impressions', 0)])
-    writer.writerow(['Clicks', metrics.get('clicks', 0)])
-    writer.writerow(['CTR', f"{metrics.get('ctr', 0):.2%}"])
-    return output.getvalue()
-
-
-async def start_nats_loop():
-    nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-    nc = NATS()
-    await nc.connect(servers=[nats_url])
-
-    async def handle_request(msg):
-        payload = json.loads(msg.data.decode())
-        req = ReportRequest(**payload)
-        
-        if req.format == 'pdf':
-            report_data = generate_pdf_report(req.metrics)
-            report_url = f"/reports/{req.campaign_id}.pdf"
-        elif req.format == 'csv':
-            report_data = generate_csv_report(req.metrics)
-            report_url = f"/reports/{req.campaign_id}.csv"
-        else:  # json
-            report_data = json.dumps(req.metrics, indent=2)
-            report_url = f"/reports/{req.campaign_id}.json"
-        
-        resp = ReportResponse(request_id=req.request_id, report_url=report_url)
-        await nc.publish('report.complete', json.dumps(resp.model_dump()).encode())
-
-    await nc.subscribe('report.generate', cb=handle_request)
-    while True:
-        await asyncio.sleep(3600)
+@app.get('/reports/{key:path}')
+async def download_report(key: str):
+    try:
+        path = store.path_for(key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Report not found")
+    return FileResponse(path)
+
+
+async def render(msg, req: ReportRequest, key: str) -> int:
+    """Render in the process pool, keeping the JetStream message alive meanwhile."""
+    async with _render_slots:
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(
+            get_pool(),
+            render_report,
+            str(store.path_for(key)),
+            req.format,
+            req.title or f"Campaign Report: {req.campaign_id}",
+            req.metrics,
+            req.posts,
+            req.daily,
+        )
+        while True:
+            done, _ = await asyncio.wait({job}, timeout=runtime.config.ack_wait / 2)
+            if done:
+                return job.result()
+            if runtime.config.jetstream:
+                await msg.in_progress()
+
+
+@runtime.subscribe('report.generate', idempotent=True)
+async def handle_request(msg):
+    try:
+        req = decode(msg.data, ReportRequest)
+        if req.format not in FORMATS:
+            req.format = 'json'
+        key = f"{req.campaign_id}/{req.request_id}.{req.format}"
+        size = await render(msg, req, key)
+
+        resp = ReportResponse(request_id=req.request_id, report_url=store.url_for(key), format=req.format, size_bytes=size)
+        await runtime.publish('report.complete', encode(resp))
+    except Exception as e:
+        await runtime.publish('report.failed', encode({'error': str(e)}))
 
 
 @app.on_event('startup')
 async def on_startup():
-    asyncio.create_task(start_nats_loop())
+    await runtime.start()
+
+
+@app.on_event('shutdown')
+async def on_shutdown():
+    await runtime.stop()
+    if _pool is not None:
+        _pool.shutdown()
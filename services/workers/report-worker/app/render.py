@@ -0,0 +1,234 @@
+"""Report renderers that write straight to the object store.
+
+Renderers are plain functions over plain data so they can run in a worker
+process. Each one writes its output to a temporary file next to the final key
+and renames it into place, so readers never see a partial report. Rows are
+written as they are produced: CSV and JSON output never exist in full in
+memory, and PDF pages are emitted table row by table row (reportlab still keeps
+the compressed page streams until `save()`).
+"""
+import csv
+import json
+import os
+from collections import defaultdict
+from pathlib import Path
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+
+POST_COLUMNS = ['post_id', 'platform', 'published_at', 'impressions', 'clicks', 'engagements', 'ctr']
+DAY_COLUMNS = ['date', 'posts', 'impressions', 'clicks', 'engagements', 'ctr']
+
+
+def _number(row: dict, key: str) -> float:
+    value = row.get(key) or 0
+    return value if isinstance(value, (int, float)) else float(value)
+
+
+def _ctr(clicks: float, impressions: float) -> float:
+    return clicks / impressions if impressions else 0.0
+
+
+def post_rows(posts: list[dict]):
+    for post in posts:
+        impressions = _number(post, 'impressions')
+        clicks = _number(post, 'clicks')
+        yield {
+            'post_id': post.get('post_id') or post.get('id') or '',
+            'platform': post.get('platform', ''),
+            'published_at': post.get('published_at', ''),
+            'impressions': impressions,
+            'clicks': clicks,
+            'engagements': _number(post, 'engagements'),
+            'ctr': post['ctr'] if 'ctr' in post else _ctr(clicks, impressions),
+        }
+
+
+def day_rows(posts: list[dict], daily: list[dict] | None):
+    """Per-day rows as given, or aggregated from the posts' `published_at` dates."""
+    if daily:
+        for day in daily:
+            impressions = _number(day, 'impressions')
+            clicks = _number(day, 'clicks')
+            yield {
+                'date': day.get('date', ''),
+                'posts': int(_number(day, 'posts')),
+                'impressions': impressions,
+                'clicks': clicks,
+                'engagements': _number(day, 'engagements'),
+                'ctr': day['ctr'] if 'ctr' in day else _ctr(clicks, impressions),
+            }
+        return
+    totals: dict[str, list[float]] = defaultdict(lambda: [0, 0, 0, 0])
+    for row in post_rows(posts):
+        day = totals[str(row['published_at'])[:10] or 'unknown']
+        day[0] += 1
+        day[1] += row['impressions']
+        day[2] += row['clicks']
+        day[3] += row['engagements']
+    for date in sorted(totals):
+        count, impressions, clicks, engagements = totals[date]
+        yield {
+            'date': date,
+            'posts': count,
+            'impressions': impressions,
+            'clicks': clicks,
+            'engagements': engagements,
+            'ctr': _ctr(clicks, impressions),
+        }
+
+
+def summary(metrics: dict, posts: list[dict]) -> dict:
+    """Every campaign metric as given, plus totals falling back to sums over the posts.
+
+    JSON reports carry the whole dict; CSV and PDF show the totals.
+    """
+    impressions = metrics.get('impressions')
+    clicks = metrics.get('clicks')
+    if impressions is None:
+        impressions = sum(_number(p, 'impressions') for p in posts)
+    if clicks is None:
+        clicks = sum(_number(p, 'clicks') for p in posts)
+    return {
+        **metrics,
+        'posts': len(posts) if posts else metrics.get('posts', 0),
+        'impressions': impressions,
+        'clicks': clicks,
+        'ctr': metrics.get('ctr', _ctr(clicks, impressions)),
+    }
+
+
+def _cell(column: str, value) -> str:
+    if column == 'ctr':
+        return f"{value:.2%}"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def write_csv(f, title: str, totals: dict, posts: list[dict], daily: list[dict] | None):
+    writer = csv.writer(f)
+    writer.writerow([title])
+    writer.writerow(['Metric', 'Value'])
+    writer.writerow(['Posts', totals['posts']])
+    writer.writerow(['Impressions', totals['impressions']])
+    writer.writerow(['Clicks', totals['clicks']])
+    writer.writerow(['CTR', f"{totals['ctr']:.2%}"])
+    for name, columns, rows in (
+        ('Per day', DAY_COLUMNS, day_rows(posts, daily)),
+        ('Per post', POST_COLUMNS, post_rows(posts)),
+    ):
+        writer.writerow([])
+        writer.writerow([name])
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_cell(c, row[c]) for c in columns])
+
+
+def write_json(f, title: str, totals: dict, posts: list[dict], daily: list[dict] | None):
+    f.write('{"title": %s, "summary": %s' % (json.dumps(title), json.dumps(totals)))
+    for name, rows in (('daily', day_rows(posts, daily)), ('posts', post_rows(posts))):
+        f.write(', "%s": [' % name)
+        for i, row in enumerate(rows):
+            f.write((', ' if i else '') + json.dumps(row))
+        f.write(']')
+    f.write('}\n')
+
+
+class _PdfTableWriter:
+    """Draws tables row by row, starting a new page whenever one fills up."""
+
+    margin = 50
+    line = 14
+
+    def __init__(self, path: str):
+        self.width, self.height = letter
+        self.pdf = canvas.Canvas(path, pagesize=letter, pageCompression=1)
+        self.y = self.height - self.margin
+        self.pages = 1
+
+    def new_page(self):
+        self.pdf.showPage()
+        self.pages += 1
+        self.y = self.height - self.margin
+
+    def text(self, x: float, value: str, font: str = 'Helvetica', size: int = 9):
+        self.pdf.setFont(font, size)
+        self.pdf.drawString(x, self.y, value)
+
+    def advance(self, lines: float = 1):
+        self.y -= self.line * lines
+        if self.y < self.margin:
+            self.new_page()
+
+    def heading(self, value: str, size: int = 13):
+        if self.y < self.margin + self.line * 4:
+            self.new_page()
+        self.text(self.margin, value, 'Helvetica-Bold', size)
+        self.advance(1.5)
+
+    def table(self, columns: list[str], rows):
+        step = (self.width - 2 * self.margin) / len(columns)
+
+        def header():
+            for i, column in enumerate(columns):
+                self.text(self.margin + i * step, column.replace('_', ' ').title(), 'Helvetica-Bold')
+            self.advance()
+
+        header()
+        for row in rows:
+            for i, column in enumerate(columns):
+                self.text(self.margin + i * step, _cell(column, row[column])[:24])
+            top = self.pages
+            self.advance()
+            if self.pages != top:
+                header()
+        self.advance()
+
+    def save(self):
+        self.pdf.save()
+
+
+def write_pdf(path: str, title: str, totals: dict, posts: list[dict], daily: list[dict] | None):
+    doc = _PdfTableWriter(path)
+    doc.heading(title, size=16)
+    doc.text(doc.margin, f"Posts: {totals['posts']}")
+    doc.advance()
+    doc.text(doc.margin, f"Total Impressions: {_cell('impressions', totals['impressions'])}")
+    doc.advance()
+    doc.text(doc.margin, f"Total Clicks: {_cell('clicks', totals['clicks'])}")
+    doc.advance()
+    doc.text(doc.margin, f"CTR: {totals['ctr']:.2%}")
+    doc.advance(2)
+    doc.heading('Per day')
+    doc.table(DAY_COLUMNS, day_rows(posts, daily))
+    doc.heading('Per post')
+    doc.table(POST_COLUMNS, post_rows(posts))
+    doc.save()
+
+
+def render_report(
+    path: str,
+    fmt: str,
+    title: str,
+    metrics: dict,
+    posts: list[dict],
+    daily: list[dict] | None = None,
+) -> int:
+    """Render one report to `path` atomically; returns its size in bytes."""
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    totals = summary(metrics, posts)
+    try:
+        if fmt == 'pdf':
+            write_pdf(str(tmp), title, totals, posts, daily)
+        else:
+            with open(tmp, 'w', newline='' if fmt == 'csv' else None, encoding='utf-8') as f:
+                (write_csv if fmt == 'csv' else write_json)(f, title, totals, posts, daily)
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return target.stat().st_size
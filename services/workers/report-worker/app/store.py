@@ -0,0 +1,25 @@
+"""Local directory standing in for the report object store (S3 in production)."""
+import os
+from pathlib import Path
+
+
+class LocalObjectStore:
+    def __init__(self, root: str | Path, public_url: str = '/reports'):
+        self.root = Path(root).resolve()
+        self.public_url = public_url.rstrip('/')
+
+    @classmethod
+    def from_env(cls) -> 'LocalObjectStore':
+        return cls(
+            os.getenv('REPORT_STORE_DIR', 'report-store'),
+            public_url=os.getenv('REPORT_PUBLIC_URL', '/reports'),
+        )
+
+    def path_for(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def url_for(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
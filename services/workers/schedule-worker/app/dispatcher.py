@@ -0,0 +1,399 @@
+"""Durable dispatcher for scheduled posts.
+
+Scheduled posts live in an append-only log; memory only holds where each
+pending post's record starts and when it is due:
+
+- posts due in the current bucket (`bucket` seconds, 60 by default) sit in a
+  heap of (due, offset)
+- later posts sit in per-bucket `array`s of dues and offsets (16 bytes a
+  post), moved into the heap when their bucket comes up
+
+Payloads stay on disk and are read back (`os.pread`) only when a post fires.
+Each pending post id also maps to the sequence number of its latest schedule,
+and only that record fires: scheduling an id again (a redelivered
+schedule.post included) replaces the earlier schedule, and a cancel drops the
+id. Fired posts get a `fired` record once they have been emitted, so a
+restart does not fire them again.
+
+On start the log is replayed (a torn tail from a crash is truncated) and
+overdue posts fire immediately. Once fired/cancelled records outnumber live
+ones the log is compacted in a worker thread: the live schedule records of a
+snapshot are copied to a new file while posts keep firing, then, between two
+batches, the records appended meanwhile are copied over and the new file
+replaces the old one.
+
+Log record: op (u8), seq (u64), due (f64), id length (u16), data length
+(u32), then the id and the data (the publish.orchestrate payload for a
+schedule, the schedule record's offset for `fired`).
+"""
+import array
+import asyncio
+import heapq
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE, CANCEL, FIRED = 1, 2, 3
+HEADER = struct.Struct('<BQdHI')
+OFFSET = struct.Struct('<Q')
+
+
+class ScheduleLog:
+  """Append-only record file with positional reads."""
+
+  def __init__(self, path: str | Path, fsync: bool = False):
+    self.path = Path(path)
+    self.fsync = fsync
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self._file = open(self.path, 'ab')
+    self._fd = os.open(self.path, os.O_RDONLY)
+    self.size = self._file.tell()
+    self._flushed = self.size
+    self._lock = threading.Lock()
+
+  def append(self, op: int, seq: int, due: float, post_id: str, data: bytes = b'') -> int:
+    key = post_id.encode()
+    with self._lock:
+      offset = self.size
+      self._file.write(HEADER.pack(op, seq, due, len(key), len(data)) + key + data)
+      self.size += HEADER.size + len(key) + len(data)
+      return offset
+
+  def sync(self):
+    """Make appended records survive a process crash (and a machine crash with `fsync`)."""
+    with self._lock:
+      self._file.flush()
+      self._flushed = self.size
+      if self.fsync:
+        os.fsync(self._file.fileno())
+
+  def read(self, offset: int) -> tuple[int, int, float, str, bytes]:
+    if offset >= self._flushed:
+      with self._lock:
+        self._file.flush()
+        self._flushed = self.size
+    header = os.pread(self._fd, HEADER.size, offset)
+    op, seq, due, key_len, data_len = HEADER.unpack(header)
+    body = os.pread(self._fd, key_len + data_len, offset + HEADER.size)
+    return op, seq, due, body[:key_len].decode(), body[key_len:]
+
+  def records(self, start: int):
+    """Yield (offset, op, seq, due, id, data) for the records from `start` to the end."""
+    offset = start
+    while offset < self.size:
+      op, seq, due, post_id, data = self.read(offset)
+      yield offset, op, seq, due, post_id, data
+      offset += HEADER.size + len(post_id.encode()) + len(data)
+
+  def scan(self):
+    """Yield (offset, op, seq, due, id, data) for every complete record; drop a torn tail.
+
+    Schedule payloads are not read (`data` is empty for them).
+    """
+    self.sync()
+    size = os.path.getsize(self.path)
+    offset = 0
+    if size:
+      with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while offset + HEADER.size <= size:
+          op, seq, due, key_len, data_len = HEADER.unpack_from(data, offset)
+          end = offset + HEADER.size + key_len + data_len
+          if end > size or op not in (SCHEDULE, CANCEL, FIRED):
+            break
+          start = offset + HEADER.size
+          yield offset, op, seq, due, data[start:start + key_len].decode(), data[start + key_len:end] if op == FIRED else b''
+          offset = end
+    if offset < size:
+      logger.warning("schedule log %s: dropping %d bytes of torn tail", self.path, size - offset)
+      with self._lock:
+        self._file.truncate(offset)
+        self.size = self._flushed = offset
+
+  def close(self):
+    with self._lock:
+      self._file.close()
+      os.close(self._fd)
+
+
+class Dispatcher:
+  def __init__(self, path: str | Path, bucket: float = 60.0, batch: int = 500, fsync: bool = False, compact_min: int = 100_000):
+    self.log = ScheduleLog(path, fsync=fsync)
+    self.bucket = bucket
+    self.batch = batch
+    self.compact_min = compact_min
+    self._heap: list[tuple[float, int]] = []
+    self._buckets: dict[int, tuple[array.array, array.array]] = {}
+    self._bucket_keys: list[int] = []
+    self._horizon = 0.0  # posts due before this are in the heap
+    self._wake_at = 0.0
+    self._latest: dict[str, int] = {}  # pending post id -> seq of the schedule that fires
+    self._seq = 0
+    self.pending = 0
+    self.dead = 0  # log records that compaction would drop
+    self.fired = 0
+    self._wakeup = asyncio.Event()
+    self._task: asyncio.Task | None = None
+    self._compaction: tuple[asyncio.Future, int] | None = None  # (write task, log size it copied)
+    self._emit: Callable[[list[bytes]], Awaitable[None]] | None = None
+
+  @classmethod
+  def from_env(cls) -> 'Dispatcher':
+    return cls(
+      os.getenv('SCHEDULE_LOG', 'schedule-data/dispatch.log'),
+      bucket=float(os.getenv('SCHEDULE_BUCKET_SECONDS', '60')),
+      batch=int(os.getenv('SCHEDULE_FIRE_BATCH', '500')),
+      fsync=os.getenv('SCHEDULE_LOG_FSYNC', '').lower() in ('1', 'true', 'yes'),
+      compact_min=int(os.getenv('SCHEDULE_COMPACT_MIN', '100000')),
+    )
+
+  # -- index -----------------------------------------------------------------
+
+  def _index(self, due: float, offset: int):
+    if due < self._horizon:
+      heapq.heappush(self._heap, (due, offset))
+      return
+    key = int(due // self.bucket)
+    entry = self._buckets.get(key)
+    if entry is None:
+      entry = self._buckets[key] = (array.array('d'), array.array('Q'))
+      heapq.heappush(self._bucket_keys, key)
+    entry[0].append(due)
+    entry[1].append(offset)
+
+  def _advance(self, now: float):
+    """Move every bucket that starts before the end of the current one into the heap."""
+    self._horizon = max(self._horizon, (int(now // self.bucket) + 1) * self.bucket)
+    while self._bucket_keys and self._bucket_keys[0] * self.bucket < self._horizon:
+      dues, offsets = self._buckets.pop(heapq.heappop(self._bucket_keys))
+      self._heap.extend(zip(dues, offsets))
+    heapq.heapify(self._heap)
+
+  def _next_due(self) -> float:
+    if self._heap:
+      return self._heap[0][0]
+    return self._horizon if self._bucket_keys else float('inf')
+
+  # -- commands --------------------------------------------------------------
+
+  def schedule(self, post_id: str, due: float, payload: bytes):
+    """Schedule `payload` for publish.orchestrate at `due` (epoch seconds).
+
+    A pending schedule of the same `post_id` is replaced.
+    """
+    self._seq += 1
+    offset = self.log.append(SCHEDULE, self._seq, due, post_id, payload)
+    self._latest[post_id] = self._seq
+    self._index(due, offset)
+    self.pending += 1
+    if due < self._wake_at:
+      self._wakeup.set()
+
+  def cancel(self, post_id: str):
+    self._seq += 1
+    self.log.append(CANCEL, self._seq, 0.0, post_id)
+    self._latest.pop(post_id, None)
+    self.dead += 1
+
+  def sync(self):
+    self.log.sync()
+
+  # -- replay / compaction ---------------------------------------------------
+
+  def replay(self):
+    dues, offsets, seqs = array.array('d'), array.array('Q'), array.array('Q')
+    records = 0
+    for offset, op, seq, due, post_id, data in self.log.scan():
+      records += 1
+      self._seq = max(self._seq, seq)
+      if op == SCHEDULE:
+        dues.append(due)
+        offsets.append(offset)
+        seqs.append(seq)
+        self._latest[post_id] = seq
+      elif op == CANCEL or self._latest.get(post_id) == seq:
+        del self._latest[post_id]  # cancelled, or its latest schedule fired
+    self._horizon = (int(time.time() // self.bucket) + 1) * self.bucket
+    live = set(self._latest.values())
+    for due, offset, seq in zip(dues, offsets, seqs):
+      if seq in live:
+        self._index(due, offset)
+        self.pending += 1
+    self.dead = records - self.pending
+    logger.info("schedule log replayed: %d records, %d pending", records, self.pending)
+
+  def _live_offsets(self) -> array.array:
+    offsets = array.array('Q', (offset for _, offset in self._heap))
+    for _, bucket_offsets in self._buckets.values():
+      offsets.extend(bucket_offsets)
+    return array.array('Q', sorted(offsets))  # read the old log front to back
+
+  def _snapshot(self) -> tuple[array.array, dict[str, int], int]:
+    """What a compaction copies: indexed offsets, the latest seq per id and the log size."""
+    self.log.sync()
+    return self._live_offsets(), dict(self._latest), self.log.size
+
+  def _write_compacted(self, offsets: array.array, latest: dict[str, int]) -> tuple[ScheduleLog, dict[int, int]]:
+    """Copy the snapshot's live schedule records to a new log; runs in a worker thread."""
+    tmp = self.log.path.with_name(self.log.path.name + '.compact')
+    tmp.unlink(missing_ok=True)
+    new = ScheduleLog(tmp, fsync=self.log.fsync)
+    moved: dict[int, int] = {}  # old offset -> new offset
+    for offset in offsets:
+      _, seq, due, post_id, data = self.log.read(offset)
+      if latest.get(post_id) == seq:
+        moved[offset] = new.append(SCHEDULE, seq, due, post_id, data)
+    new.sync()
+    return new, moved
+
+  def _swap(self, new: ScheduleLog, moved: dict[int, int], cutoff: int):
+    """Copy the records logged since `cutoff` to `new`, then replace the log with it."""
+    self.log.sync()
+    for offset, op, seq, due, post_id, data in self.log.records(cutoff):
+      if op == SCHEDULE:
+        moved[offset] = new.append(op, seq, due, post_id, data)
+      elif op == CANCEL:
+        new.append(op, seq, due, post_id)
+      elif (fired := OFFSET.unpack(data)[0]) in moved:
+        new.append(op, seq, due, post_id, OFFSET.pack(moved[fired]))
+    new.sync()
+    self.log.close()
+    os.replace(new.path, self.log.path)
+    new.path = self.log.path
+    records = sum(1 for _ in new.records(0))
+    self.log = new
+    self._heap = [(due, moved[offset]) for due, offset in self._heap if offset in moved]
+    heapq.heapify(self._heap)
+    self.pending = len(self._heap)
+    for key, (dues, offsets) in self._buckets.items():
+      kept = [(due, moved[offset]) for due, offset in zip(dues, offsets) if offset in moved]
+      self._buckets[key] = (array.array('d', (d for d, _ in kept)), array.array('Q', (o for _, o in kept)))
+      self.pending += len(kept)
+    self.dead = records - self.pending
+    logger.info("schedule log compacted to %d records", records)
+
+  def compact(self):
+    """Rewrite the log with the schedule records that can still fire, in one go."""
+    offsets, latest, cutoff = self._snapshot()
+    self._swap(*self._write_compacted(offsets, latest), cutoff)
+
+  def _start_compaction(self):
+    offsets, latest, cutoff = self._snapshot()
+    task = asyncio.ensure_future(asyncio.to_thread(self._write_compacted, offsets, latest))
+    task.add_done_callback(lambda _: self._wakeup.set())
+    self._compaction = (task, cutoff)
+
+  def _finish_compaction(self):
+    task, cutoff = self._compaction
+    self._compaction = None
+    self._swap(*task.result(), cutoff)
+
+  # -- firing ----------------------------------------------------------------
+
+  def due(self, now: float) -> list[tuple[float, int, int, str, bytes]]:
+    """Pop up to `batch` posts due by `now` as (due, offset, seq, id, payload)."""
+    if now >= self._horizon:
+      self._advance(now)
+    batch = []
+    while self._heap and self._heap[0][0] <= now and len(batch) < self.batch:
+      due, offset = heapq.heappop(self._heap)
+      self.pending -= 1
+      _, seq, _, post_id, data = self.log.read(offset)
+      if self._latest.get(post_id) != seq:
+        self.dead += 1  # cancelled or re-scheduled
+        continue
+      batch.append((due, offset, seq, post_id, data))
+    return batch
+
+  def mark_fired(self, batch: list[tuple[float, int, int, str, bytes]], now: float):
+    for _, offset, seq, post_id, _ in batch:
+      self.log.append(FIRED, seq, now, post_id, OFFSET.pack(offset))
+      if self._latest.get(post_id) == seq:
+        del self._latest[post_id]
+    self.log.sync()
+    self.fired += len(batch)
+    self.dead += 2 * len(batch)
+
+  def requeue(self, batch: list[tuple[float, int, int, str, bytes]]):
+    for due, offset, *_ in batch:
+      heapq.heappush(self._heap, (due, offset))
+    self.pending += len(batch)
+
+  async def _run(self):
+    while True:
+      try:
+        await self._tick()
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        logger.exception("dispatcher tick failed")
+        await asyncio.sleep(1.0)
+
+  async def _tick(self):
+    """Fire one batch, start or finish a compaction, or sleep until the next post is due."""
+    if self._compaction is not None and self._compaction[0].done():
+      self._finish_compaction()  # between batches, so no fired offset refers to the old log
+    now = time.time()
+    batch = self.due(now)
+    if batch:
+      try:
+        await self._emit([data for *_, data in batch])
+      except Exception:
+        logger.exception("dispatcher: emitting %d posts failed; retrying", len(batch))
+        self.requeue(batch)
+        await asyncio.sleep(1.0)
+        return
+      self.mark_fired(batch, now)
+      return
+    if self._compaction is None and self.dead > max(self.compact_min, self.pending):
+      self._start_compaction()
+    self._wake_at = self._next_due()
+    self._wakeup.clear()
+    delay = self._wake_at - time.time()
+    if delay > 0:
+      try:
+        await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, self.bucket))
+      except asyncio.TimeoutError:
+        pass
+
+  async def load(self):
+    """Replay the log; call before anything is scheduled."""
+    await asyncio.to_thread(self.replay)
+
+  def start(self, emit: Callable[[list[bytes]], Awaitable[None]]):
+    """Start firing due posts through `emit(payloads)`."""
+    self._emit = emit
+    self._task = asyncio.create_task(self._run())
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      await asyncio.gather(self._task, return_exceptions=True)
+      self._task = None
+    if self._compaction is not None:
+      task, _ = self._compaction
+      self._compaction = None
+      result = (await asyncio.gather(task, return_exceptions=True))[0]
+      if not isinstance(result, BaseException):
+        result[0].close()
+        result[0].path.unlink(missing_ok=True)
+    self.log.sync()
+    self.log.close()
+
+  def stats(self) -> dict:
+    return {
+      'pending': self.pending,
+      'fired': self.fired,
+      'heap': len(self._heap),
+      'buckets': len(self._buckets),
+      'log_bytes': self.log.size,
+      'dead_records': self.dead,
+      'compacting': self._compaction is not None,
+    }
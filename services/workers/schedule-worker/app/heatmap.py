@@ -0,0 +1,285 @@
+"""Best-time engine: 7×24 engagement heatmaps per platform and region.
+
+Each (platform, region) keeps two flat 168-cell arrays, the summed engagement
+rate and the number of posts per local hour of the week (Monday 00:00 = 0),
+in the region's own timezone so daylight-saving changes do not smear the
+pattern. The platform-wide map (`region='*'`) is kept in UTC. New metrics
+update one cell each; nothing is re-aggregated at lookup time.
+
+A lookup scores the next `horizon` hours: every candidate hour is mapped to
+its cell with cached per-hour UTC offsets, the region's average is shrunk
+towards the platform-wide map (and that towards a generic prior) by `prior`
+pseudo-posts, and the best hours are picked greedily at least `spacing`
+hours apart.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+
+HOURS = 7 * 24
+ALL = '*'
+
+# Representative audience timezone per region code; IANA names are accepted too.
+REGION_TIMEZONES: dict[str, str] = {
+  'US': 'America/New_York',
+  'CA': 'America/Toronto',
+  'MX': 'America/Mexico_City',
+  'BR': 'America/Sao_Paulo',
+  'UK': 'Europe/London',
+  'GB': 'Europe/London',
+  'IE': 'Europe/Dublin',
+  'EU': 'Europe/Berlin',
+  'DE': 'Europe/Berlin',
+  'FR': 'Europe/Paris',
+  'ES': 'Europe/Madrid',
+  'IT': 'Europe/Rome',
+  'NL': 'Europe/Amsterdam',
+  'IN': 'Asia/Kolkata',
+  'SG': 'Asia/Singapore',
+  'JP': 'Asia/Tokyo',
+  'KR': 'Asia/Seoul',
+  'AU': 'Australia/Sydney',
+  'NZ': 'Pacific/Auckland',
+  'ZA': 'Africa/Johannesburg',
+}
+
+
+def _prior() -> np.ndarray:
+  """Generic engagement-rate curve by local hour of week: work-day peaks, quiet nights."""
+  hours = np.arange(24)
+  day = 0.01 + 0.02 * np.exp(-((hours - 12) / 4.0) ** 2)
+  day += 0.01 * np.exp(-((hours - 19) / 2.0) ** 2) + 0.005 * np.exp(-((hours - 8) / 1.5) ** 2)
+  week = np.tile(day, (7, 1))
+  week[5:] *= 0.8  # weekends
+  return week.reshape(HOURS)
+
+
+PRIOR = _prior()
+
+
+@lru_cache(maxsize=256)
+def zone(name: str) -> ZoneInfo:
+  return ZoneInfo(name)
+
+
+def region_key(region: str) -> str:
+  """Region codes are case-insensitive; IANA timezone names are kept as given."""
+  return region if region == ALL or '/' in region else region.upper()
+
+
+def region_zone(region: str) -> str:
+  region = region_key(region)
+  if region == ALL:
+    return 'UTC'
+  return REGION_TIMEZONES.get(region, region if '/' in region else 'UTC')
+
+
+@lru_cache(maxsize=1 << 16)
+def offset_minutes(tz: str, epoch_hour: int) -> int:
+  """UTC offset of `tz` in minutes during the given hour since the epoch."""
+  at = datetime.fromtimestamp(epoch_hour * 3600, timezone.utc).astimezone(zone(tz))
+  return int(at.utcoffset().total_seconds()) // 60
+
+
+@lru_cache(maxsize=1024)
+def hour_offsets(tz: str, start_hour: int, hours: int = HOURS) -> np.ndarray:
+  """UTC offsets of `tz` in minutes for each of `hours` hours from `start_hour`."""
+  offsets = np.fromiter((offset_minutes(tz, start_hour + i) for i in range(hours)), dtype=np.int64, count=hours)
+  offsets.flags.writeable = False
+  return offsets
+
+
+def week_cells(epoch_minutes: np.ndarray, offsets_min: np.ndarray) -> np.ndarray:
+  """Hour-of-week cell (Monday 00:00 = 0) of each epoch minute, shifted into local time.
+
+  The offset is added before truncating to the hour, so half- and quarter-hour
+  zones (India, Newfoundland, Nepal) land in the right local hour.
+  """
+  local_hours = (epoch_minutes + offsets_min) // 60
+  # 1970-01-01 was a Thursday, i.e. 72 hours into its week.
+  return (local_hours + 72) % HOURS
+
+
+def parse_time(value) -> datetime | None:
+  if value is None or value == '':
+    return None
+  if isinstance(value, (int, float)):
+    return datetime.fromtimestamp(value, timezone.utc)
+  at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+  return at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+
+
+def engagement_rate(normalized: dict) -> float | None:
+  if normalized.get('engagement_rate') is not None:
+    return float(normalized['engagement_rate'])
+  impressions = normalized.get('impressions') or 0
+  if not impressions:
+    return None
+  engagements = sum(normalized.get(k) or 0 for k in ('likes', 'comments', 'shares', 'saves'))
+  return engagements / impressions
+
+
+class Heatmap:
+  __slots__ = ('tz', 'sums', 'counts')
+
+  def __init__(self, tz: str):
+    self.tz = tz
+    self.sums = np.zeros(HOURS, dtype=np.float64)
+    self.counts = np.zeros(HOURS, dtype=np.int64)
+
+
+class HeatmapStore:
+  def __init__(self, prior: float = 20.0, spacing: int = 3, horizon: int = HOURS):
+    self.prior = prior  # pseudo-posts pulling sparse cells towards the parent map
+    self.spacing = spacing
+    self.horizon = horizon
+    self.maps: dict[tuple[str, str], Heatmap] = {}
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_env(cls) -> 'HeatmapStore':
+    store = cls(
+      prior=float(os.getenv('SCHEDULE_PRIOR_POSTS', '20')),
+      spacing=int(os.getenv('SCHEDULE_MIN_SPACING_HOURS', '3')),
+      horizon=int(os.getenv('SCHEDULE_HORIZON_HOURS', str(HOURS))),
+    )
+    path = os.getenv('SCHEDULE_HEATMAPS')
+    if path and Path(path).exists():
+      store.load(path)
+    elif os.getenv('SCHEDULE_HISTORY') and Path(os.environ['SCHEDULE_HISTORY']).exists():
+      store.load_history(os.environ['SCHEDULE_HISTORY'])
+    return store
+
+  def heatmap(self, platform: str, region: str) -> Heatmap:
+    key = (platform.lower(), region_key(region))
+    heatmap = self.maps.get(key)
+    if heatmap is None:
+      heatmap = self.maps[key] = Heatmap(region_zone(key[1]))
+    return heatmap
+
+  # -- updates ---------------------------------------------------------------
+
+  def observe_many(self, platforms: list[str], regions: list[str | None], published: list, rates: list[float | None]):
+    """Add posts to their platform/region maps and to the platform-wide maps."""
+    groups: dict[tuple[str, str], tuple[list[float], list[float]]] = {}
+    for platform, region, at, rate in zip(platforms, regions, published, rates):
+      at = parse_time(at)
+      if not platform or at is None or rate is None:
+        continue
+      minute = at.timestamp() // 60
+      for key in ((platform, ALL), (platform, region)) if region else ((platform, ALL),):
+        minutes, values = groups.setdefault(key, ([], []))
+        minutes.append(minute)
+        values.append(rate)
+    with self._lock:
+      for (platform, region), (minutes, values) in groups.items():
+        heatmap = self.heatmap(platform, region)
+        epoch_minutes = np.asarray(minutes, dtype=np.int64)
+        offsets = np.fromiter(
+          (offset_minutes(heatmap.tz, h) for h in (epoch_minutes // 60).tolist()), dtype=np.int64, count=len(minutes),
+        )
+        cells = week_cells(epoch_minutes, offsets)
+        np.add.at(heatmap.sums, cells, values)
+        np.add.at(heatmap.counts, cells, 1)
+
+  def observe(self, platform: str, region: str | None, published_at, rate: float | None):
+    self.observe_many([platform], [region], [published_at], [rate])
+
+  # -- lookups ---------------------------------------------------------------
+
+  def scores(self, platform: str, region: str, start_hour: int, hours: int) -> np.ndarray:
+    """Expected engagement rate of each of `hours` hours from `start_hour` (epoch hours)."""
+    epoch_minutes = np.arange(start_hour, start_hour + hours, dtype=np.int64) * 60
+    k = self.prior
+    region = region_key(region)
+    tz = region_zone(region)
+    local = week_cells(epoch_minutes, hour_offsets(tz, start_hour, hours))
+    utc = week_cells(epoch_minutes, np.zeros(hours, dtype=np.int64))
+    with self._lock:
+      parent = self.maps.get((platform.lower(), ALL))
+      child = self.maps.get((platform.lower(), region)) if region != ALL else None
+      # The generic prior is in local time, so it follows the region's clock.
+      score = PRIOR[local]
+      if parent is not None:
+        score = (parent.sums[utc] + k * score) / (parent.counts[utc] + k)
+      if child is not None:
+        score = (child.sums[local] + k * score) / (child.counts[local] + k)
+    return score
+
+  def best_slots(self, platform: str, region: str, count: int, now: datetime | None = None,
+                 spacing: int | None = None, horizon: int | None = None) -> list[tuple[int, float]]:
+    """Top `count` (epoch hour, score) pairs from the next hour on, in time order."""
+    if count <= 0:
+      return []
+    now = now or datetime.now(timezone.utc)
+    start = int(now.timestamp() // 3600) + 1
+    horizon = horizon or self.horizon
+    spacing = self.spacing if spacing is None else spacing
+    score = self.scores(platform, region, start, horizon)
+    picked: list[int] = []
+    for i in np.argsort(-score, kind='stable').tolist():
+      if all(abs(i - j) >= spacing for j in picked):
+        picked.append(i)
+        if len(picked) == count:
+          break
+    return [(start + i, float(score[i])) for i in sorted(picked)]
+
+  def grid(self, platform: str, region: str) -> dict:
+    """Raw map for inspection: 7 rows (Mon..Sun) × 24 local hours."""
+    heatmap = self.maps.get((platform.lower(), region_key(region)))
+    if heatmap is None:
+      return {'timezone': region_zone(region), 'posts': 0, 'rates': None}
+    with self._lock:
+      rates = np.divide(heatmap.sums, heatmap.counts, out=np.zeros(HOURS), where=heatmap.counts > 0)
+      return {
+        'timezone': heatmap.tz,
+        'posts': int(heatmap.counts.sum()),
+        'rates': np.round(rates, 5).reshape(7, 24).tolist(),
+        'counts': heatmap.counts.reshape(7, 24).tolist(),
+      }
+
+  # -- persistence -----------------------------------------------------------
+
+  def save(self, path: str | Path):
+    path = Path(path)
+    with self._lock:
+      arrays = {}
+      for (platform, region), heatmap in self.maps.items():
+        arrays[f"{platform}|{region}|sums"] = heatmap.sums
+        arrays[f"{platform}|{region}|counts"] = heatmap.counts
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+      np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+  def load(self, path: str | Path):
+    with np.load(path) as data, self._lock:
+      for name in data.files:
+        platform, region, kind = name.rsplit('|', 2)
+        heatmap = self.heatmap(platform, region)
+        setattr(heatmap, kind, data[name].astype(np.float64 if kind == 'sums' else np.int64))
+
+  def load_history(self, path: str | Path):
+    """Build the maps from a JSONL file of metrics.processed messages."""
+    platforms, regions, published, rates = [], [], [], []
+    with open(path, encoding='utf-8') as f:
+      for line in f:
+        if not line.strip():
+          continue
+        record = json.loads(line)
+        platforms.append(record.get('platform'))
+        regions.append(record.get('region'))
+        published.append(record.get('published_at'))
+        rates.append(engagement_rate(record.get('normalized') or {}))
+    self.observe_many(platforms, regions, published, rates)
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {f"{p}/{r}": int(h.counts.sum()) for (p, r), h in sorted(self.maps.items())}
@@ -1,26 +1,65 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
 import os
-import json
-from datetime import datetime, timedelta
-from nats.aio.client import Client as NATS
+from datetime import datetime, timezone
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, Raw, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.dispatcher import Dispatcher
+from app.heatmap import ALL, HeatmapStore, engagement_rate, parse_time, zone
 
-class ScheduleRequest(BaseModel):
+
+class ScheduleRequest(Message):
   request_id: str
   platform: str
   region: str = 'US'
   timezone: str = 'UTC'
   count: int = 5
+  min_spacing_hours: int | None = None
+  horizon_hours: int | None = None
 
 
-class ScheduleResponse(BaseModel):
+class ScheduleResponse(Message):
   request_id: str
   slots: list[str]
+  scores: list[float] | None = None  # expected engagement rate per slot
+
+
+class ScheduledPost(Message):
+  post_id: str
+  due_at: str | float  # ISO 8601 or epoch seconds
+  payload: Raw  # publish.orchestrate message, forwarded byte for byte
+
+
+class ScheduleCancel(Message):
+  post_id: str
+
+
+class ProcessedMetrics(Message):
+  """The fields of a metrics.processed message the heatmaps need."""
+  platform: str | None = None
+  region: str | None = None
+  published_at: str | float | None = None
+  normalized: dict | None = None
+
+
+class ProcessedMetricsBatch(Message):
+  count: int
+  platforms: list[str]
+  columns: dict[str, list]
+  published_at: list[str | float | None] | None = None
+  regions: list[str | None] | None = None
 
 
 app = FastAPI(title="Schedule Worker", version="0.1.0")
+runtime = WorkerRuntime('schedule-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+heatmaps = HeatmapStore.from_env()
+# Owns an append-only log; run a single dispatching replica per log.
+dispatcher = Dispatcher.from_env()
 
 
 @app.get('/health')
@@ -28,31 +67,102 @@ async def health():
   return {"status": "ok", "service": "schedule-worker"}
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
+@app.get('/dispatcher')
+async def dispatcher_stats():
+  return dispatcher.stats()
 
-  async def handle_request(msg):
-    try:
-      payload = json.loads(msg.data.decode())
-      req = ScheduleRequest(**payload)
-      now = datetime.utcnow().replace(microsecond=0)
-      # naive slots: every 3 hours starting next hour
-      base = now + timedelta(hours=1)
-      slots = [(base + timedelta(hours=i * 3)).isoformat() + 'Z' for i in range(req.count)]
-      resp = ScheduleResponse(request_id=req.request_id, slots=slots)
-      await nc.publish('schedule.complete', json.dumps(resp.model_dump()).encode())
-    except Exception as e:
-      await nc.publish('schedule.failed', json.dumps({'error': str(e)}).encode())
 
-  await nc.subscribe('schedule.request', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@app.get('/heatmaps')
+async def heatmap_stats():
+  return heatmaps.stats()
 
 
-@app.on_event('startup')
-async def on_startup():
-  asyncio.create_task(start_nats_loop())
+@app.get('/heatmaps/{platform}/{region:path}')
+async def heatmap_grid(platform: str, region: str):
+  return heatmaps.grid(platform, region)
+
+
+def format_slot(epoch_hour: int, tz: str) -> str:
+  at = datetime.fromtimestamp(epoch_hour * 3600, timezone.utc)
+  if tz.upper() in ('UTC', 'Z'):
+    return at.replace(tzinfo=None).isoformat() + 'Z'
+  return at.astimezone(zone(tz)).isoformat()
+
 
+@runtime.subscribe('schedule.request')
+async def handle_request(msg):
+  try:
+    req = decode(msg.data, ScheduleRequest)
+    zone(req.timezone)  # reject unknown timezones before scoring
+    picked = heatmaps.best_slots(
+      req.platform, req.region or ALL, req.count, spacing=req.min_spacing_hours, horizon=req.horizon_hours,
+    )
+    resp = ScheduleResponse(
+      request_id=req.request_id,
+      slots=[format_slot(hour, req.timezone) for hour, _ in picked],
+      scores=[round(score, 5) for _, score in picked],
+    )
+    await runtime.publish('schedule.complete', encode(resp))
+  except Exception as e:
+    await runtime.publish('schedule.failed', encode({'error': str(e)}))
 
+
+@runtime.subscribe('metrics.processed')
+async def handle_metrics(msg):
+  # Incremental heatmap updates; posts without platform/published_at are skipped.
+  body = decode(msg.data, ProcessedMetrics)
+  heatmaps.observe(body.platform, body.region, body.published_at, engagement_rate(body.normalized or {}))
+
+
+@runtime.subscribe('metrics.processed.batch')
+async def handle_metrics_batch(msg):
+  body = decode(msg.data, ProcessedMetricsBatch)
+  n = body.count
+  columns = body.columns
+  rates = columns.get('engagement_rate') or [None] * n
+  heatmaps.observe_many(
+    body.platforms,
+    body.regions or [None] * n,
+    body.published_at or [None] * n,
+    [rate if impressions else None for rate, impressions in zip(rates, columns.get('impressions') or [0] * n)],
+  )
+
+
+@runtime.subscribe('schedule.post')
+async def handle_post(msg):
+  try:
+    post = decode(msg.data, ScheduledPost)
+    dispatcher.schedule(post.post_id, parse_time(post.due_at).timestamp(), bytes(post.payload))
+  except Exception as e:
+    await runtime.publish('schedule.failed', encode({'error': str(e)}))
+    return
+  dispatcher.sync()  # logged before the message is acked
+
+
+@runtime.subscribe('schedule.cancel')
+async def handle_cancel(msg):
+  dispatcher.cancel(decode(msg.data, ScheduleCancel).post_id)
+  dispatcher.sync()
+
+
+async def emit(payloads: list[bytes]):
+  for data in payloads:
+    await runtime.publish('publish.orchestrate', data)
+
+
+@app.on_event('startup')
+async def on_startup():
+  if int(os.getenv('WORKER_PROCESSES', '1')) > 1:
+    raise RuntimeError("schedule-worker owns the dispatcher log; run it with --processes 1 --stop-first")
+  await dispatcher.load()
+  await runtime.start()
+  dispatcher.start(emit)
+
+
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  await dispatcher.stop()
+  path = os.getenv('SCHEDULE_HEATMAPS')
+  if path:
+    await asyncio.to_thread(heatmaps.save, path)
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+from app.dispatcher import Dispatcher
+
+
+async def run(dispatcher: Dispatcher, fired: list[bytes], until, timeout: float = 5.0):
+  async def emit(payloads: list[bytes]):
+    fired.extend(payloads)
+
+  dispatcher.start(emit)
+  deadline = time.monotonic() + timeout
+  while not until():
+    assert time.monotonic() < deadline, 'dispatcher did not catch up in time'
+    await asyncio.sleep(0.01)
+  await dispatcher.stop()
+
+
+def test_redelivered_schedule_fires_once(tmp_path):
+  dispatcher = Dispatcher(tmp_path / 'schedule.log')
+  dispatcher.replay()
+  now = time.time()
+  dispatcher.schedule('post-1', now - 1, b'first')
+  dispatcher.schedule('post-1', now - 1, b'first')  # redelivered schedule.post
+  dispatcher.schedule('post-2', now - 1, b'old')
+  dispatcher.schedule('post-2', now - 1, b'new')
+  dispatcher.schedule('post-3', now - 1, b'cancelled')
+  dispatcher.cancel('post-3')
+  fired = []
+  asyncio.run(run(dispatcher, fired, lambda: dispatcher.pending == 0))
+  assert sorted(fired) == [b'first', b'new']
+
+
+def test_replay_keeps_only_latest_unfired_schedules(tmp_path):
+  path = tmp_path / 'schedule.log'
+  dispatcher = Dispatcher(path)
+  dispatcher.replay()
+  now = time.time()
+  dispatcher.schedule('fired', now - 1, b'fired')
+  dispatcher.schedule('later', now + 3600, b'v1')
+  dispatcher.schedule('later', now + 7200, b'v2')
+  dispatcher.schedule('cancelled', now + 3600, b'cancelled')
+  dispatcher.cancel('cancelled')
+  fired = []
+  asyncio.run(run(dispatcher, fired, lambda: fired))
+  assert fired == [b'fired']
+
+  restarted = Dispatcher(path)
+  restarted.replay()
+  assert restarted.pending == 1
+  assert [payload for *_, payload in restarted.due(now + 7200)] == [b'v2']
+  restarted.log.close()
+
+
+def test_compaction_runs_while_posts_fire(tmp_path):
+  path = tmp_path / 'schedule.log'
+  dispatcher = Dispatcher(path, batch=50, compact_min=10)
+  dispatcher.replay()
+  now = time.time()
+  for i in range(2000):
+    dispatcher.schedule(f'post-{i}', now - 1 + (i % 20) * 0.02, b'%d' % i)
+  for i in range(0, 2000, 4):
+    dispatcher.cancel(f'post-{i}')
+  for i in range(100):
+    dispatcher.schedule(f'later-{i}', now + 3600, b'later')
+  expected = {b'%d' % i for i in range(2000) if i % 4}
+  fired = []
+  asyncio.run(run(dispatcher, fired, lambda: len(fired) == len(expected) and dispatcher._compaction is None))
+  assert sorted(fired) == sorted(expected)
+  assert dispatcher.pending == 100
+
+  restarted = Dispatcher(path)
+  restarted.replay()
+  assert restarted.pending == 100
+  assert restarted.dead < 500  # 3500 cancel/fired records without compaction
+  assert {payload for *_, payload in restarted.due(now + 3600)} == {b'later'}
+  restarted.log.close()
+  assert not path.with_name(path.name + '.compact').exists()
@@ -0,0 +1,31 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.heatmap import HeatmapStore
+
+
+NOW = datetime(2026, 3, 2, 8, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def store() -> HeatmapStore:
+  store = HeatmapStore(spacing=3)
+  for day in range(1, 8):
+    store.observe('twitter', 'US', f'2026-02-{day:02d}T14:00:00Z', 0.09)
+    store.observe('twitter', 'US', f'2026-02-{day:02d}T03:00:00Z', 0.01)
+  return store
+
+
+@pytest.mark.parametrize('count', [0, -1])
+def test_best_slots_without_a_positive_count_is_empty(store, count):
+  assert store.best_slots('twitter', 'US', count, now=NOW) == []
+
+
+def test_best_slots_are_spaced_and_in_time_order(store):
+  slots = store.best_slots('twitter', 'US', 4, now=NOW)
+  hours = [hour for hour, _ in slots]
+  assert len(slots) == 4
+  assert hours == sorted(hours)
+  assert all(b - a >= 3 for a, b in zip(hours, hours[1:]))
+  assert hours[0] > NOW.timestamp() // 3600
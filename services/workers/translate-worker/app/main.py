@@ -1,25 +1,44 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
-import os
-import json
-from nats.aio.client import Client as NATS
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
 
+from app.memory import TranslationMemory, join_segments, normalize, split_segments
 
-class TranslateRequest(BaseModel):
+
+class TranslateRequest(Message):
   request_id: str
   content: str
   source_lang: str = 'en'
   target_lang: str = 'es'
+  target_langs: list[str] | None = None  # all locales in one pass; overrides target_lang
+  fuzzy: bool = False  # look up similar segments as backend hints and suggestions
+
 
+class Suggestion(Message):
+  """A stored translation of a segment similar to `segment`; never applied."""
+  segment: int  # index of the sentence in the content
+  source: str
+  translation: str
+  score: float
 
-class TranslateResponse(BaseModel):
+
+class TranslateResponse(Message):
   request_id: str
-  content: str
+  content: str  # first target's translation
   target_lang: str
+  translations: dict[str, str] | None = None
+  memory: dict[str, int] | None = None  # segments served by exact hits, fuzzy suggestions, translated
+  suggestions: dict[str, list[Suggestion]] | None = None  # per target, when fuzzy is set
 
 
 app = FastAPI(title="Translate Worker", version="0.1.0")
+runtime = WorkerRuntime('translate-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+memory = TranslationMemory.from_env()
 
 
 @app.get('/health')
@@ -27,33 +46,96 @@ async def health():
   return {"status": "ok", "service": "translate-worker"}
 
 
+@app.get('/memory/stats')
+async def memory_stats():
+  return memory.stats()
+
+
 def mock_translate(text: str, target: str) -> str:
   # Placeholder translate stub
   return f"[{target}] {text}"
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    try:
-      payload = json.loads(msg.data.decode())
-      req = TranslateRequest(**payload)
-      translated = mock_translate(req.content, req.target_lang)
-      resp = TranslateResponse(request_id=req.request_id, content=translated, target_lang=req.target_lang)
-      await nc.publish('translate.complete', json.dumps(resp.model_dump()).encode())
-    except Exception as e:
-      await nc.publish('translate.failed', json.dumps({'error': str(e)}).encode())
-
-  await nc.subscribe('translate.request', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+def mock_translate_batch(texts: list[str], target: str, hints: list[tuple[str, str] | None] | None = None) -> list[str]:
+  # hints[i]: (source, translation) of a similar stored segment, for the backend to adapt
+  return [mock_translate(text, target) for text in texts]
+
+
+async def translate(
+  req: TranslateRequest, target: str, segments: list[str], keys: list[str],
+) -> tuple[list[str], dict, list[Suggestion]]:
+  """Translate segments through the memory; only segments without an exact hit reach the backend."""
+  out: list[str | None] = [None] * len(segments)
+  misses: dict[str, list[int]] = {}
+  hints: dict[str, tuple[str, str]] = {}
+  suggestions: list[Suggestion] = []
+  counts = {'segments': 0, 'exact': 0, 'fuzzy': 0, 'translated': 0}
+  for i, (segment, key) in enumerate(zip(segments, keys)):
+    if not key:
+      out[i] = segment  # blank or whitespace-only
+      continue
+    counts['segments'] += 1
+    match = memory.lookup(req.source_lang, target, key, fuzzy=req.fuzzy)
+    if match is not None and match.kind == 'exact':
+      out[i] = match.translation
+      counts['exact'] += 1
+      continue
+    if match is not None:
+      hints[key] = (match.source, match.translation)
+      suggestions.append(Suggestion(segment=i, source=match.source, translation=match.translation, score=match.score))
+      counts['fuzzy'] += 1
+    misses.setdefault(key, []).append(i)
+  if misses:
+    # One backend call per target for the distinct unseen segments.
+    firsts = [positions[0] for positions in misses.values()]
+    translated = await asyncio.to_thread(
+      mock_translate_batch, [segments[i] for i in firsts], target, [hints.get(key) for key in misses],
+    )
+    for positions, text in zip(misses.values(), translated):
+      for i in positions:
+        out[i] = text
+    counts['translated'] = len(translated)
+    await asyncio.to_thread(memory.add_many, req.source_lang, target, list(zip(misses, translated)))
+  memory.record(**counts)
+  return out, counts, suggestions
+
+
+@runtime.subscribe('translate.request')
+async def handle_request(msg):
+  try:
+    req = decode(msg.data, TranslateRequest)
+    targets = list(dict.fromkeys(req.target_langs or [req.target_lang]))
+    segments, separators = split_segments(req.content)
+    keys = [normalize(segment) for segment in segments]
+    translations: dict[str, str] = {}
+    suggestions: dict[str, list[Suggestion]] = {}
+    totals = {'segments': 0, 'exact': 0, 'fuzzy': 0, 'translated': 0}
+    for target in targets:
+      translated, counts, similar = await translate(req, target, segments, keys)
+      translations[target] = join_segments(translated, separators)
+      if similar:
+        suggestions[target] = similar
+      for k, v in counts.items():
+        totals[k] += v
+    resp = TranslateResponse(
+      request_id=req.request_id,
+      content=translations[targets[0]],
+      target_lang=targets[0],
+      translations=translations,
+      memory=totals,
+      suggestions=suggestions or None,
+    )
+    await runtime.publish('translate.complete', encode(resp))
+  except Exception as e:
+    await runtime.publish('translate.failed', encode({'error': str(e)}))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  memory.close()
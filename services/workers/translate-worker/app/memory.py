@@ -0,0 +1,225 @@
+"""Translation memory: sentence segments keyed by (source, target, normalized text).
+
+Content is split into sentences; each sentence is looked up by its
+normalized form (NFKC, case-folded, whitespace collapsed). An exact hit is
+reused as is. Otherwise a character-trigram inverted index proposes earlier
+segments sharing its rarest trigrams, and the best one whose Dice similarity
+reaches `threshold` is a fuzzy match, unless the two differ in their numbers
+("20% off" must not match "30% off"). A fuzzy match is never reused as the
+translation: a single changed word ("is not available" / "is available",
+"Mexico" / "Canada") keeps the score high and flips the meaning. It is only
+passed to the backend as a hint and returned as a suggestion. Every segment
+without an exact hit goes to the translation backend, and the results are
+added to the memory.
+
+Segments are persisted in SQLite and loaded into the in-process indexes on
+startup.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+
+# Sentence ends followed by whitespace, or line breaks; separators are kept.
+_SPLIT = re.compile(r'((?<=[.!?。！？…])\s+|\n+)')
+_SPACE = re.compile(r'\s+')
+_NUMBERS = re.compile(r'\d+(?:[.,]\d+)*')
+
+MAX_PROBES = 24  # rarest trigrams of a query whose postings are scanned
+MAX_CANDIDATES = 16  # segments sharing most of them, scored exactly
+
+
+def split_segments(text: str) -> tuple[list[str], list[str]]:
+  """Sentences and the separators between them: text == s0 + sep0 + s1 + sep1 + ..."""
+  parts = _SPLIT.split(text)
+  return parts[0::2], parts[1::2] + ['']
+
+
+def join_segments(segments: list[str], separators: list[str]) -> str:
+  return ''.join(s + sep for s, sep in zip(segments, separators))
+
+
+def normalize(segment: str) -> str:
+  return _SPACE.sub(' ', unicodedata.normalize('NFKC', segment).casefold()).strip()
+
+
+def trigrams(normalized: str) -> set[str]:
+  padded = f"  {normalized} "
+  return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def dice(shared: int, a: int, b: int) -> float:
+  return 2 * shared / (a + b) if a + b else 0.0
+
+
+@dataclass
+class Match:
+  translation: str
+  kind: str  # 'exact' or 'fuzzy'
+  score: float = 1.0
+  source: str = ''  # normalized source of the stored segment
+
+
+class PairIndex:
+  """Segments of one (source, target) language pair."""
+
+  def __init__(self):
+    self.sources: list[str] = []
+    self.translations: list[str] = []
+    self.sizes = array('H')  # trigram count per segment
+    self.exact: dict[str, int] = {}
+    self.postings: dict[str, array] = {}
+
+  def add(self, normalized: str, translation: str):
+    idx = self.exact.get(normalized)
+    if idx is not None:
+      self.translations[idx] = translation
+      return
+    idx = len(self.sources)
+    grams = trigrams(normalized)
+    self.sources.append(normalized)
+    self.translations.append(translation)
+    self.sizes.append(min(len(grams), 0xFFFF))
+    self.exact[normalized] = idx
+    for gram in grams:
+      posting = self.postings.get(gram)
+      if posting is None:
+        posting = self.postings[gram] = array('I')
+      posting.append(idx)
+
+  def fuzzy(self, normalized: str, threshold: float) -> tuple[int, float] | None:
+    grams = trigrams(normalized)
+    known = sorted((self.postings[g] for g in grams if g in self.postings), key=len)
+    if not known:
+      return None
+    # A segment reaching `threshold` shares at least `needed` trigrams, so it
+    # holds one of the rarest len(grams) - needed + 1: count over those only.
+    needed = int(len(grams) * threshold / (2 - threshold))
+    candidates = Counter()
+    for posting in known[:min(MAX_PROBES, len(grams) - needed + 1)]:
+      candidates.update(posting)
+    lo, hi = len(grams) * threshold / (2 - threshold), len(grams) * (2 - threshold) / threshold
+    best, best_score = None, threshold
+    numbers = _NUMBERS.findall(normalized)
+    for idx, _ in candidates.most_common(MAX_CANDIDATES):
+      if not lo <= self.sizes[idx] <= hi:
+        continue
+      source = self.sources[idx]
+      score = dice(len(grams & trigrams(source)), len(grams), self.sizes[idx])
+      if score >= best_score and _NUMBERS.findall(source) == numbers:
+        best, best_score = idx, score
+    return (best, best_score) if best is not None else None
+
+
+class MemoryStore:
+  """Segment table in SQLite."""
+
+  def __init__(self, path: str):
+    self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("PRAGMA synchronous=NORMAL")
+    self._conn.execute(
+      "CREATE TABLE IF NOT EXISTS segments ("
+      " source_lang TEXT NOT NULL, target_lang TEXT NOT NULL, source TEXT NOT NULL,"
+      " translation TEXT NOT NULL, updated_at REAL NOT NULL,"
+      " PRIMARY KEY (source_lang, target_lang, source))"
+    )
+    self._lock = threading.Lock()
+
+  def rows(self):
+    with self._lock:
+      return self._conn.execute("SELECT source_lang, target_lang, source, translation FROM segments").fetchall()
+
+  def add_many(self, rows: list[tuple[str, str, str, str]]):
+    now = time.time()
+    with self._lock:
+      self._conn.execute("BEGIN")
+      try:
+        self._conn.executemany(
+          "INSERT OR REPLACE INTO segments (source_lang, target_lang, source, translation, updated_at) VALUES (?, ?, ?, ?, ?)",
+          [(*row, now) for row in rows],
+        )
+        self._conn.execute("COMMIT")
+      except BaseException:
+        self._conn.execute("ROLLBACK")
+        raise
+
+  def close(self):
+    self._conn.close()
+
+
+class TranslationMemory:
+  def __init__(self, store: MemoryStore | None = None, threshold: float = 0.85):
+    self.store = store
+    self.threshold = threshold
+    self.pairs: dict[tuple[str, str], PairIndex] = {}
+    self.counts = Counter()  # segments, exact, fuzzy (suggested), translated
+    self._lock = threading.Lock()
+    if store is not None:
+      for source_lang, target_lang, source, translation in store.rows():
+        self.pair(source_lang, target_lang).add(source, translation)
+
+  @classmethod
+  def from_env(cls) -> 'TranslationMemory':
+    path = os.getenv('TRANSLATE_TM_PATH', 'translation-memory.db')
+    if path:
+      Path(path).parent.mkdir(parents=True, exist_ok=True)
+    return cls(
+      MemoryStore(path) if path else None,
+      threshold=float(os.getenv('TRANSLATE_FUZZY_THRESHOLD', '0.85')),
+    )
+
+  def pair(self, source_lang: str, target_lang: str) -> PairIndex:
+    key = (source_lang.lower(), target_lang.lower())
+    index = self.pairs.get(key)
+    if index is None:
+      index = self.pairs[key] = PairIndex()
+    return index
+
+  def lookup(self, source_lang: str, target_lang: str, normalized: str, fuzzy: bool = True) -> Match | None:
+    with self._lock:
+      index = self.pair(source_lang, target_lang)
+      idx = index.exact.get(normalized)
+      if idx is not None:
+        return Match(index.translations[idx], 'exact', source=normalized)
+      if fuzzy:
+        found = index.fuzzy(normalized, self.threshold)
+        if found is not None:
+          return Match(index.translations[found[0]], 'fuzzy', round(found[1], 4), index.sources[found[0]])
+    return None
+
+  def add_many(self, source_lang: str, target_lang: str, pairs: list[tuple[str, str]]):
+    """Remember (normalized source, translation) pairs."""
+    with self._lock:
+      index = self.pair(source_lang, target_lang)
+      for normalized, translation in pairs:
+        index.add(normalized, translation)
+    if self.store is not None:
+      self.store.add_many([(source_lang.lower(), target_lang.lower(), n, t) for n, t in pairs])
+
+  def record(self, segments: int, exact: int, fuzzy: int, translated: int):
+    self.counts.update(segments=segments, exact=exact, fuzzy=fuzzy, translated=translated)
+
+  def stats(self) -> dict:
+    segments = self.counts['segments']
+    hits = self.counts['exact']
+    return {
+      'pairs': {f"{s}->{t}": len(index.sources) for (s, t), index in sorted(self.pairs.items())},
+      'segments': segments,
+      'exact_hits': hits,
+      'fuzzy_suggestions': self.counts['fuzzy'],
+      'backend_calls': self.counts['translated'],
+      'saved_backend_calls': hits,
+      'hit_rate': round(hits / segments, 4) if segments else 0.0,
+    }
+
+  def close(self):
+    if self.store is not None:
+      self.store.close()
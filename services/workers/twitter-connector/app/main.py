@@ -1,27 +1,37 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
-import os
-import json
 import random
-import httpx
-from nats.aio.client import Client as NATS
+from worker_common import RetryLater, WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.http import PlatformHttp, bearer_headers
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
+from worker_common.ratelimit import RateLimiter, account_key
 
 
-class PublishRequest(BaseModel):
+class PublishRequest(Message, kw_only=True):
   request_id: str
+  brand_id: str | None = None  # echoed on publish.success for duplicate detection
   content: str
   media_ids: list[str] | None = None
   credentials: dict  # { api_key, api_secret, access_token, access_token_secret }
 
 
-class PublishResponse(BaseModel):
+class PublishResponse(Message):
   request_id: str
   external_id: str
   url: str | None = None
+  connector: str = 'twitter'
+  brand_id: str | None = None
+  content: str | None = None
 
 
 app = FastAPI(title="Twitter Connector", version="0.1.0")
+runtime = WorkerRuntime('twitter-connector')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+http = PlatformHttp('twitter')
+limiter = RateLimiter.from_env('twitter')
 
 
 @app.get('/health')
@@ -30,42 +40,49 @@ async def health():
 
 
 async def publish_tweet(req: PublishRequest) -> PublishResponse:
-  # Stub: simulate API call success with random external id
-  # Replace with actual Twitter/X API (v2) call using OAuth 1.0a or 2.0 as required.
-  await asyncio.sleep(0.2)
-  external_id = f"tw_{random.randint(1_000_000, 9_999_999)}"
+  if http.enabled:
+    body = {'text': req.content}
+    if req.media_ids:
+      body['media'] = {'media_ids': req.media_ids}
+    resp = await http.request('POST', '/2/tweets', json=body, headers=bearer_headers(req.credentials))
+    resp.raise_for_status()
+    external_id = resp.json()['data']['id']
+  else:
+    # Stub: simulate API call success with random external id
+    # Set TWITTER_API_BASE_URL to call the Twitter/X API (v2).
+    await asyncio.sleep(0.2)
+    external_id = f"tw_{random.randint(1_000_000, 9_999_999)}"
   return PublishResponse(request_id=req.request_id, external_id=external_id, url=f"https://x.com/i/web/status/{external_id}")
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    payload = json.loads(msg.data.decode())
-    req = PublishRequest(**payload)
-    retries = 3
-    backoff = 0.5
-    for attempt in range(1, retries + 1):
-      try:
-        resp = await publish_tweet(req)
-        await nc.publish('publish.success', json.dumps(resp.model_dump()).encode())
-        return
-      except Exception as e:
-        if attempt == retries:
-          await nc.publish('publish.failed', json.dumps({'request_id': req.request_id, 'error': str(e)}).encode())
-        else:
-          await asyncio.sleep(backoff)
-          backoff *= 2
-
-  await nc.subscribe('publish.twitter', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+@runtime.subscribe('publish.twitter', idempotent=True)
+async def handle_request(msg):
+  req = decode(msg.data, PublishRequest)
+  try:
+    resp = await limiter.run(
+      account_key(req.credentials),
+      lambda: publish_tweet(req),
+      attempt=runtime.attempt(msg),
+      attempts=runtime.config.max_deliver,
+    )
+  except RetryLater:
+    raise
+  except Exception as e:
+    await runtime.publish('publish.failed', encode({'request_id': req.request_id, 'connector': 'twitter', 'error': str(e)}))
+    return
+  if req.brand_id:
+    resp.brand_id, resp.content = req.brand_id, req.content
+  await runtime.publish('publish.success', encode(resp))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await http.start()
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  await http.close()
+  await limiter.close()
@@ -1,26 +1,58 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
 import asyncio
 import os
-import json
-import random
-from nats.aio.client import Client as NATS
+import time
+from concurrent.futures import ProcessPoolExecutor
+from worker_common import WorkerRuntime
+from worker_common.codec import Message, decode, encode
+from worker_common.metrics import serve_metrics
+from worker_common.profiler import serve_profiler
+from worker_common.voice import DEFAULT_DIM
 
+from app.train import featurize_chunk, fit, merge_chunks, model_id
 
-class VoiceTrainRequest(BaseModel):
+
+class VoiceTrainRequest(Message):
   request_id: str
   brand_id: str
   examples: list[dict]  # [{ content, source }]
   constraints: dict | None = None
 
 
-class VoiceTrainResponse(BaseModel):
+class VoiceTrainResponse(Message):
   request_id: str
   voice_model_id: str
   metrics: dict
 
 
+class VoiceTrainProgress(Message):
+  request_id: str
+  brand_id: str
+  stage: str  # features, fit, done
+  done: int
+  total: int
+  progress: float
+
+
 app = FastAPI(title="Voice Train Worker", version="0.1.0")
+runtime = WorkerRuntime('voice-train-worker')
+serve_metrics(app, runtime)
+serve_profiler(app, runtime)
+
+MODEL_DIR = os.getenv('VOICE_MODEL_DIR', 'voice-models')
+TRAIN_PROCESSES = int(os.getenv('VOICE_TRAIN_PROCESSES', str(os.cpu_count() or 2)))
+FEATURE_DIM = int(os.getenv('VOICE_FEATURE_DIM', str(DEFAULT_DIM)))
+COMPONENTS = int(os.getenv('VOICE_COMPONENTS', '16'))
+CHUNK = int(os.getenv('VOICE_TRAIN_CHUNK', '500'))
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+  global _pool
+  if _pool is None:
+    _pool = ProcessPoolExecutor(max_workers=TRAIN_PROCESSES)
+  return _pool
 
 
 @app.get('/health')
@@ -28,33 +60,72 @@ async def health():
   return {"status": "ok", "service": "voice-train-worker"}
 
 
-async def start_nats_loop():
-  nats_url = os.getenv("NATS_URL", "nats://localhost:4222")
-  nc = NATS()
-  await nc.connect(servers=[nats_url])
-
-  async def handle_request(msg):
-    payload = json.loads(msg.data.decode())
-    req = VoiceTrainRequest(**payload)
-    # Simulate training epochs
-    for _ in range(3):
-      await asyncio.sleep(0.5)
-      # Normally would emit progress updates here
-    voice_model_id = f"vm_{random.randint(1_000_000, 9_999_999)}"
-    resp = VoiceTrainResponse(
-      request_id=req.request_id,
-      voice_model_id=voice_model_id,
-      metrics={"accuracy": 0.88, "epochs": 3, "datasetSize": len(req.examples)},
+async def keep_alive(msg, jobs: set[asyncio.Future]) -> set[asyncio.Future]:
+  """Wait for some of `jobs`, keeping the JetStream message alive meanwhile."""
+  while True:
+    done, _ = await asyncio.wait(jobs, timeout=runtime.config.ack_wait / 2, return_when=asyncio.FIRST_COMPLETED)
+    if done:
+      return done
+    if runtime.config.jetstream:
+      await msg.in_progress()
+
+
+async def progress(req: VoiceTrainRequest, stage: str, done: int, total: int):
+  update = VoiceTrainProgress(
+    request_id=req.request_id, brand_id=req.brand_id, stage=stage, done=done, total=total, progress=round(done / total, 4),
+  )
+  await runtime.publish('voice.train.progress', encode(update))
+
+
+@runtime.subscribe('voice.train.request', idempotent=True)
+async def handle_request(msg):
+  try:
+    req = decode(msg.data, VoiceTrainRequest)
+    texts = [e['content'] for e in req.examples if isinstance(e.get('content'), str) and e['content'].strip()]
+    if not texts:
+      raise ValueError('no example has any content')
+    started = time.perf_counter()
+    voice_model_id = model_id(req.brand_id, texts, FEATURE_DIM, COMPONENTS)
+
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    chunks = [texts[i:i + CHUNK] for i in range(0, len(texts), CHUNK)]
+    total = len(chunks) + 1
+    jobs = {loop.run_in_executor(pool, featurize_chunk, chunk, FEATURE_DIM): i for i, chunk in enumerate(chunks)}
+    results = [None] * len(chunks)
+    pending = set(jobs)
+    while pending:
+      done = await keep_alive(msg, pending)
+      pending -= done
+      for job in done:
+        results[jobs[job]] = job.result()
+      await progress(req, 'features', len(chunks) - len(pending), total)
+
+    indptr, indices, counts, stats = merge_chunks(results)
+    meta = {'brand_id': req.brand_id, 'constraints': req.constraints or {}, 'trained_at': time.time()}
+    await progress(req, 'fit', len(chunks), total)
+    job = loop.run_in_executor(
+      pool, fit, MODEL_DIR, voice_model_id, indptr, indices, counts, stats, FEATURE_DIM, COMPONENTS, meta,
     )
-    await nc.publish('voice.train.complete', json.dumps(resp.model_dump()).encode())
+    await keep_alive(msg, {job})
+    metrics = job.result()
+    await progress(req, 'done', total, total)
 
-  await nc.subscribe('voice.train.request', cb=handle_request)
-  while True:
-    await asyncio.sleep(3600)
+    metrics['skipped'] = len(req.examples) - len(texts)
+    metrics['trainingSeconds'] = round(time.perf_counter() - started, 3)
+    resp = VoiceTrainResponse(request_id=req.request_id, voice_model_id=voice_model_id, metrics=metrics)
+    await runtime.publish('voice.train.complete', encode(resp))
+  except Exception as e:
+    await runtime.publish('voice.train.failed', encode({'error': str(e)}))
 
 
 @app.on_event('startup')
 async def on_startup():
-  asyncio.create_task(start_nats_loop())
+  await runtime.start()
 
 
+@app.on_event('shutdown')
+async def on_shutdown():
+  await runtime.stop()
+  if _pool is not None:
+    _pool.shutdown()
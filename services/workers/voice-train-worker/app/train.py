@@ -0,0 +1,142 @@
+"""Brand-voice training, run in a process pool.
+
+`featurize_chunk` turns a chunk of examples into CSR term counts and
+per-post statistics; chunks are merged and `fit` computes IDF, the centroid
+and the top principal components of the TF-IDF vectors (randomized SVD with
+one power iteration, never densifying the n × dim matrix), calibrates the
+distance of the examples to the voice and writes the model directory with
+`worker_common.voice.save_model`.
+"""
+import hashlib
+import time
+
+import numpy as np
+from worker_common.voice import count_matrix, save_model, summarize_stats, text_stats, tfidf
+
+
+def model_id(brand_id: str, texts: list[str], dim: int, components: int) -> str:
+  """Same brand, examples and settings → same model ID (retraining is idempotent)."""
+  digest = hashlib.blake2b(digest_size=12)
+  digest.update(f"{brand_id}\0{dim}\0{components}".encode())
+  for text in texts:
+    digest.update(b'\0' + text.encode())
+  return f"vm_{digest.hexdigest()}"
+
+
+def featurize_chunk(texts: list[str], dim: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+  indptr, indices, counts = count_matrix(texts, dim)
+  return indptr, indices, counts, [text_stats(text) for text in texts]
+
+
+def merge_chunks(chunks: list[tuple[np.ndarray, np.ndarray, np.ndarray, list[dict]]]):
+  indptr = [np.zeros(1, dtype=np.int64)]
+  offset = 0
+  for chunk_indptr, *_ in chunks:
+    indptr.append(chunk_indptr[1:] + offset)
+    offset += chunk_indptr[-1]
+  return (
+    np.concatenate(indptr),
+    np.concatenate([c[1] for c in chunks]),
+    np.concatenate([c[2] for c in chunks]),
+    [row for c in chunks for row in c[3]],
+  )
+
+
+class _Centered:
+  """Products with the centered TF-IDF matrix X - 1·cᵀ kept in CSR form."""
+
+  def __init__(self, indptr: np.ndarray, indices: np.ndarray, values: np.ndarray, centroid: np.ndarray):
+    self.n = len(indptr) - 1
+    self.dim = len(centroid)
+    self.rows = np.repeat(np.arange(self.n), np.diff(indptr))
+    self.indices = indices
+    self.values = values.astype(np.float64)
+    self.centroid = centroid
+
+  def times(self, w: np.ndarray) -> np.ndarray:
+    """(X - 1cᵀ) @ w for w of shape dim × p."""
+    out = np.empty((self.n, w.shape[1]))
+    for j in range(w.shape[1]):
+      out[:, j] = np.bincount(self.rows, weights=self.values * w[self.indices, j], minlength=self.n)
+    return out - self.centroid @ w
+
+  def transpose_times(self, q: np.ndarray) -> np.ndarray:
+    """(X - 1cᵀ)ᵀ @ q for q of shape n × p."""
+    out = np.empty((self.dim, q.shape[1]))
+    for j in range(q.shape[1]):
+      out[:, j] = np.bincount(self.indices, weights=self.values * q[self.rows, j], minlength=self.dim)
+    return out - np.outer(self.centroid, q.sum(axis=0))
+
+
+def fit(
+  root: str,
+  voice_model_id: str,
+  indptr: np.ndarray,
+  indices: np.ndarray,
+  counts: np.ndarray,
+  stats: list[dict],
+  dim: int,
+  components: int,
+  meta: dict,
+) -> dict:
+  """Fit and save the model; returns the training metrics."""
+  started = time.perf_counter()
+  n = len(indptr) - 1
+  df = np.bincount(indices, minlength=dim)
+  idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+  values = tfidf(indptr, indices, counts, idf)
+  rows = np.repeat(np.arange(n), np.diff(indptr))
+  centroid = np.bincount(indices, weights=values, minlength=dim) / n
+  x = _Centered(indptr, indices, values, centroid)
+
+  k = min(components, n - 1)
+  if k > 0:
+    rng = np.random.default_rng(0)
+    p = min(k + 8, n)
+    q, _ = np.linalg.qr(x.times(rng.standard_normal((dim, p))))
+    q, _ = np.linalg.qr(x.times(x.transpose_times(q)))  # one power iteration
+    _, s, vt = np.linalg.svd(x.transpose_times(q).T, full_matrices=False)
+    basis = vt[:k].T  # dim × k
+    variances = s[:k] ** 2 / (n - 1)
+  else:
+    basis = np.zeros((dim, 0))
+    variances = np.zeros(0)
+
+  # Distance calibration on the examples themselves.
+  similarity = np.bincount(rows, weights=values * centroid[indices], minlength=n)
+  centroid_sq = float(centroid @ centroid)
+  dist_sq = np.maximum(1 - 2 * similarity + centroid_sq, 0)
+  proj = x.times(basis) if k > 0 else np.zeros((n, 0))
+  residual = np.maximum(dist_sq - (proj * proj).sum(axis=1), 0)
+  mean_residual = max(float(residual.mean()), 1e-6)
+  subspace = (proj * proj / np.maximum(variances, 1e-9)).mean(axis=1) if k > 0 else np.zeros(n)
+  distance = np.maximum(subspace, residual / mean_residual)
+  p50, p95 = (float(v) for v in np.percentile(distance, [50, 95]))
+  total_variance = float(dist_sq.sum() / max(n - 1, 1))
+
+  metrics = {
+    'datasetSize': n,
+    'dim': dim,
+    'components': int(k),
+    'features': int(np.count_nonzero(df)),
+    'explainedVariance': round(float(variances.sum()) / total_variance, 4) if total_variance else 0.0,
+    'meanSimilarity': round(float(similarity.mean() / max(np.sqrt(centroid_sq), 1e-12)), 4),
+    'distanceP50': round(p50, 4),
+    'distanceP95': round(p95, 4),
+  }
+  save_model(
+    root,
+    voice_model_id,
+    {'idf': idf, 'centroid': centroid, 'components': basis, 'variances': variances},
+    {
+      **meta,
+      'dim': dim,
+      'centroid_norm_sq': centroid_sq,
+      'centroid_projection': (centroid @ basis).tolist(),
+      'calibration': {'p50': p50, 'p95': p95, 'residual': mean_residual},
+      'stats': summarize_stats(stats),
+      'metrics': metrics,
+    },
+  )
+  metrics['fitSeconds'] = round(time.perf_counter() - started, 3)
+  return metrics
@@ -0,0 +1,88 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from worker_common.idempotency import Idempotency, IdempotencyStore, capture
+
+
+def request(request_id: str) -> SimpleNamespace:
+  return SimpleNamespace(subject='publish.twitter', data=json.dumps({'request_id': request_id}).encode())
+
+
+class FlakyHandler:
+  """Publishes publish.failed on the first `failures` runs, publish.success after."""
+
+  def __init__(self, failures: int):
+    self.failures = failures
+    self.runs = 0
+    self.published: list[str] = []
+
+  async def publish(self, subject, data, headers=None):
+    capture(subject, data, headers)
+    self.published.append(subject)
+
+  async def __call__(self, msg):
+    self.runs += 1
+    subject = 'publish.failed' if self.runs <= self.failures else 'publish.success'
+    await self.publish(subject, msg.data)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def idempotency(request, tmp_path):
+  store = IdempotencyStore(str(tmp_path / 'idempotency.db')) if request.param == 'sqlite' else None
+  idem = Idempotency(store, window=1000)
+  yield idem
+  idem.close()
+
+
+def test_duplicate_replays_response(idempotency):
+  handler = FlakyHandler(failures=0)
+
+  async def scenario():
+    await idempotency.run(request('r1'), handler, handler.publish)
+    await idempotency.run(request('r1'), handler, handler.publish)
+
+  asyncio.run(scenario())
+  assert handler.runs == 1
+  assert handler.published == ['publish.success', 'publish.success']
+
+
+def test_failed_request_runs_again_on_retry(idempotency):
+  handler = FlakyHandler(failures=1)
+
+  async def scenario():
+    await idempotency.run(request('r1'), handler, handler.publish)
+    await idempotency.run(request('r1'), handler, handler.publish)
+    await idempotency.run(request('r1'), handler, handler.publish)
+
+  asyncio.run(scenario())
+  assert handler.runs == 2
+  assert handler.published == ['publish.failed', 'publish.success', 'publish.success']
+  assert idempotency.counts['failed'] == 1
+
+
+def test_failed_request_is_released_in_store(tmp_path):
+  path = str(tmp_path / 'idempotency.db')
+  handler = FlakyHandler(failures=1)
+
+  async def attempt():
+    idem = Idempotency(IdempotencyStore(path))
+    try:
+      await idem.run(request('r1'), handler, handler.publish)
+    finally:
+      idem.close()
+
+  asyncio.run(attempt())
+  asyncio.run(attempt())  # a restarted process sees no claim for the failed run
+  assert handler.runs == 2
+  assert handler.published == ['publish.failed', 'publish.success']
+
+
+def test_from_env_defaults_to_filter(monkeypatch, tmp_path):
+  monkeypatch.delenv('WORKER_IDEMPOTENCY_PATH', raising=False)
+  monkeypatch.chdir(tmp_path)
+  idem = Idempotency.from_env()
+  assert idem.store is None and idem.seen is not None
+  assert not list(tmp_path.iterdir())
@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import pytest
+
+from worker_common import MemoryBus, RetryLater, RuntimeConfig, WorkerRuntime
+
+
+def config(**overrides) -> RuntimeConfig:
+  settings = dict(
+    max_concurrency=4, fetch_timeout=0.05, ack_wait=5.0, nak_delay=0.01, drain_timeout=5.0,
+    metrics=False, idempotency=False,
+  )
+  return RuntimeConfig(**{**settings, **overrides})
+
+
+async def until(condition, timeout: float = 2.0):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      raise AssertionError('condition not met in time')
+    await asyncio.sleep(0.01)
+
+
+def test_smoke_request_reply():
+  runtime = WorkerRuntime('echo-worker', config())
+  replies = []
+
+  @runtime.subscribe('echo.request')
+  async def handle(msg):
+    await runtime.publish('echo.reply', msg.data.upper())
+
+  async def scenario():
+    bus = MemoryBus()
+
+    async def on_reply(msg):
+      replies.append(msg.data)
+
+    await bus.subscribe('echo.reply', cb=on_reply)
+    await runtime.start(bus=bus)
+    await bus.publish('echo.request', b'hello')
+    await until(lambda: replies)
+    await runtime.stop()
+
+  asyncio.run(scenario())
+  assert replies == [b'HELLO']
+
+
+@pytest.mark.parametrize('jetstream', [True, False])
+def test_ack_on_success(jetstream):
+  runtime = WorkerRuntime('test-worker', config(jetstream=jetstream, ack_wait=0.1))
+  seen = []
+
+  @runtime.subscribe('work.item')
+  async def handle(msg):
+    seen.append(msg)
+
+  async def scenario():
+    bus = MemoryBus()
+    await runtime.start(bus=bus)
+    await bus.publish('work.item', b'1')
+    await until(lambda: seen)
+    await asyncio.sleep(0.3)  # an unacked message would be redelivered after ack_wait
+    await runtime.stop()
+
+  asyncio.run(scenario())
+  assert len(seen) == 1
+  if jetstream:
+    assert seen[0]._done
+
+
+@pytest.mark.parametrize('jetstream', [True, False])
+def test_retry_later_redelivers_after_delay(jetstream):
+  runtime = WorkerRuntime('test-worker', config(jetstream=jetstream))
+  attempts = []
+
+  @runtime.subscribe('work.item')
+  async def handle(msg):
+    attempts.append((runtime.attempt(msg), time.monotonic()))
+    if len(attempts) == 1:
+      raise RetryLater(0.2, 'not yet')
+
+  async def scenario():
+    bus = MemoryBus()
+    await runtime.start(bus=bus)
+    await bus.publish('work.item', b'1')
+    await until(lambda: len(attempts) == 2)
+    await runtime.stop()
+
+  asyncio.run(scenario())
+  assert [attempt for attempt, _ in attempts] == [1, 2]
+  assert attempts[1][1] - attempts[0][1] >= 0.2
+
+
+def test_exception_naks_until_max_deliver():
+  runtime = WorkerRuntime('test-worker', config(max_deliver=3))
+  attempts = []
+
+  @runtime.subscribe('work.item')
+  async def handle(msg):
+    attempts.append(runtime.attempt(msg))
+    raise ValueError('boom')
+
+  async def scenario():
+    bus = MemoryBus()
+    await runtime.start(bus=bus)
+    await bus.publish('work.item', b'1')
+    await until(lambda: len(attempts) == 3)
+    await asyncio.sleep(0.1)
+    await runtime.stop()
+
+  asyncio.run(scenario())
+  assert attempts == [1, 2, 3]
+
+
+@pytest.mark.parametrize('jetstream', [True, False])
+def test_concurrency_is_bounded(jetstream):
+  runtime = WorkerRuntime('test-worker', config(jetstream=jetstream, max_concurrency=3))
+  running = peak = done = 0
+
+  @runtime.subscribe('work.item')
+  async def handle(msg):
+    nonlocal running, peak, done
+    running += 1
+    peak = max(peak, running)
+    await asyncio.sleep(0.05)
+    running -= 1
+    done += 1
+
+  async def scenario():
+    bus = MemoryBus()
+    await runtime.start(bus=bus)
+    for i in range(12):
+      await bus.publish('work.item', str(i).encode())
+    await until(lambda: done == 12)
+    await runtime.stop()
+
+  asyncio.run(scenario())
+  assert peak == 3
+
+
+def test_stop_drains_in_flight_handlers():
+  runtime = WorkerRuntime('test-worker', config())
+  started, finished = [], []
+
+  @runtime.subscribe('work.item')
+  async def handle(msg):
+    started.append(msg)
+    await asyncio.sleep(0.2)
+    finished.append(msg)
+
+  async def scenario():
+    bus = MemoryBus()
+    await runtime.start(bus=bus)
+    for i in range(3):
+      await bus.publish('work.item', str(i).encode())
+    await until(lambda: len(started) == 3)
+    await runtime.stop()
+    assert runtime.in_flight == 0
+
+  asyncio.run(scenario())
+  assert len(finished) == 3
+  assert all(msg._done for msg in finished)
@@ -0,0 +1,4 @@
+from .bus import MemoryBus, NatsBus
+from .runtime import RetryLater, RuntimeConfig, WorkerRuntime
+
+__all__ = ['MemoryBus', 'NatsBus', 'RetryLater', 'RuntimeConfig', 'WorkerRuntime']
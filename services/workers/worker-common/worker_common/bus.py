@@ -0,0 +1,289 @@
+"""Message bus adapters used by the worker runtime.
+
+`NatsBus` talks to a real NATS server and consumes through durable JetStream
+pull consumers. `MemoryBus` is an in-process stand-in with the same surface
+(durable consumers, ack/nak/term, redelivery) for local runs and benchmarks.
+"""
+import asyncio
+import itertools
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import nats
+from nats.js import api
+from nats.js.errors import NotFoundError
+
+
+DEFAULT_MAX_PAYLOAD = 1024 * 1024
+
+
+@dataclass
+class ConsumerSettings:
+  ack_wait: float = 30.0
+  max_deliver: int = 5
+
+
+def subject_matches(pattern: str, subject: str) -> bool:
+  """NATS wildcard match: `*` matches one token, `>` matches the rest."""
+  p_tokens = pattern.split('.')
+  s_tokens = subject.split('.')
+  for i, tok in enumerate(p_tokens):
+    if tok == '>':
+      return len(s_tokens) > i
+    if i >= len(s_tokens) or (tok != '*' and tok != s_tokens[i]):
+      return False
+  return len(p_tokens) == len(s_tokens)
+
+
+class NatsBus:
+  """NATS connection with JetStream pull consumers for durable subjects."""
+
+  def __init__(self, url: str, stream: str, stream_max_age: float | None = None):
+    self.url = url
+    self.stream = stream
+    self.stream_max_age = stream_max_age
+    self.nc = None
+    self.js = None
+
+  async def connect(self):
+    self.nc = await nats.connect(servers=[self.url])
+    self.js = self.nc.jetstream()
+
+  @property
+  def max_payload(self) -> int:
+    return self.nc.max_payload if self.nc else DEFAULT_MAX_PAYLOAD
+
+  async def publish(self, subject: str, data: bytes, headers: dict | None = None):
+    await self.nc.publish(subject, data, headers=headers)
+
+  async def ensure_stream(self, subjects: list[str]):
+    """Make sure every subject is captured by some stream.
+
+    Subjects already bound to a provisioned stream are left alone; the rest are
+    added to this bus' stream, which is created on first use.
+    """
+    missing = []
+    for subject in subjects:
+      try:
+        await self.js.find_stream_name_by_subject(subject)
+      except NotFoundError:
+        missing.append(subject)
+    if not missing:
+      return
+    try:
+      info = await self.js.stream_info(self.stream)
+    except NotFoundError:
+      await self.js.add_stream(name=self.stream, subjects=sorted(missing), max_age=self.stream_max_age)
+      return
+    config = info.config
+    config.subjects = sorted(set(config.subjects or []) | set(missing))
+    await self.js.update_stream(config)
+
+  async def pull_subscribe(self, subject: str, durable: str, settings: ConsumerSettings):
+    config = api.ConsumerConfig(
+      durable_name=durable,
+      ack_policy=api.AckPolicy.EXPLICIT,
+      ack_wait=settings.ack_wait,
+      max_deliver=settings.max_deliver,
+    )
+    sub = await self.js.pull_subscribe(subject, durable=durable, config=config)
+    return _NatsPullSubscription(sub)
+
+  async def subscribe(self, subject: str, cb: Callable[..., Awaitable], queue: str = ''):
+    return await self.nc.subscribe(subject, queue=queue, cb=cb)
+
+  async def close(self):
+    if self.nc and not self.nc.is_closed:
+      await self.nc.drain()
+
+
+class _NatsPullSubscription:
+  def __init__(self, sub):
+    self._sub = sub
+
+  async def fetch(self, batch: int, timeout: float) -> list:
+    try:
+      return await self._sub.fetch(batch, timeout=timeout)
+    except nats.errors.TimeoutError:
+      return []
+
+  async def unsubscribe(self):
+    await self._sub.unsubscribe()
+
+
+@dataclass
+class MemoryMetadata:
+  num_delivered: int
+
+
+class MemoryMsg:
+  """Message delivered by `MemoryBus`; mirrors the nats-py `Msg` surface."""
+
+  def __init__(self, subject: str, data: bytes, headers: dict | None = None, reply: str = '', consumer=None):
+    self.subject = subject
+    self.data = data
+    self.headers = headers
+    self.reply = reply
+    self._consumer = consumer
+    self._delivered = 0
+    self._done = False
+    self._timer = None
+
+  @property
+  def metadata(self) -> MemoryMetadata:
+    return MemoryMetadata(num_delivered=self._delivered)
+
+  async def ack(self):
+    self._settle()
+
+  async def term(self):
+    self._settle()
+
+  async def in_progress(self):
+    if self._consumer and not self._done:
+      self._consumer.arm(self)
+
+  async def nak(self, delay: float | None = None):
+    if self._consumer and not self._done:
+      self._consumer.requeue(self, delay or 0)
+
+  def _settle(self):
+    self._done = True
+    if self._timer:
+      self._timer.cancel()
+      self._timer = None
+
+
+class _MemoryConsumer:
+  def __init__(self, settings: ConsumerSettings):
+    self.settings = settings
+    self.pending: deque[MemoryMsg] = deque()
+    self.ready = asyncio.Event()
+
+  def push(self, msg: MemoryMsg):
+    self.pending.append(msg)
+    self.ready.set()
+
+  def arm(self, msg: MemoryMsg):
+    if msg._timer:
+      msg._timer.cancel()
+    loop = asyncio.get_running_loop()
+    msg._timer = loop.call_later(self.settings.ack_wait, self.requeue, msg, 0)
+
+  def requeue(self, msg: MemoryMsg, delay: float):
+    if msg._timer:
+      msg._timer.cancel()
+      msg._timer = None
+    if msg._done:
+      return
+    if msg._delivered >= self.settings.max_deliver:
+      msg._done = True
+      return
+    if delay > 0:
+      msg._timer = asyncio.get_running_loop().call_later(delay, self.push, msg)
+    else:
+      self.push(msg)
+
+  async def fetch(self, batch: int, timeout: float) -> list[MemoryMsg]:
+    if not self.pending:
+      self.ready.clear()
+      try:
+        await asyncio.wait_for(self.ready.wait(), timeout)
+      except asyncio.TimeoutError:
+        return []
+    out = []
+    while self.pending and len(out) < batch:
+      msg = self.pending.popleft()
+      if msg._done:
+        continue
+      msg._delivered += 1
+      self.arm(msg)
+      out.append(msg)
+    return out
+
+  async def unsubscribe(self):
+    pass
+
+
+class MemoryBus:
+  """In-process stand-in for NATS + JetStream.
+
+  Durable consumers survive a runtime stop/start on the same bus instance, so
+  unacked and nak'd messages are redelivered just like with a real server.
+  Messages published to a stream subject before any consumer exists are held
+  until the first consumer for that subject attaches.
+  """
+
+  def __init__(self, max_payload: int = DEFAULT_MAX_PAYLOAD):
+    self.max_payload = max_payload
+    self._stream_subjects: set[str] = set()
+    self._consumers: dict[str, tuple[str, _MemoryConsumer]] = {}
+    self._backlog: dict[str, deque] = {}
+    self._subs: dict[int, tuple[str, str, Callable[..., Awaitable]]] = {}
+    self._sub_ids = itertools.count()
+    self._queue_rr: dict[tuple[str, str], int] = {}
+    self._tasks: set[asyncio.Task] = set()
+
+  async def connect(self):
+    pass
+
+  async def ensure_stream(self, subjects: list[str]):
+    self._stream_subjects.update(subjects)
+
+  async def publish(self, subject: str, data: bytes, headers: dict | None = None, reply: str = ''):
+    if len(data) > self.max_payload:
+      raise ValueError(f"payload of {len(data)} bytes exceeds max_payload {self.max_payload}")
+    delivered = False
+    for filter_subject, consumer in self._consumers.values():
+      if subject_matches(filter_subject, subject):
+        consumer.push(MemoryMsg(subject, data, headers, reply, consumer))
+        delivered = True
+    if not delivered and any(subject_matches(s, subject) for s in self._stream_subjects):
+      self._backlog.setdefault(subject, deque()).append((data, headers, reply))
+    self._deliver_core(subject, data, headers, reply)
+
+  def _deliver_core(self, subject: str, data: bytes, headers: dict | None, reply: str):
+    groups: dict[str, list] = {}
+    for pattern, queue, cb in list(self._subs.values()):
+      if not subject_matches(pattern, subject):
+        continue
+      if queue:
+        groups.setdefault(queue, []).append(cb)
+      else:
+        self._spawn(cb(MemoryMsg(subject, data, headers, reply)))
+    for queue, members in groups.items():
+      idx = self._queue_rr.get((subject, queue), 0)
+      self._queue_rr[(subject, queue)] = idx + 1
+      self._spawn(members[idx % len(members)](MemoryMsg(subject, data, headers, reply)))
+
+  def _spawn(self, coro):
+    task = asyncio.ensure_future(coro)
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  async def pull_subscribe(self, subject: str, durable: str, settings: ConsumerSettings):
+    if durable not in self._consumers:
+      consumer = _MemoryConsumer(settings)
+      self._consumers[durable] = (subject, consumer)
+      for pending_subject in [s for s in self._backlog if subject_matches(subject, s)]:
+        for data, headers, reply in self._backlog.pop(pending_subject):
+          consumer.push(MemoryMsg(pending_subject, data, headers, reply, consumer))
+    return self._consumers[durable][1]
+
+  async def subscribe(self, subject: str, cb: Callable[..., Awaitable], queue: str = ''):
+    sub_id = next(self._sub_ids)
+    self._subs[sub_id] = (subject, queue, cb)
+    return _MemorySubscription(self, sub_id)
+
+  async def close(self):
+    self._subs.clear()
+
+
+class _MemorySubscription:
+  def __init__(self, bus: MemoryBus, sub_id: int):
+    self._bus = bus
+    self._sub_id = sub_id
+
+  async def unsubscribe(self):
+    self._bus._subs.pop(self._sub_id, None)
@@ -0,0 +1,78 @@
+"""Typed JSON codec for bus messages.
+
+Message types are msgspec Structs deriving from `Message`:
+
+  class PublishRequest(Message):
+    request_id: str
+    content: str
+    media_ids: list[str] | None = None
+
+  req = decode(msg.data, PublishRequest)
+  await runtime.publish('publish.success', encode(resp))
+
+`decode` parses the message bytes straight into the typed struct (no
+intermediate str, dict or model copy) with a decoder built once per type;
+`encode` writes a struct, or plain dicts and lists, straight to bytes.
+
+The wire format stays what pydantic + `json` produced: unknown fields are
+ignored, every field is encoded (None included) in declaration order, and
+decoding is lax, accepting the numeric strings and similar coercions that
+pydantic accepted. A type whose required fields follow defaulted ones (fine
+for pydantic) is declared keyword-only: `class GenerateRequest(Message,
+kw_only=True)`.
+"""
+import functools
+from typing import Any, TypeVar
+
+import msgspec
+
+
+T = TypeVar('T')
+
+# Raised for malformed JSON; ValidationError (wrong or missing fields) is a subclass.
+DecodeError = msgspec.DecodeError
+ValidationError = msgspec.ValidationError
+# A field left undecoded, e.g. a payload forwarded byte for byte.
+Raw = msgspec.Raw
+
+
+class Message(msgspec.Struct):
+  """Base class of bus message types."""
+
+
+def _enc_hook(obj: Any) -> Any:
+  # NumPy scalars (np.float64 is a float subclass, np.int64 and np.bool_ are
+  # not ints) encode as the Python numbers json.dumps produced for them.
+  if isinstance(obj, float):
+    return float(obj)
+  item = getattr(obj, 'item', None)
+  if callable(item) and getattr(obj, 'ndim', None) == 0:
+    return item()
+  raise NotImplementedError(f"cannot encode objects of type {type(obj).__name__}")
+
+
+_encoder = msgspec.json.Encoder(enc_hook=_enc_hook)
+
+
+@functools.lru_cache(maxsize=None)
+def decoder(type_: Any = Any) -> msgspec.json.Decoder:
+  """Cached decoder for `type_` (`Any` decodes to plain dicts and lists)."""
+  return msgspec.json.Decoder(type_, strict=False)
+
+
+def decode(data: bytes | bytearray | memoryview, type_: type[T] = Any) -> T:
+  return decoder(type_).decode(data)
+
+
+def encode(obj: Any) -> bytes:
+  return _encoder.encode(obj)
+
+
+def to_builtins(obj: Any) -> Any:
+  """Plain dicts and lists of `obj`, e.g. for HTTP responses."""
+  return msgspec.to_builtins(obj)
+
+
+def replace(obj: T, **changes) -> T:
+  """Copy of struct `obj` with `changes` applied."""
+  return msgspec.structs.replace(obj, **changes)
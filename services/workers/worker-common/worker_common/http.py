@@ -0,0 +1,137 @@
+"""Pooled HTTP clients for the platform connectors.
+
+Each connector owns one `PlatformHttp`, which holds a single long-lived
+`httpx.AsyncClient` for its platform: HTTP/2 where the server supports it,
+keep-alive connections reused across publishes, and explicit pool limits and
+timeouts. The client is opened on startup and closed on shutdown:
+
+  http = PlatformHttp('twitter')
+
+  if http.enabled:
+    resp = await http.request('POST', '/2/tweets', json=body, headers=auth)
+
+A platform is only called for real when `<PLATFORM>_API_BASE_URL` is set;
+otherwise `enabled` is False and connectors keep their local stub.
+
+Needs the `http` extra (`httpx[http2]`).
+"""
+import logging
+import os
+from dataclasses import dataclass
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+  import h2  # noqa: F401
+  HTTP2_AVAILABLE = True
+except ImportError:
+  HTTP2_AVAILABLE = False
+
+
+def _flag(value: str) -> bool:
+  return value.strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+@dataclass
+class HttpConfig:
+  base_url: str | None = None
+  http2: bool = True
+  max_connections: int = 100
+  max_keepalive: int = 20
+  keepalive_expiry: float = 30.0
+  connect_timeout: float = 5.0
+  read_timeout: float = 30.0
+  write_timeout: float = 30.0
+  pool_timeout: float = 5.0
+  verify: bool = True
+  # False opens a fresh client per request; only meant for benchmarking the pool.
+  pooled: bool = True
+
+  @classmethod
+  def from_env(cls, platform: str, **overrides) -> 'HttpConfig':
+    """`<PLATFORM>_API_BASE_URL` plus `<PLATFORM>_HTTP_*`, falling back to `CONNECTOR_HTTP_*`."""
+    config = cls(**overrides)
+    prefix = platform.upper()
+    config.base_url = os.getenv(f"{prefix}_API_BASE_URL") or config.base_url
+    env = {
+      'http2': ('HTTP2', _flag),
+      'max_connections': ('MAX_CONNECTIONS', int),
+      'max_keepalive': ('MAX_KEEPALIVE', int),
+      'keepalive_expiry': ('KEEPALIVE_EXPIRY', float),
+      'connect_timeout': ('CONNECT_TIMEOUT', float),
+      'read_timeout': ('READ_TIMEOUT', float),
+      'write_timeout': ('WRITE_TIMEOUT', float),
+      'pool_timeout': ('POOL_TIMEOUT', float),
+      'verify': ('VERIFY', _flag),
+      'pooled': ('POOLED', _flag),
+    }
+    for attr, (suffix, cast) in env.items():
+      value = os.getenv(f"{prefix}_HTTP_{suffix}") or os.getenv(f"CONNECTOR_HTTP_{suffix}")
+      if value:
+        setattr(config, attr, cast(value))
+    return config
+
+  def client_kwargs(self) -> dict:
+    return {
+      'base_url': self.base_url or '',
+      'http2': self.http2 and HTTP2_AVAILABLE,
+      'verify': self.verify,
+      'limits': httpx.Limits(
+        max_connections=self.max_connections,
+        max_keepalive_connections=self.max_keepalive,
+        keepalive_expiry=self.keepalive_expiry,
+      ),
+      'timeout': httpx.Timeout(
+        connect=self.connect_timeout,
+        read=self.read_timeout,
+        write=self.write_timeout,
+        pool=self.pool_timeout,
+      ),
+    }
+
+
+def bearer_headers(credentials: dict) -> dict:
+  return {'Authorization': f"Bearer {credentials.get('access_token', '')}"}
+
+
+class PlatformHttp:
+  """The long-lived HTTP client of one platform connector."""
+
+  def __init__(self, platform: str, config: HttpConfig | None = None):
+    self.platform = platform
+    self.config = config or HttpConfig.from_env(platform)
+    self._client: httpx.AsyncClient | None = None
+
+  @property
+  def enabled(self) -> bool:
+    return bool(self.config.base_url)
+
+  @property
+  def client(self) -> httpx.AsyncClient:
+    if self._client is None:
+      self._client = httpx.AsyncClient(**self.config.client_kwargs())
+    return self._client
+
+  async def start(self):
+    if not self.enabled:
+      return
+    if self.config.http2 and not HTTP2_AVAILABLE:
+      logger.warning("h2 is not installed; %s API calls fall back to HTTP/1.1", self.platform)
+    if self.config.pooled and self._client is None:
+      self._client = httpx.AsyncClient(**self.config.client_kwargs())
+    logger.info("%s API at %s", self.platform, self.config.base_url)
+
+  async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+    if not self.config.pooled:
+      async with httpx.AsyncClient(**self.config.client_kwargs()) as client:
+        return await client.request(method, path, **kwargs)
+    return await self.client.request(method, path, **kwargs)
+
+  async def close(self):
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
@@ -0,0 +1,388 @@
+"""Request-ID deduplication for handlers with side effects.
+
+A handler registered with `idempotent=True` runs once per `request_id` and
+subject; the messages it publishes are captured as its response, and a
+redelivered or retried duplicate publishes that response again instead of
+running the handler:
+
+  @runtime.subscribe('publish.twitter', idempotent=True)
+  async def handle_request(msg):
+    ...
+
+Only successful runs are recorded. A handler that raises (including
+`RetryLater`) or that published a `*.failed` message is forgotten, so its
+redelivery or the client's retry runs again, and a message without a
+`request_id` always runs.
+
+Responses live in a bounded LRU (entries and bytes). With a store
+(`WORKER_IDEMPOTENCY_PATH`, a SQLite file shared by every worker process on
+the host; unset by default) each request is claimed with one
+`INSERT OR IGNORE` in a worker thread before it runs,
+so a duplicate delivered to another replica while the first is still running
+is retried later, and one delivered afterwards (or after a restart) replays
+the stored response. Without a store, a rotating cuckoo filter remembers
+every completed key of the hot window at 2-4 bytes per key: a duplicate whose
+response has left the LRU is then acked without running (false positives,
+about 1.2e-4 with the default 16-bit fingerprints, are skipped the same way).
+"""
+import asyncio
+import contextvars
+import hashlib
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+import msgspec
+
+from .codec import Message, decode
+
+
+logger = logging.getLogger(__name__)
+
+ENTRY_OVERHEAD = 160  # rough per-entry cost of the key, list and tuple objects
+
+Response = list[tuple[str, bytes, dict | None]]
+
+# Messages published by the idempotent handler running in the current task.
+_captured: contextvars.ContextVar[Response | None] = contextvars.ContextVar('worker_idempotency_captured', default=None)
+
+
+def capture(subject: str, data: bytes, headers: dict | None):
+  """Record a publish for the idempotent handler running in this task, if any."""
+  captured = _captured.get()
+  if captured is not None:
+    captured.append((subject, data, headers))
+
+
+class _Keyed(Message):
+  request_id: str | int | None = None
+
+
+def request_key(subject: str, data: bytes) -> bytes | None:
+  """16-byte digest of subject and the message's request_id, or None without one."""
+  try:
+    request_id = decode(data, _Keyed).request_id
+  except msgspec.DecodeError:
+    return None
+  if request_id is None or request_id == '':
+    return None
+  return hashlib.blake2b(f"{subject}\0{request_id}".encode(), digest_size=16).digest()
+
+
+class CuckooFilter:
+  """Cuckoo filter of 16-byte digests: 4-slot buckets of `fingerprint_bits` fingerprints.
+
+  False-positive rate is about 8 / 2**fingerprint_bits: ~3% at 8 bits,
+  ~1.2e-4 at 16, ~2e-9 at 32. Holds `capacity` keys at up to 90% load.
+  """
+
+  SLOTS = 4
+  MAX_KICKS = 500
+
+  def __init__(self, capacity: int, fingerprint_bits: int = 16):
+    typecode = {8: 'B', 16: 'H', 32: 'I'}[fingerprint_bits]
+    buckets = 1 << max(1, math.ceil(capacity / (self.SLOTS * 0.9)) - 1).bit_length()
+    self.capacity = capacity
+    self.table = array(typecode, [0]) * (buckets * self.SLOTS)
+    self.mask = buckets - 1
+    self.fp_mask = (1 << fingerprint_bits) - 1
+    self.count = 0
+    self._rng = random.Random(0)
+
+  def _locate(self, digest: bytes) -> tuple[int, int, int]:
+    fp = int.from_bytes(digest[8:12], 'little') & self.fp_mask or 1  # 0 marks an empty slot
+    i1 = int.from_bytes(digest[:8], 'little') & self.mask
+    return fp, i1, self._alt(i1, fp)
+
+  def _alt(self, i: int, fp: int) -> int:
+    return (i ^ (fp * 0x5BD1E995)) & self.mask
+
+  def __contains__(self, digest: bytes) -> bool:
+    fp, i1, i2 = self._locate(digest)
+    table, s1, s2 = self.table, i1 * self.SLOTS, i2 * self.SLOTS
+    return fp in table[s1:s1 + self.SLOTS] or fp in table[s2:s2 + self.SLOTS]
+
+  def add(self, digest: bytes) -> bool:
+    """Insert `digest`; False when the table is too full (one older fingerprint is lost)."""
+    fp, i1, i2 = self._locate(digest)
+    table, slots = self.table, self.SLOTS
+    for i in (i1, i2):
+      try:
+        table[table.index(0, i * slots, i * slots + slots)] = fp
+        self.count += 1
+        return True
+      except ValueError:
+        pass
+    i = self._rng.choice((i1, i2))
+    for _ in range(self.MAX_KICKS):
+      slot = i * slots + self._rng.randrange(slots)
+      fp, table[slot] = table[slot], fp
+      i = self._alt(i, fp)
+      try:
+        table[table.index(0, i * slots, i * slots + slots)] = fp
+        self.count += 1
+        return True
+      except ValueError:
+        pass
+    return False
+
+  @property
+  def nbytes(self) -> int:
+    return len(self.table) * self.table.itemsize
+
+
+class RotatingFilter:
+  """Two cuckoo generations of `capacity` keys: the last 1-2x capacity keys are remembered."""
+
+  def __init__(self, capacity: int, fingerprint_bits: int = 16):
+    self.capacity = capacity
+    self.fingerprint_bits = fingerprint_bits
+    self.current = CuckooFilter(capacity, fingerprint_bits)
+    self.previous: CuckooFilter | None = None
+    self.rotations = 0
+
+  def add(self, digest: bytes):
+    if self.current.count >= self.capacity or not self.current.add(digest):
+      self.previous, self.current = self.current, CuckooFilter(self.capacity, self.fingerprint_bits)
+      self.rotations += 1
+      self.current.add(digest)
+
+  def __contains__(self, digest: bytes) -> bool:
+    return digest in self.current or (self.previous is not None and digest in self.previous)
+
+  @property
+  def nbytes(self) -> int:
+    return self.current.nbytes + (self.previous.nbytes if self.previous is not None else 0)
+
+
+class IdempotencyStore:
+  """Claims and responses in SQLite, shared by every process on the host."""
+
+  def __init__(self, path: str):
+    self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("PRAGMA synchronous=NORMAL")
+    self._conn.execute(
+      "CREATE TABLE IF NOT EXISTS requests ("
+      " key BLOB PRIMARY KEY, claimed_at REAL NOT NULL, response BLOB) WITHOUT ROWID"
+    )
+    self._conn.execute("CREATE INDEX IF NOT EXISTS requests_claimed_at ON requests (claimed_at)")
+    self._lock = threading.Lock()
+
+  def claim(self, key: bytes, now: float, stale_after: float) -> tuple[str, bytes | float | None]:
+    """('new', None), ('done', response) or ('pending', claimed_at) for `key`.
+
+    A pending claim older than `stale_after` is taken over (its owner died).
+    """
+    with self._lock:
+      if self._conn.execute("INSERT OR IGNORE INTO requests (key, claimed_at) VALUES (?, ?)", (key, now)).rowcount:
+        return 'new', None
+      row = self._conn.execute("SELECT claimed_at, response FROM requests WHERE key = ?", (key,)).fetchone()
+      if row is None:
+        self._conn.execute("INSERT OR REPLACE INTO requests (key, claimed_at) VALUES (?, ?)", (key, now))
+        return 'new', None
+      claimed_at, response = row
+      if response is not None:
+        return 'done', response
+      if now - claimed_at > stale_after and self._conn.execute(
+        "UPDATE requests SET claimed_at = ? WHERE key = ? AND claimed_at = ? AND response IS NULL", (now, key, claimed_at),
+      ).rowcount:
+        return 'new', None
+      return 'pending', claimed_at
+
+  def complete(self, key: bytes, response: bytes):
+    with self._lock:
+      self._conn.execute("UPDATE requests SET response = ? WHERE key = ?", (response, key))
+
+  def release(self, key: bytes):
+    """Drop an unfinished claim so the redelivery can run."""
+    with self._lock:
+      self._conn.execute("DELETE FROM requests WHERE key = ? AND response IS NULL", (key,))
+
+  def prune(self, before: float) -> int:
+    with self._lock:
+      return self._conn.execute("DELETE FROM requests WHERE claimed_at < ?", (before,)).rowcount
+
+  def close(self):
+    self._conn.close()
+
+
+class Idempotency:
+  """LRU of responses over a store (or, without one, a cuckoo filter of completed keys)."""
+
+  def __init__(
+    self,
+    store: IdempotencyStore | None = None,
+    max_entries: int = 10_000,
+    max_bytes: int = 64 * 2**20,
+    window: int = 5_000_000,
+    fingerprint_bits: int = 16,
+    ttl: float = 7 * 24 * 3600,
+    stale_after: float = 60.0,
+  ):
+    self.store = store
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.stale_after = stale_after
+    self.seen = RotatingFilter(window, fingerprint_bits) if store is None else None
+    self._responses: OrderedDict[bytes, Response] = OrderedDict()
+    self._sizes: dict[bytes, int] = {}
+    self._bytes = 0
+    self._inflight: dict[bytes, asyncio.Future] = {}
+    self._completed = 0
+    self.counts = dict.fromkeys(('new', 'replayed', 'waited', 'retried', 'skipped', 'failed'), 0)
+
+  @classmethod
+  def from_env(cls, stale_after: float = 60.0) -> 'Idempotency':
+    path = os.getenv('WORKER_IDEMPOTENCY_PATH', '')
+    if path:
+      Path(path).parent.mkdir(parents=True, exist_ok=True)
+    return cls(
+      IdempotencyStore(path) if path else None,
+      max_entries=int(os.getenv('WORKER_IDEMPOTENCY_CACHE', '10000')),
+      max_bytes=int(float(os.getenv('WORKER_IDEMPOTENCY_CACHE_MB', '64')) * 2**20),
+      window=int(os.getenv('WORKER_IDEMPOTENCY_WINDOW', '5000000')),
+      fingerprint_bits=int(os.getenv('WORKER_IDEMPOTENCY_FINGERPRINT_BITS', '16')),
+      ttl=float(os.getenv('WORKER_IDEMPOTENCY_TTL', str(7 * 24 * 3600))),
+      stale_after=stale_after,
+    )
+
+  async def run(self, msg, fn, publish):
+    """Run `fn(msg)` unless `msg` duplicates a recorded request; then replay its response."""
+    key = request_key(msg.subject, msg.data)
+    if key is None:
+      await fn(msg)
+      return
+
+    response = self._get(key)
+    if response is None and key in self._inflight:
+      # Redelivered while the first delivery still runs in this process.
+      response = await asyncio.shield(self._inflight[key])
+      if response is not None:
+        self.counts['waited'] += 1
+        await self._replay(response, publish)
+        return
+    elif response is not None:
+      self.counts['replayed'] += 1
+      await self._replay(response, publish)
+      return
+
+    if self.store is not None:
+      state, value = await asyncio.to_thread(self.store.claim, key, time.time(), self.stale_after)
+      if state == 'done':
+        response = [tuple(m) for m in msgspec.msgpack.decode(value)]
+        self._put(key, response)
+        self.counts['replayed'] += 1
+        await self._replay(response, publish)
+        return
+      if state == 'pending':
+        from .runtime import RetryLater  # the runtime imports this module
+
+        self.counts['retried'] += 1
+        raise RetryLater(max(0.5, min(5.0, value + self.stale_after - time.time())), 'request in progress elsewhere')
+    elif key in self.seen:
+      self.counts['skipped'] += 1
+      logger.info("skipping duplicate %s request whose response is no longer cached", msg.subject)
+      return
+
+    self.counts['new'] += 1
+    done = asyncio.get_running_loop().create_future()
+    self._inflight[key] = done
+    captured: Response = []
+    token = _captured.set(captured)
+    try:
+      await fn(msg)
+    except BaseException:
+      try:
+        await self._release(key)
+      finally:
+        done.set_result(None)
+      raise
+    finally:
+      _captured.reset(token)
+      del self._inflight[key]
+    if any(subject.endswith('.failed') for subject, _, _ in captured):
+      # The handler reported the failure itself; a retry of the request runs again.
+      self.counts['failed'] += 1
+      try:
+        await self._release(key)
+      finally:
+        done.set_result(None)
+      return
+    try:
+      await self._record(key, captured)
+    finally:
+      done.set_result(captured)
+
+  async def _release(self, key: bytes):
+    if self.store is not None:
+      await asyncio.to_thread(self.store.release, key)
+
+  async def _record(self, key: bytes, response: Response):
+    self._put(key, response)
+    if self.store is not None:
+      await asyncio.to_thread(self.store.complete, key, msgspec.msgpack.encode(response))
+      self._completed += 1
+      if self._completed % 1000 == 0:
+        await asyncio.to_thread(self.store.prune, time.time() - self.ttl)
+    else:
+      self.seen.add(key)
+
+  async def _replay(self, response: Response, publish):
+    for subject, data, headers in response:
+      await publish(subject, data, headers)
+
+  def _get(self, key: bytes) -> Response | None:
+    response = self._responses.get(key)
+    if response is not None:
+      self._responses.move_to_end(key)
+    return response
+
+  def _put(self, key: bytes, response: Response):
+    size = ENTRY_OVERHEAD + sum(len(subject) + len(data) for subject, data, _ in response)
+    if size > self.max_bytes:
+      return
+    if key in self._responses:
+      self._bytes -= self._sizes[key]
+    self._responses[key] = response
+    self._responses.move_to_end(key)
+    self._sizes[key] = size
+    self._bytes += size
+    while len(self._responses) > self.max_entries or self._bytes > self.max_bytes:
+      old, _ = self._responses.popitem(last=False)
+      self._bytes -= self._sizes.pop(old)
+
+  def stats(self) -> dict:
+    return {
+      **self.counts,
+      'cached': len(self._responses),
+      'cached_bytes': self._bytes,
+      'in_flight': len(self._inflight),
+      'filter_bytes': self.seen.nbytes if self.seen is not None else 0,
+    }
+
+  def render(self, labels: str) -> str:
+    """Prometheus series for `/metrics`, each carrying `labels`."""
+    lines = [
+      '# HELP worker_idempotency_messages_total Idempotent-handler messages by result.',
+      '# TYPE worker_idempotency_messages_total counter',
+    ]
+    lines += [f'worker_idempotency_messages_total{{{labels},result="{k}"}} {n}' for k, n in self.counts.items()]
+    lines += [
+      '# HELP worker_idempotency_cached_bytes Bytes of responses kept for replay.',
+      '# TYPE worker_idempotency_cached_bytes gauge',
+      f'worker_idempotency_cached_bytes{{{labels}}} {self._bytes}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+  def close(self):
+    if self.store is not None:
+      self.store.close()
@@ -0,0 +1,210 @@
+"""Prometheus instrumentation for the workers.
+
+`WorkerRuntime` records, per subject it consumes, the time to handle a
+message (ack included), messages in flight, handled messages by outcome
+(`ok`, `error`, `retry`) and received payload sizes; per subject it
+publishes, messages and bytes published (so `gen.failed` or `policy.failed`
+rates come straight from `worker_published_messages_total`); and the event
+loop's lag, sampled by a timer that should fire every `loop_lag_interval`
+seconds. Each worker serves it all in the Prometheus text format:
+
+  app = FastAPI(...)
+  runtime = WorkerRuntime('policy-check-worker')
+  serve_metrics(app, runtime)  # GET /metrics
+
+Recording a message costs two `perf_counter()` calls, two bucket bisections
+and a few integer increments; buckets are cumulated only when `/metrics` is
+scraped.
+
+Series carry a `service` label and, for a process run by the supervisor, a
+`process` label (`WORKER_PROCESS_INDEX`); scrape each process on its own
+`--metrics-port` (see `worker_common.supervisor`).
+"""
+import asyncio
+import os
+import time
+from bisect import bisect_left
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+OUTCOMES = ('ok', 'error', 'retry')
+
+_now = time.perf_counter
+
+
+class Histogram:
+  """Fixed-bucket histogram; `counts[i]` holds observations in bucket i only."""
+
+  __slots__ = ('bounds', 'counts', 'sum')
+
+  def __init__(self, bounds: tuple[float, ...]):
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+    self.sum = 0.0
+
+  def observe(self, value: float):
+    self.counts[bisect_left(self.bounds, value)] += 1
+    self.sum += value
+
+  def samples(self, name: str, labels: str):
+    """(line, ...) of the `_bucket`, `_sum` and `_count` series."""
+    total = 0
+    sep = ',' if labels else ''
+    for bound, n in zip(self.bounds, self.counts):
+      total += n
+      yield f'{name}_bucket{{{labels}{sep}le="{_number(bound)}"}} {total}'
+    total += self.counts[-1]
+    yield f'{name}_bucket{{{labels}{sep}le="+Inf"}} {total}'
+    yield f'{name}_sum{{{labels}}} {_number(self.sum)}'
+    yield f'{name}_count{{{labels}}} {total}'
+
+
+class SubjectStats:
+  """Counters of one consumed subject, updated by the runtime around each handler call."""
+
+  __slots__ = ('subject', 'latency', 'size', 'in_flight', 'outcomes')
+
+  def __init__(self, subject: str):
+    self.subject = subject
+    self.latency = Histogram(LATENCY_BUCKETS)
+    self.size = Histogram(SIZE_BUCKETS)
+    self.in_flight = 0
+    self.outcomes = dict.fromkeys(OUTCOMES, 0)
+
+  # Histogram.observe inlined: these run around every handler call.
+  def begin(self, msg) -> float:
+    self.in_flight += 1
+    size = len(msg.data or b'')
+    hist = self.size
+    hist.counts[bisect_left(hist.bounds, size)] += 1
+    hist.sum += size
+    return _now()
+
+  def end(self, started: float, outcome: str):
+    elapsed = _now() - started
+    hist = self.latency
+    hist.counts[bisect_left(hist.bounds, elapsed)] += 1
+    hist.sum += elapsed
+    self.in_flight -= 1
+    self.outcomes[outcome] += 1
+
+
+class Metrics:
+  """Registry of one worker's subject stats, published counts and loop lag."""
+
+  def __init__(self, service: str, loop_lag_interval: float = 0.5):
+    self.service = service
+    self.loop_lag_interval = loop_lag_interval
+    self.subjects: dict[str, SubjectStats] = {}
+    self.published: dict[str, list[int]] = {}  # subject -> [messages, bytes]
+    self.loop_lag = Histogram(LAG_BUCKETS)
+    self.last_loop_lag = 0.0
+    self._lag_task: asyncio.Task | None = None
+
+  def subject(self, subject: str) -> SubjectStats:
+    stats = self.subjects.get(subject)
+    if stats is None:
+      stats = self.subjects[subject] = SubjectStats(subject)
+    return stats
+
+  def record_publish(self, subject: str, size: int):
+    counts = self.published.get(subject)
+    if counts is None:
+      counts = self.published[subject] = [0, 0]
+    counts[0] += 1
+    counts[1] += size
+
+  # -- event loop lag --------------------------------------------------------
+
+  def start(self):
+    if self._lag_task is None and self.loop_lag_interval > 0:
+      self._lag_task = asyncio.create_task(self._watch_loop())
+
+  async def stop(self):
+    if self._lag_task is not None:
+      self._lag_task.cancel()
+      await asyncio.gather(self._lag_task, return_exceptions=True)
+      self._lag_task = None
+
+  async def _watch_loop(self):
+    loop = asyncio.get_running_loop()
+    interval = self.loop_lag_interval
+    while True:
+      due = loop.time() + interval
+      await asyncio.sleep(interval)
+      lag = max(0.0, loop.time() - due)
+      self.last_loop_lag = lag
+      self.loop_lag.observe(lag)
+
+  # -- exposition ------------------------------------------------------------
+
+  def render(self) -> str:
+    """All series in the Prometheus text exposition format."""
+    service = base_labels(self.service)
+    subjects = [(f'{service},subject="{_escape(s.subject)}"', s) for s in self.subjects.values()]
+    lines = []
+
+    def family(name: str, kind: str, help_: str):
+      lines.append(f'# HELP {name} {help_}')
+      lines.append(f'# TYPE {name} {kind}')
+
+    family('worker_handler_duration_seconds', 'histogram', 'Time to handle a message, ack included.')
+    for labels, stats in subjects:
+      lines.extend(stats.latency.samples('worker_handler_duration_seconds', labels))
+    family('worker_handler_messages_total', 'counter', 'Handled messages by outcome.')
+    for labels, stats in subjects:
+      for outcome, n in stats.outcomes.items():
+        lines.append(f'worker_handler_messages_total{{{labels},outcome="{outcome}"}} {n}')
+    family('worker_handler_in_flight', 'gauge', 'Messages being handled.')
+    for labels, stats in subjects:
+      lines.append(f'worker_handler_in_flight{{{labels}}} {stats.in_flight}')
+    family('worker_message_size_bytes', 'histogram', 'Payload size of received messages.')
+    for labels, stats in subjects:
+      lines.extend(stats.size.samples('worker_message_size_bytes', labels))
+
+    published = [(f'{service},subject="{_escape(subject)}"', counts) for subject, counts in self.published.items()]
+    family('worker_published_messages_total', 'counter', 'Messages published.')
+    for labels, (n, _) in published:
+      lines.append(f'worker_published_messages_total{{{labels}}} {n}')
+    family('worker_published_bytes_total', 'counter', 'Payload bytes published.')
+    for labels, (_, size) in published:
+      lines.append(f'worker_published_bytes_total{{{labels}}} {size}')
+
+    family('worker_event_loop_lag_seconds', 'histogram', 'Delay of a timer past its due time.')
+    lines.extend(self.loop_lag.samples('worker_event_loop_lag_seconds', service))
+    family('worker_event_loop_lag_last_seconds', 'gauge', 'Most recent event loop lag sample.')
+    lines.append(f'worker_event_loop_lag_last_seconds{{{service}}} {_number(self.last_loop_lag)}')
+    return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(app, runtime, path: str = '/metrics'):
+  """Add `GET path` serving `runtime.metrics` to a FastAPI app."""
+  from fastapi.responses import Response
+
+  async def metrics():
+    body = runtime.metrics.render() if runtime.metrics is not None else ''
+    if runtime.idempotency is not None:
+      body += runtime.idempotency.render(base_labels(runtime.service))
+    return Response(body, media_type=CONTENT_TYPE)
+
+  app.add_api_route(path, metrics, methods=['GET'], include_in_schema=False)
+
+
+def base_labels(service: str) -> str:
+  """The `service` label, plus `process` for a process under the supervisor."""
+  labels = f'service="{_escape(service)}"'
+  process = os.getenv('WORKER_PROCESS_INDEX')
+  return f'{labels},process="{_escape(process)}"' if process else labels
+
+
+def _escape(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+  return repr(float(value))
@@ -0,0 +1,284 @@
+"""On-demand profiling of a running worker.
+
+Nothing runs until a profile is requested; a worker only carries the routes
+and one idle core subscription:
+
+  serve_profiler(app, runtime)
+
+- `GET /admin/profile?seconds=10` samples every thread's stack from a
+  background thread (`interval_ms`, default 5) plus the await chain of every
+  asyncio task from the event loop, and returns collapsed stacks
+  (`frame;frame;frame count` lines) for flamegraph.pl, speedscope, inferno
+  and the like. Thread stacks are rooted at `thread:<name>`, task await chains
+  at `asyncio`.
+- `GET /admin/allocations?seconds=10&top=25` traces allocations with
+  tracemalloc for the window and returns the top allocation sites by size
+  still alive at its end.
+- `control.<service>.profile` takes the same commands over NATS
+  (`{"token": ..., "mode": "cpu" | "alloc", "seconds": ...}`) on every replica
+  and answers on the message's reply subject, or on
+  `control.<service>.profile.result`.
+
+Both are refused unless `WORKER_ADMIN_TOKEN` is set and the request carries
+it (`Authorization: Bearer <token>` or the command's `token`). A profile runs
+at most `WORKER_PROFILE_MAX_SECONDS` (60) and one at a time per process.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from .codec import Message, decode, encode
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.005
+MIN_INTERVAL = 0.001
+# Await chains change slower than thread stacks and walking every task costs
+# more, so tasks are sampled at most this often.
+MIN_TASK_INTERVAL = 0.02
+MAX_DEPTH = 128
+# Room left in max_payload for the envelope of a NATS reply.
+PAYLOAD_HEADROOM = 4096
+
+
+class ProfilerBusy(RuntimeError):
+  """Raised when a profile is requested while another one runs."""
+
+
+class ProfileCommand(Message):
+  token: str | None = None
+  mode: str = 'cpu'  # cpu: stack samples; alloc: tracemalloc top allocations
+  seconds: float = 10.0
+  interval_ms: float = DEFAULT_INTERVAL * 1000
+  tasks: bool = True
+  top: int = 25
+  frames: int = 1  # traceback depth kept per allocation
+
+
+def _frame_label(code, lineno: int, labels: dict) -> str:
+  key = (code, lineno)
+  label = labels.get(key)
+  if label is None:
+    name = getattr(code, 'co_qualname', code.co_name)
+    label = labels[key] = f"{name} ({os.path.basename(code.co_filename)}:{lineno})".replace(';', ':')
+  return label
+
+
+def _frame_stack(frame) -> tuple:
+  """(code, lineno) pairs of `frame` and its callers, outermost first."""
+  stack = []
+  while frame is not None and len(stack) < MAX_DEPTH:
+    stack.append((frame.f_code, frame.f_lineno))
+    frame = frame.f_back
+  stack.reverse()
+  return tuple(stack)
+
+
+def _await_chain(coro) -> tuple:
+  """(code, lineno) pairs of a task's coroutine and everything it awaits, outermost first."""
+  stack = []
+  while coro is not None and len(stack) < MAX_DEPTH:
+    frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None) or getattr(coro, 'ag_frame', None)
+    if frame is None:
+      break
+    stack.append((frame.f_code, frame.f_lineno))
+    coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None) or getattr(coro, 'ag_await', None)
+  return tuple(stack)
+
+
+class _ThreadSampler(threading.Thread):
+  def __init__(self, interval: float):
+    super().__init__(name='worker-profiler', daemon=True)
+    self.interval = interval
+    self.samples: Counter = Counter()  # (thread ident, stack) -> count
+    self.ticks = 0
+    self._halt = threading.Event()
+
+  def run(self):
+    own = threading.get_ident()
+    while not self._halt.wait(self.interval):
+      self.ticks += 1
+      for ident, frame in sys._current_frames().items():
+        if ident != own:
+          self.samples[ident, _frame_stack(frame)] += 1
+
+  def stop(self):
+    self._halt.set()
+    self.join()
+
+
+class Profiler:
+  """Stack sampler and tracemalloc snapshots for one process, idle until asked."""
+
+  def __init__(self, max_seconds: float = 60.0):
+    self.max_seconds = max_seconds
+    self._busy = False
+
+  @classmethod
+  def from_env(cls) -> 'Profiler':
+    return cls(max_seconds=float(os.getenv('WORKER_PROFILE_MAX_SECONDS', '60')))
+
+  def _window(self, seconds: float) -> float:
+    if self._busy:
+      raise ProfilerBusy('a profile is already running')
+    return min(max(float(seconds), 0.0), self.max_seconds)
+
+  async def sample(self, seconds: float, interval: float = DEFAULT_INTERVAL, tasks: bool = True) -> dict:
+    """Sample stacks for `seconds`; returns collapsed stacks and sample counts."""
+    seconds = self._window(seconds)
+    interval = max(interval, MIN_INTERVAL)
+    self._busy = True
+    sampler = _ThreadSampler(interval)
+    task_samples: Counter = Counter()
+    task_ticks = 0
+    try:
+      sampler.start()
+      deadline = time.monotonic() + seconds
+      me = asyncio.current_task()
+      while True:
+        await asyncio.sleep(min(max(interval, MIN_TASK_INTERVAL), max(0.0, deadline - time.monotonic())))
+        if tasks:
+          task_ticks += 1
+          for task in asyncio.all_tasks():
+            if task is not me:
+              task_samples[_await_chain(task.get_coro())] += 1
+        if time.monotonic() >= deadline:
+          break
+    finally:
+      sampler.stop()
+      self._busy = False
+
+    names = {t.ident: t.name for t in threading.enumerate()}
+    labels: dict = {}
+    lines: Counter = Counter()
+    for (ident, stack), n in sampler.samples.items():
+      root = f"thread:{names.get(ident, ident)}".replace(';', ':')
+      lines[';'.join([root] + [_frame_label(c, l, labels) for c, l in stack])] += n
+    for stack, n in task_samples.items():
+      if stack:
+        lines[';'.join(['asyncio'] + [_frame_label(c, l, labels) for c, l in stack])] += n
+    return {
+      'seconds': seconds,
+      'interval_ms': round(interval * 1000, 3),
+      'thread_samples': sampler.ticks,
+      'task_samples': task_ticks,
+      'stacks': lines,
+    }
+
+  async def allocations(self, seconds: float, top: int = 25, frames: int = 1) -> dict:
+    """Top allocation sites, by size still allocated, of the next `seconds`."""
+    seconds = self._window(seconds)
+    self._busy = True
+    tracing = tracemalloc.is_tracing()
+    try:
+      if not tracing:
+        tracemalloc.start(max(1, frames))
+      await asyncio.sleep(seconds)
+      snapshot = tracemalloc.take_snapshot()
+      current, peak = tracemalloc.get_traced_memory()
+    finally:
+      if not tracing:
+        tracemalloc.stop()
+      self._busy = False
+    snapshot = snapshot.filter_traces([
+      tracemalloc.Filter(False, tracemalloc.__file__),
+      tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+    stats = snapshot.statistics('traceback' if frames > 1 else 'lineno')
+    return {
+      'seconds': seconds,
+      'traced_bytes': current,
+      'peak_bytes': peak,
+      'top': [
+        {
+          'size_bytes': stat.size,
+          'count': stat.count,
+          'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        }
+        for stat in stats[:max(1, top)]
+      ],
+    }
+
+
+def collapsed(stacks: Counter, limit: int | None = None) -> tuple[str, bool]:
+  """Collapsed-stack text, most sampled first; cut to `limit` bytes if given."""
+  out = []
+  size = 0
+  for stack, n in stacks.most_common():
+    line = f"{stack} {n}\n"
+    size += len(line.encode()) + 1  # the newline is escaped in JSON
+    if limit is not None and size > limit:
+      return ''.join(out), True
+    out.append(line)
+  return ''.join(out), False
+
+
+def authorized(token: str | None) -> bool:
+  expected = os.getenv('WORKER_ADMIN_TOKEN')
+  return bool(expected) and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def serve_profiler(app, runtime, profiler: Profiler | None = None):
+  """Add the /admin profiling routes and the control.<service>.profile handler."""
+  from fastapi import HTTPException, Request
+  from fastapi.responses import PlainTextResponse
+
+  profiler = profiler or Profiler.from_env()
+
+  def check(request: Request):
+    header = request.headers.get('authorization', '')
+    if not authorized(header[7:] if header.lower().startswith('bearer ') else None):
+      raise HTTPException(status_code=403, detail='admin token required')
+
+  async def profile(request: Request, seconds: float = 10.0, interval_ms: float = DEFAULT_INTERVAL * 1000, tasks: bool = True):
+    check(request)
+    try:
+      result = await profiler.sample(seconds, interval_ms / 1000, tasks)
+    except ProfilerBusy as e:
+      raise HTTPException(status_code=409, detail=str(e))
+    text, _ = collapsed(result['stacks'])
+    return PlainTextResponse(text)
+
+  async def allocations(request: Request, seconds: float = 10.0, top: int = 25, frames: int = 1):
+    check(request)
+    try:
+      return await profiler.allocations(seconds, top, frames)
+    except ProfilerBusy as e:
+      raise HTTPException(status_code=409, detail=str(e))
+
+  app.add_api_route('/admin/profile', profile, methods=['GET'], include_in_schema=False)
+  app.add_api_route('/admin/allocations', allocations, methods=['GET'], include_in_schema=False)
+
+  subject = f"control.{runtime.service}.profile"
+
+  # Every replica answers, so the command fans out over core NATS.
+  @runtime.subscribe(subject, durable=False)
+  async def handle_profile(msg):
+    reply = getattr(msg, 'reply', '') or f"{subject}.result"
+    try:
+      cmd = decode(msg.data, ProfileCommand)
+      if not authorized(cmd.token):
+        raise PermissionError('admin token required')
+      if cmd.mode == 'alloc':
+        body = await profiler.allocations(cmd.seconds, cmd.top, cmd.frames)
+      elif cmd.mode == 'cpu':
+        result = await profiler.sample(cmd.seconds, cmd.interval_ms / 1000, cmd.tasks)
+        budget = runtime.max_payload - PAYLOAD_HEADROOM
+        body = {k: v for k, v in result.items() if k != 'stacks'}
+        body['collapsed'], body['truncated'] = collapsed(result['stacks'], budget)
+      else:
+        raise ValueError(f"unknown profile mode: {cmd.mode}")
+      body.update(service=runtime.service, mode=cmd.mode, pid=os.getpid())
+    except Exception as e:
+      logger.warning("%s: profile command failed: %s", runtime.service, e)
+      body = {'service': runtime.service, 'pid': os.getpid(), 'error': str(e)}
+    await runtime.publish(reply, encode(body))
+
+  return profiler
@@ -0,0 +1,260 @@
+"""Per-platform, per-account publish pacing for the connectors.
+
+Every platform account gets a token bucket (`<PLATFORM>_RATE_LIMIT` requests
+per second, `<PLATFORM>_RATE_BURST` burst). Buckets live in process memory, or
+in Redis when `RATE_LIMIT_REDIS_URL` is set so every connector replica shares
+one quota (needs the `redis` extra).
+
+`RateLimiter.run()` paces a call through the account's bucket and turns
+failures into scheduled retries instead of in-handler sleeps:
+
+  resp = await limiter.run(key, lambda: publish(req), attempt=runtime.attempt(msg))
+
+- short waits for a token are slept through; longer ones raise `RetryLater`
+- a 429/503 blocks the account for its `Retry-After` / rate-limit reset and
+  raises `RetryLater` with that delay plus jitter
+- other retryable statuses and transport errors (connect/read failures,
+  timeouts) raise `RetryLater` with jittered exponential backoff
+- everything else is re-raised: non-retryable HTTP errors (4xx other than
+  408/409/425/429), and errors raised after the request went through, such
+  as an unexpected response body, which must not post the content again
+- on the last attempt the original error is re-raised so the handler can
+  publish the failure
+
+The runtime turns `RetryLater` into a delayed redelivery (JetStream nak with
+delay), so a message waiting for its retry does not hold a handler slot.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable
+
+from .runtime import RetryLater
+
+try:
+  import redis.asyncio as aioredis
+except ImportError:  # optional: only needed for a shared quota
+  aioredis = None
+
+try:
+  import httpx
+except ImportError:  # optional: the `http` extra
+  httpx = None
+
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+RATE_LIMITED_STATUS = {429, 503}
+# Failures where the request may not have reached the platform. TimeoutException
+# is a TransportError too.
+TRANSIENT_ERRORS = (httpx.TransportError,) if httpx is not None else ()
+
+
+def account_key(credentials: dict | None, *ids: str | None) -> str:
+  """Bucket key for the account behind a request.
+
+  The first explicit account/page/profile id wins; otherwise the access token
+  is hashed so equal credentials share a bucket without keeping the token.
+  """
+  for value in ids:
+    if value:
+      return str(value)
+  token = (credentials or {}).get('access_token')
+  if token:
+    return hashlib.sha256(str(token).encode()).hexdigest()[:16]
+  return 'default'
+
+
+def retry_after(headers, now: float | None = None) -> float | None:
+  """Seconds to wait according to `Retry-After` or rate-limit reset headers."""
+  if not headers:
+    return None
+  now = time.time() if now is None else now
+  value = headers.get('retry-after')
+  if value:
+    try:
+      return max(0.0, float(value))
+    except ValueError:
+      try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+      except (TypeError, ValueError):
+        pass
+  for remaining, reset in (
+    ('x-rate-limit-remaining', 'x-rate-limit-reset'),   # Twitter/X: epoch seconds
+    ('x-ratelimit-remaining', 'x-ratelimit-reset'),     # Pinterest, TikTok
+    ('ratelimit-remaining', 'ratelimit-reset'),         # IETF draft: delta seconds
+  ):
+    if headers.get(remaining) == '0' and headers.get(reset):
+      try:
+        value = float(headers[reset])
+      except ValueError:
+        continue
+      # Large values are epoch timestamps, small ones are deltas.
+      return max(0.0, value - now if value > 1e9 else value)
+  return None
+
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 60.0) -> float:
+  """Exponential backoff with equal jitter: half fixed, half random."""
+  delay = min(cap, base * 2 ** max(0, attempt - 1))
+  return delay / 2 + random.uniform(0, delay / 2)
+
+
+def jittered(delay: float) -> float:
+  """A server-given delay plus a little jitter so retries do not arrive together."""
+  return delay + random.uniform(0, 0.1 * delay + 0.25)
+
+
+@dataclass
+class Limit:
+  rate: float = 5.0  # tokens per second; 0 disables limiting
+  burst: float = 10.0
+
+
+class MemoryBucketStore:
+  """Token buckets in process memory."""
+
+  def __init__(self):
+    self._buckets: dict[str, list[float]] = {}  # key -> [tokens, updated, blocked_until]
+
+  async def take(self, key: str, limit: Limit) -> float:
+    """Take a token if one is available; otherwise return the seconds until one is."""
+    now = time.monotonic()
+    bucket = self._buckets.setdefault(key, [limit.burst, now, 0.0])
+    if bucket[2] > now:
+      return bucket[2] - now
+    bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+    bucket[1] = now
+    if bucket[0] >= 1:
+      bucket[0] -= 1
+      return 0.0
+    return (1 - bucket[0]) / limit.rate
+
+  async def block(self, key: str, seconds: float):
+    now = time.monotonic()
+    bucket = self._buckets.setdefault(key, [0.0, now, 0.0])
+    bucket[2] = max(bucket[2], now + seconds)
+
+  async def close(self):
+    pass
+
+
+# KEYS[1] bucket hash; ARGV rate, burst. Uses the server clock so replicas agree.
+_TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+local blocked = tonumber(state[3]) or 0
+if blocked > now then return tostring(blocked - now) end
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 3600)
+return tostring(wait)
+"""
+
+_BLOCK_SCRIPT = """
+local t = redis.call('TIME')
+local until_ = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked')) or 0
+if until_ > blocked then redis.call('HSET', KEYS[1], 'blocked', until_) end
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[1])) + 3600)
+return 1
+"""
+
+
+class RedisBucketStore:
+  """Token buckets shared by every replica through Redis."""
+
+  def __init__(self, url: str, prefix: str = 'ratelimit:'):
+    if aioredis is None:
+      raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+    self.prefix = prefix
+    self._redis = aioredis.from_url(url)
+    self._take = self._redis.register_script(_TAKE_SCRIPT)
+    self._block = self._redis.register_script(_BLOCK_SCRIPT)
+
+  async def take(self, key: str, limit: Limit) -> float:
+    return float(await self._take(keys=[self.prefix + key], args=[limit.rate, limit.burst]))
+
+  async def block(self, key: str, seconds: float):
+    await self._block(keys=[self.prefix + key], args=[seconds])
+
+  async def close(self):
+    await self._redis.aclose()
+
+
+class RateLimiter:
+  """Paces one platform's calls per account and schedules their retries."""
+
+  def __init__(self, platform: str, limit: Limit | None = None, store=None, max_wait: float = 1.0):
+    self.platform = platform
+    self.limit = limit or Limit()
+    self.store = store or MemoryBucketStore()
+    self.max_wait = max_wait
+
+  @classmethod
+  def from_env(cls, platform: str) -> 'RateLimiter':
+    prefix = platform.upper()
+    url = os.getenv('RATE_LIMIT_REDIS_URL')
+    return cls(
+      platform,
+      Limit(
+        rate=float(os.getenv(f"{prefix}_RATE_LIMIT") or os.getenv('RATE_LIMIT_DEFAULT', '5')),
+        burst=float(os.getenv(f"{prefix}_RATE_BURST") or os.getenv('RATE_BURST_DEFAULT', '10')),
+      ),
+      store=RedisBucketStore(url) if url else None,
+      max_wait=float(os.getenv('RATE_LIMIT_MAX_WAIT', '1.0')),
+    )
+
+  def _key(self, account: str) -> str:
+    return f"{self.platform}:{account}"
+
+  async def acquire(self, account: str, final: bool = False):
+    """Wait for a token; raise `RetryLater` instead when the wait is long (unless `final`)."""
+    if self.limit.rate <= 0:
+      return
+    key = self._key(account)
+    while True:
+      wait = await self.store.take(key, self.limit)
+      if wait <= 0:
+        return
+      if wait > self.max_wait and not final:
+        raise RetryLater(jittered(wait), f"{key} rate limited")
+      await asyncio.sleep(wait)
+
+  async def block(self, account: str, seconds: float):
+    await self.store.block(self._key(account), seconds)
+
+  async def run(self, account: str, call: Callable[[], Awaitable[Any]], attempt: int = 1, attempts: int = 5) -> Any:
+    """Pace `call()` through the account's bucket and classify its failure."""
+    final = attempt >= attempts
+    await self.acquire(account, final=final)
+    try:
+      return await call()
+    except Exception as e:
+      response = getattr(e, 'response', None)
+      status = getattr(response, 'status_code', None)
+      if status not in RETRYABLE_STATUS and not isinstance(e, TRANSIENT_ERRORS):
+        raise
+      delay = retry_after(response.headers) if response is not None else None
+      if delay is not None and status in RATE_LIMITED_STATUS:
+        await self.block(account, delay)
+      if final:
+        raise
+      delay = jittered(delay) if delay is not None else backoff(attempt)
+      logger.info("%s: attempt %d failed (%s); retrying in %.2fs", self.platform, attempt, e, delay)
+      raise RetryLater(delay, str(e)) from e
+
+  async def close(self):
+    await self.store.close()
@@ -0,0 +1,324 @@
+"""Shared NATS runtime for the Python workers.
+
+Workers register handlers per subject and the runtime owns the connection,
+the consumers and the concurrency budget:
+
+  runtime = WorkerRuntime('policy-check-worker')
+
+  @runtime.subscribe('policy.check')
+  async def handle_request(msg):
+    ...
+    await runtime.publish('policy.approved', data)
+
+Durable subjects are consumed through JetStream pull consumers, fetched in
+batches sized to the free handler slots, and acked only after the handler
+returns. A handler that raises is nak'd so JetStream redelivers it (up to
+`max_deliver`). Non-durable subscriptions (`durable=False`) use core NATS and
+are meant for fan-out/observer subjects.
+
+Replicas of a worker split its durable subjects: they pull from the same
+named consumer, and with `WORKER_JETSTREAM=0` they subscribe in one queue
+group (`WORKER_QUEUE_GROUP`, the service name by default). `durable=False`
+subjects stay fan-out, so every replica sees them.
+
+A handler that wants to try again later raises `RetryLater(delay)`: the
+message is nak'd with that delay (or, on core NATS, re-run from a timer) so
+the wait does not hold a handler slot. `runtime.attempt(msg)` is the 1-based
+delivery attempt of a message.
+
+Unless `WORKER_METRICS=0`, `runtime.metrics` records per-subject handler
+latency, in-flight messages, outcomes, payload sizes and published messages,
+plus event-loop lag (see `worker_common.metrics`).
+
+Handlers registered with `idempotent=True` run once per `request_id` and
+subject; duplicates replay the messages the first run published (see
+`worker_common.idempotency`).
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from .bus import ConsumerSettings, NatsBus
+from .idempotency import Idempotency, capture
+from .metrics import Metrics, SubjectStats
+
+
+logger = logging.getLogger(__name__)
+
+HandlerFn = Callable[..., Awaitable[None]]
+
+
+class RetryLater(Exception):
+  """Raised by a handler to have its message redelivered after `delay` seconds."""
+
+  def __init__(self, delay: float, reason: str = ''):
+    super().__init__(reason or f"retry in {delay:.2f}s")
+    self.delay = max(0.0, delay)
+
+
+def _env_flag(name: str, default: bool) -> bool:
+  value = os.getenv(name)
+  if value is None:
+    return default
+  return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
+@dataclass
+class RuntimeConfig:
+  nats_url: str = 'nats://localhost:4222'
+  stream: str = 'WORKERS'
+  stream_max_age: float | None = 24 * 3600
+  jetstream: bool = True
+  max_concurrency: int = 16
+  fetch_batch: int = 16
+  fetch_timeout: float = 1.0
+  ack_wait: float = 30.0
+  max_deliver: int = 5
+  nak_delay: float = 1.0
+  drain_timeout: float = 30.0
+  queue_group: str | None = None
+  metrics: bool = True
+  idempotency: bool = True
+  loop_lag_interval: float = 0.5
+
+  @classmethod
+  def from_env(cls, **overrides) -> 'RuntimeConfig':
+    """Build a config from `WORKER_*`/`NATS_URL` env vars; explicit overrides are defaults."""
+    config = cls(**overrides)
+    env = {
+      'nats_url': ('NATS_URL', str),
+      'stream': ('WORKER_STREAM', str),
+      'stream_max_age': ('WORKER_STREAM_MAX_AGE', float),
+      'max_concurrency': ('WORKER_MAX_CONCURRENCY', int),
+      'fetch_batch': ('WORKER_FETCH_BATCH', int),
+      'fetch_timeout': ('WORKER_FETCH_TIMEOUT', float),
+      'ack_wait': ('WORKER_ACK_WAIT', float),
+      'max_deliver': ('WORKER_MAX_DELIVER', int),
+      'nak_delay': ('WORKER_NAK_DELAY', float),
+      'drain_timeout': ('WORKER_DRAIN_TIMEOUT', float),
+      'queue_group': ('WORKER_QUEUE_GROUP', str),
+      'loop_lag_interval': ('WORKER_LOOP_LAG_INTERVAL', float),
+    }
+    for attr, (var, cast) in env.items():
+      if os.getenv(var):
+        setattr(config, attr, cast(os.environ[var]))
+    config.jetstream = _env_flag('WORKER_JETSTREAM', config.jetstream)
+    config.metrics = _env_flag('WORKER_METRICS', config.metrics)
+    config.idempotency = _env_flag('WORKER_IDEMPOTENCY', config.idempotency)
+    return config
+
+
+@dataclass
+class Handler:
+  subject: str
+  fn: HandlerFn
+  durable: bool = True
+  idempotent: bool = False
+  stats: SubjectStats | None = None
+
+
+@dataclass
+class _Subscription:
+  handler: Handler
+  sub: object = None
+  loop_task: asyncio.Task | None = None
+
+
+class WorkerRuntime:
+  """Owns the bus connection, subscriptions and bounded handler execution."""
+
+  def __init__(self, service: str, config: RuntimeConfig | None = None, **overrides):
+    self.service = service
+    self.config = config or RuntimeConfig.from_env(**overrides)
+    self.bus = None
+    self._handlers: list[Handler] = []
+    self._subs: list[_Subscription] = []
+    self._slots: asyncio.Semaphore | None = None
+    self._tasks: set[asyncio.Task] = set()
+    self._timers: set[asyncio.TimerHandle] = set()
+    self._stopping = False
+    self.metrics = Metrics(service, self.config.loop_lag_interval) if self.config.metrics else None
+    self.idempotency: Idempotency | None = None
+
+  def subscribe(self, subject: str, *, durable: bool = True, idempotent: bool = False) -> Callable[[HandlerFn], HandlerFn]:
+    """Register `fn(msg)` as the handler for `subject`."""
+    def register(fn: HandlerFn) -> HandlerFn:
+      self._handlers.append(Handler(subject=subject, fn=fn, durable=durable, idempotent=idempotent))
+      return fn
+    return register
+
+  @property
+  def max_payload(self) -> int:
+    return self.bus.max_payload
+
+  @property
+  def in_flight(self) -> int:
+    return len(self._tasks)
+
+  def attempt(self, msg) -> int:
+    """1-based delivery attempt of `msg`."""
+    retried = getattr(msg, '_worker_attempt', None)
+    if retried:
+      return retried
+    try:
+      return max(1, int(msg.metadata.num_delivered))
+    except Exception:
+      return 1
+
+  async def publish(self, subject: str, data: bytes, headers: dict | None = None):
+    await self.bus.publish(subject, data, headers=headers)
+    capture(subject, data, headers)
+    if self.metrics is not None:
+      self.metrics.record_publish(subject, len(data))
+
+  async def start(self, bus=None):
+    """Connect (unless a bus is injected) and start consuming every registered subject."""
+    self._stopping = False
+    self._slots = asyncio.Semaphore(self.config.max_concurrency)
+    if bus is None:
+      bus = NatsBus(self.config.nats_url, self.config.stream, self.config.stream_max_age)
+      await bus.connect()
+    self.bus = bus
+    if self.idempotency is None and self.config.idempotency and any(h.idempotent for h in self._handlers):
+      # A claim older than the redelivery window belongs to a process that died.
+      self.idempotency = Idempotency.from_env(stale_after=2 * self.config.ack_wait)
+
+    durable = [h.subject for h in self._handlers if h.durable and self.config.jetstream]
+    if durable:
+      await self.bus.ensure_stream(durable)
+
+    settings = ConsumerSettings(ack_wait=self.config.ack_wait, max_deliver=self.config.max_deliver)
+    for handler in self._handlers:
+      if self.metrics is not None:
+        handler.stats = self.metrics.subject(handler.subject)
+      entry = _Subscription(handler=handler)
+      if handler.durable and self.config.jetstream:
+        entry.sub = await self.bus.pull_subscribe(handler.subject, self._durable_name(handler.subject), settings)
+        entry.loop_task = asyncio.create_task(self._pull_loop(entry))
+      else:
+        queue = (self.config.queue_group or self.service) if handler.durable else ''
+        entry.sub = await self.bus.subscribe(handler.subject, cb=self._core_callback(handler), queue=queue)
+      self._subs.append(entry)
+    if self.metrics is not None:
+      self.metrics.start()
+    logger.info("%s consuming %s", self.service, ', '.join(h.subject for h in self._handlers))
+
+  async def stop(self):
+    """Stop fetching, let in-flight handlers finish, then drain the connection."""
+    self._stopping = True
+    loops = [s.loop_task for s in self._subs if s.loop_task]
+    for task in loops:
+      task.cancel()
+    await asyncio.gather(*loops, return_exceptions=True)
+    for timer in self._timers:
+      timer.cancel()
+    if self._timers:
+      logger.warning("%s: dropping %d scheduled core retries", self.service, len(self._timers))
+    self._timers.clear()
+    for entry in self._subs:
+      await self._safely(entry.sub.unsubscribe(), 'unsubscribe')
+    self._subs.clear()
+
+    if self._tasks:
+      _, pending = await asyncio.wait(set(self._tasks), timeout=self.config.drain_timeout)
+      if pending:
+        logger.warning("%s: %d handlers still running after drain timeout", self.service, len(pending))
+    if self.metrics is not None:
+      await self.metrics.stop()
+    if self.bus is not None:
+      await self.bus.close()
+    if self.idempotency is not None:
+      self.idempotency.close()
+      self.idempotency = None
+
+  def _durable_name(self, subject: str) -> str:
+    return f"{self.service}_{subject}".replace('.', '_').replace('*', 'any').replace('>', 'all')
+
+  async def _pull_loop(self, entry: _Subscription):
+    while not self._stopping:
+      # Wait for a free slot before asking for more work so fetched messages
+      # never sit unprocessed past ack_wait.
+      await self._slots.acquire()
+      self._slots.release()
+      batch = max(1, min(self.config.fetch_batch, self.config.max_concurrency - len(self._tasks)))
+      try:
+        msgs = await entry.sub.fetch(batch, timeout=self.config.fetch_timeout)
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        logger.exception("%s: fetch failed on %s", self.service, entry.handler.subject)
+        await asyncio.sleep(self.config.fetch_timeout)
+        continue
+      for msg in msgs:
+        await self._slots.acquire()
+        self._spawn(entry.handler, msg, ack=True)
+
+  def _core_callback(self, handler: Handler) -> HandlerFn:
+    async def cb(msg):
+      if self._stopping:
+        return
+      await self._slots.acquire()
+      self._spawn(handler, msg, ack=False)
+    return cb
+
+  def _spawn(self, handler: Handler, msg, ack: bool):
+    task = asyncio.create_task(self._execute(handler, msg, ack))
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  async def _execute(self, handler: Handler, msg, ack: bool):
+    stats = handler.stats
+    if stats is not None:
+      started = stats.begin(msg)
+    outcome = 'error'
+    try:
+      if handler.idempotent and self.idempotency is not None:
+        await self.idempotency.run(msg, handler.fn, self.publish)
+      else:
+        await handler.fn(msg)
+    except RetryLater as e:
+      outcome = 'retry'
+      logger.info("%s: %s retry in %.2fs (%s)", self.service, handler.subject, e.delay, e)
+      if ack:
+        await self._safely(msg.nak(delay=e.delay), 'nak')
+      else:
+        self._schedule_retry(handler, msg, e.delay)
+    except Exception:
+      logger.exception("%s: handler for %s failed", self.service, handler.subject)
+      if ack:
+        await self._safely(msg.nak(delay=self.config.nak_delay), 'nak')
+    else:
+      outcome = 'ok'
+      if ack:
+        await self._safely(msg.ack(), 'ack')
+    finally:
+      self._slots.release()
+      if stats is not None:
+        stats.end(started, outcome)
+
+  def _schedule_retry(self, handler: Handler, msg, delay: float):
+    attempt = self.attempt(msg) + 1
+    if attempt > self.config.max_deliver:
+      logger.warning("%s: giving up on %s after %d attempts", self.service, handler.subject, attempt - 1)
+      return
+    try:
+      msg._worker_attempt = attempt
+    except AttributeError:
+      logger.warning("%s: cannot retry %s message", self.service, handler.subject)
+      return
+
+    def fire():
+      self._timers.discard(timer)
+      if not self._stopping:
+        asyncio.ensure_future(self._core_callback(handler)(msg))
+
+    timer = asyncio.get_running_loop().call_later(delay, fire)
+    self._timers.add(timer)
+
+  async def _safely(self, op: Awaitable, what: str):
+    try:
+      await op
+    except Exception:
+      logger.exception("%s: %s failed", self.service, what)
@@ -0,0 +1,297 @@
+"""Run several processes of one worker on a host.
+
+  python -m worker_common.supervisor app.main:app --processes 4 --port 8101
+
+The supervisor binds the HTTP port once and starts `--processes` children
+(one per core by default). Each imports the app and serves it with uvicorn on
+the shared socket, so every child has its own event loop, NATS connection and
+`WorkerRuntime`; replicas split the worker's durable subjects (see
+`worker_common.runtime`) and all of them see its `durable=False` ones.
+
+- A child that exits is started again, after a growing delay if it keeps
+  dying before it comes up.
+- SIGHUP restarts the children one at a time. A replacement is started first
+  and has `--ready-timeout` to become ready (its startup hooks, and so
+  `runtime.start()`, have returned); only then is the old child sent SIGTERM
+  and given `--stop-timeout` to drain. A replacement that does not come up is
+  stopped and the restart abandoned, with the old children still serving.
+- SIGTERM and SIGINT stop every child that way and exit.
+
+Requests on the shared port land on whichever child accepts them. With
+`--metrics-port N`, child `i` also serves the app on its own port `N + i`, so
+`/metrics` (labelled `process="i"`), `/admin/*` and stats routes can be
+reached per process; Prometheus scrapes every one of those ports.
+
+Children see `WORKER_PROCESSES` and `WORKER_PROCESS_INDEX`. A worker holding
+single-writer state (schedule-worker's dispatcher log) runs with
+`--processes 1 --stop-first`, which stops the old child before starting its
+replacement.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+
+
+logger = logging.getLogger('worker_common.supervisor')
+
+_spawn = multiprocessing.get_context('spawn')
+
+# A child that dies sooner than this after starting counts as a failed start.
+MIN_UPTIME = 10.0
+MAX_BACKOFF = 30.0
+
+
+def _listen(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+  sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  if reuse_port:
+    # A replacement binds its process port while the child it replaces still drains.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+  sock.bind((host, port))
+  sock.listen(2048)
+  return sock
+
+
+def _serve_child(
+  target: str,
+  app_dir: str,
+  sock: socket.socket,
+  index: int,
+  processes: int,
+  ready: Connection,
+  log_level: str,
+  own_port: int | None = None,
+):
+  """Child process: import `target` and serve it on the inherited socket until SIGTERM."""
+  import asyncio
+
+  import uvicorn
+
+  # A terminal hangup reaches the whole process group; only the supervisor acts on it.
+  signal.signal(signal.SIGHUP, signal.SIG_IGN)
+  os.environ['WORKER_PROCESSES'] = str(processes)
+  os.environ['WORKER_PROCESS_INDEX'] = str(index)
+  sys.path.insert(0, app_dir)
+  sockets = [sock]
+  if own_port is not None:
+    sockets.append(_listen(sock.getsockname()[0], own_port, reuse_port=True))
+  server = uvicorn.Server(uvicorn.Config(target, log_level=log_level, access_log=False))
+
+  async def serve():
+    task = asyncio.create_task(server.serve(sockets=sockets))
+    while not server.started and not task.done():
+      await asyncio.sleep(0.05)
+    if server.started:
+      ready.send_bytes(b'ready')
+    await task
+
+  asyncio.run(serve())
+  if not server.started:
+    sys.exit(3)
+
+
+@dataclass
+class _Child:
+  index: int
+  process: multiprocessing.Process
+  conn: Connection  # read end of the pipe the child reports readiness on
+  ready: bool = False
+  started_at: float = field(default_factory=time.monotonic)
+
+  def poll_ready(self, timeout: float = 0.0) -> bool:
+    if not self.ready and self.conn.poll(timeout):
+      try:
+        self.ready = self.conn.recv_bytes() == b'ready'
+      except EOFError:  # the child exited first
+        pass
+    return self.ready
+
+  def close(self):
+    self.process.close()
+    self.conn.close()
+
+
+class Supervisor:
+  def __init__(
+    self,
+    target: str,
+    processes: int,
+    host: str = '0.0.0.0',
+    port: int = 8000,
+    app_dir: str = '.',
+    ready_timeout: float = 60.0,
+    stop_timeout: float = 45.0,
+    stop_first: bool = False,
+    log_level: str = 'info',
+    metrics_port: int | None = None,
+  ):
+    self.target = target
+    self.processes = max(1, processes)
+    self.host = host
+    self.port = port
+    self.app_dir = os.path.abspath(app_dir)
+    self.ready_timeout = ready_timeout
+    self.stop_timeout = stop_timeout
+    self.stop_first = stop_first
+    self.log_level = log_level
+    self.metrics_port = metrics_port
+    self.children: list[_Child | None] = []
+    self._sock: socket.socket | None = None
+    self._failures = [0] * self.processes
+    self._restart_at = [0.0] * self.processes
+    self._reload = False
+    self._exit = False
+
+  def bind(self) -> socket.socket:
+    sock = _listen(self.host, self.port)
+    sock.set_inheritable(True)
+    self.port = sock.getsockname()[1]
+    return sock
+
+  def _start(self, index: int) -> _Child:
+    reader, writer = _spawn.Pipe(duplex=False)
+    process = _spawn.Process(
+      target=_serve_child,
+      args=(
+        self.target, self.app_dir, self._sock, index, self.processes, writer, self.log_level,
+        None if self.metrics_port is None else self.metrics_port + index,
+      ),
+      name=f"worker-{index}",
+    )
+    process.start()
+    writer.close()
+    logger.info("started %s process %d (pid %d)", self.target, index, process.pid)
+    return _Child(index, process, reader)
+
+  def _wait_ready(self, child: _Child) -> bool:
+    deadline = time.monotonic() + self.ready_timeout
+    while time.monotonic() < deadline and not self._exit:
+      if child.poll_ready(0.1):
+        return True
+      if not child.process.is_alive():
+        return False
+    return child.poll_ready()
+
+  def _stop(self, child: _Child):
+    process = child.process
+    if process.is_alive():
+      os.kill(process.pid, signal.SIGTERM)
+      process.join(self.stop_timeout)
+    if process.is_alive():
+      logger.warning("process %d (pid %d) still running after %.0fs, killing it", child.index, process.pid, self.stop_timeout)
+      process.kill()
+      process.join()
+    child.close()
+
+  def _replace(self, index: int) -> bool:
+    """Swap child `index` for a new process; False if the new one did not come up."""
+    old = self.children[index]
+    if self.stop_first and old is not None:
+      self._stop(old)
+      self.children[index] = old = None
+    new = self._start(index)
+    if not self._wait_ready(new):
+      logger.error("process %d (pid %d) did not become ready within %.0fs", index, new.process.pid, self.ready_timeout)
+      self._stop(new)
+      return False
+    self.children[index] = new
+    if old is not None:
+      self._stop(old)
+    return True
+
+  def reload(self):
+    """Rolling restart: replace every child in turn, stopping at the first failure."""
+    logger.info("rolling restart of %d processes", self.processes)
+    for index in range(self.processes):
+      if self._exit:
+        return
+      if not self._replace(index):
+        logger.error("rolling restart abandoned at process %d", index)
+        return
+    logger.info("rolling restart complete")
+
+  def _reap(self):
+    """Start a replacement for every child that exited, with backoff for repeated failures."""
+    now = time.monotonic()
+    for index, child in enumerate(self.children):
+      if child is not None and not child.process.is_alive():
+        code = child.process.exitcode
+        failed = not child.poll_ready() or now - child.started_at < MIN_UPTIME
+        self._failures[index] = self._failures[index] + 1 if failed else 0
+        delay = min(MAX_BACKOFF, 0.5 * 2 ** self._failures[index]) if failed else 0.0
+        logger.warning("process %d (pid %d) exited with %s; restarting in %.1fs", index, child.process.pid, code, delay)
+        child.close()
+        self.children[index] = None
+        self._restart_at[index] = now + delay
+      if self.children[index] is None and now >= self._restart_at[index]:
+        self.children[index] = self._start(index)
+
+  def _on_signal(self, signum, frame):
+    if signum == signal.SIGHUP:
+      self._reload = True
+    else:
+      self._exit = True
+
+  def run(self) -> int:
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+      signal.signal(sig, self._on_signal)
+    self._sock = self.bind()
+    logger.info("serving %s on %s:%d with %d processes", self.target, self.host, self.port, self.processes)
+    self.children = [self._start(index) for index in range(self.processes)]
+    try:
+      up = sum(self._wait_ready(child) for child in self.children)
+      logger.info("%d of %d processes ready", up, self.processes)
+      while not self._exit:
+        if self._reload:
+          self._reload = False
+          self.reload()
+          continue
+        wait([c.process.sentinel for c in self.children if c is not None], timeout=0.5)
+        if not self._exit:
+          self._reap()
+    finally:
+      logger.info("stopping %d processes", sum(c is not None for c in self.children))
+      for child in self.children:
+        if child is not None:
+          self._stop(child)
+      self._sock.close()
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('target', help='ASGI app as module:attribute, e.g. app.main:app')
+  parser.add_argument('--processes', type=int, default=int(os.getenv('WORKER_PROCESSES', '0')) or os.cpu_count() or 1)
+  parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+  parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8000')))
+  parser.add_argument('--app-dir', default='.', help='directory put on sys.path to import the app (default: .)')
+  parser.add_argument('--ready-timeout', type=float, default=60.0)
+  parser.add_argument('--stop-timeout', type=float, default=float(os.getenv('WORKER_DRAIN_TIMEOUT', '30')) + 15)
+  parser.add_argument('--stop-first', action='store_true', help='stop the old process before starting its replacement')
+  parser.add_argument('--metrics-port', type=int, help='also serve process i on port METRICS_PORT + i')
+  parser.add_argument('--log-level', default='info')
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+  return Supervisor(
+    args.target,
+    args.processes,
+    host=args.host,
+    port=args.port,
+    app_dir=args.app_dir,
+    ready_timeout=args.ready_timeout,
+    stop_timeout=args.stop_timeout,
+    stop_first=args.stop_first,
+    log_level=args.log_level,
+    metrics_port=args.metrics_port,
+  ).run()
+
+
+if __name__ == '__main__':
+  sys.exit(main())
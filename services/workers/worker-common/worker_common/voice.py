@@ -0,0 +1,256 @@
+"""Brand-voice models: hashed n-gram TF-IDF features and a compact on-disk model.
+
+voice-train-worker fits a model from a brand's example posts; generate-worker
+loads it by `voice_model_id` and scores variants against it (install with the
+`voice` extra).
+
+Text is turned into hashed features (word unigrams and bigrams, hashtags,
+mentions and punctuation/emoji tokens, character trigrams), weighted by
+log-scaled term frequency × IDF and L2-normalized. The model keeps:
+
+- `idf.npy`: IDF per hashed feature (float32, `dim`)
+- `centroid.npy`: mean example vector (float32, `dim`)
+- `components.npy`: top principal components of the examples, one column per
+  component (float32, `dim × k`), and `variances.npy` their variances
+- `meta.json`: feature settings, distance calibration, constraint statistics
+
+The arrays are memory-mapped on load, so loading is a few file opens and
+scoring only touches the rows of the features a text actually has.
+
+A text's distance to the voice is the larger of its mean squared z-score
+along the components and its residual outside them (off-voice text lands
+near the centroid within the subspace but far from it), both scaled so the
+training examples average 1; `style` is 1 up to the examples' median
+distance and halves every (p95 - p50) beyond it.
+"""
+import json
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+
+FORMAT = 1
+DEFAULT_DIM = 1 << 15
+
+_TOKEN = re.compile(r"[#@]?\w+|[^\w\s]")
+_SENTENCE = re.compile(r"[^.!?\n]+[.!?]*")
+_URL = re.compile(r"https?://\S+")
+_EMOJI = re.compile("[\U0001F300-\U0001FAFF\u2600-\u27BF\u2B50\u2B55]")
+
+# Per-post statistics kept as constraint summaries.
+STATS = (
+  'chars', 'words', 'sentence_chars', 'hashtags', 'mentions', 'urls',
+  'emoji_rate', 'exclamation_rate', 'question_rate', 'uppercase_ratio',
+)
+
+
+def features(text: str) -> list[str]:
+  lowered = _URL.sub(' <url> ', text.lower())
+  tokens = _TOKEN.findall(lowered)
+  feats = [f"w:{t}" for t in tokens]
+  feats += [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+  padded = f" {' '.join(lowered.split())} "
+  feats += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+  return feats
+
+
+def hashed_counts(text: str, dim: int) -> tuple[np.ndarray, np.ndarray]:
+  """Sorted feature indices of `text` and their counts."""
+  counts = Counter(zlib.crc32(f.encode()) % dim for f in features(text))
+  indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+  values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+  order = np.argsort(indices)
+  return indices[order], values[order]
+
+
+def count_matrix(texts: list[str], dim: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Term counts of `texts` as CSR arrays (indptr, indices, counts)."""
+  rows = [hashed_counts(text, dim) for text in texts]
+  indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+  np.cumsum([len(indices) for indices, _ in rows], out=indptr[1:])
+  if not rows:
+    return indptr, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+  return indptr, np.concatenate([r[0] for r in rows]), np.concatenate([r[1] for r in rows])
+
+
+def tfidf(indptr: np.ndarray, indices: np.ndarray, counts: np.ndarray, idf: np.ndarray) -> np.ndarray:
+  """Row-normalized log-TF × IDF values for CSR counts."""
+  values = np.log1p(counts) * idf[indices]
+  rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+  norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(indptr) - 1))
+  return (values / np.maximum(norms, 1e-12)[rows]).astype(np.float32)
+
+
+def text_stats(text: str) -> dict[str, float]:
+  words = _TOKEN.findall(_URL.sub(' ', text))
+  words = [w for w in words if w[0].isalnum() or w[0] in '#@_']
+  sentences = [s.strip() for s in _SENTENCE.findall(text) if s.strip()]
+  letters = [c for c in text if c.isalpha()]
+  n_words = max(len(words), 1)
+  return {
+    'chars': float(len(text)),
+    'words': float(len(words)),
+    'sentence_chars': float(np.mean([len(s) for s in sentences])) if sentences else 0.0,
+    'hashtags': float(sum(w.startswith('#') for w in words)),
+    'mentions': float(sum(w.startswith('@') for w in words)),
+    'urls': float(len(_URL.findall(text))),
+    'emoji_rate': len(_EMOJI.findall(text)) / n_words,
+    'exclamation_rate': text.count('!') / max(len(sentences), 1),
+    'question_rate': text.count('?') / max(len(sentences), 1),
+    'uppercase_ratio': sum(c.isupper() for c in letters) / max(len(letters), 1),
+  }
+
+
+def summarize_stats(rows: list[dict[str, float]]) -> dict[str, dict[str, float]]:
+  out = {}
+  for name in STATS:
+    values = np.asarray([row[name] for row in rows], dtype=np.float64)
+    p10, p50, p90 = np.percentile(values, [10, 50, 90]) if len(values) else (0.0, 0.0, 0.0)
+    out[name] = {
+      'mean': round(float(values.mean()), 4) if len(values) else 0.0,
+      'std': round(float(values.std()), 4) if len(values) else 0.0,
+      'p10': round(float(p10), 4),
+      'p50': round(float(p50), 4),
+      'p90': round(float(p90), 4),
+    }
+  return out
+
+
+def _within(value: float, lo: float, hi: float, scale: float) -> float:
+  """1 inside [lo, hi], halving every `scale` outside it."""
+  excess = lo - value if value < lo else value - hi if value > hi else 0.0
+  return float(2.0 ** (-excess / max(scale, 1e-9)))
+
+
+@dataclass
+class VoiceModel:
+  model_id: str
+  idf: np.ndarray
+  centroid: np.ndarray
+  components: np.ndarray  # dim × k
+  variances: np.ndarray
+  meta: dict
+
+  @property
+  def dim(self) -> int:
+    return int(self.meta['dim'])
+
+  def __post_init__(self):
+    self._centroid_sq = float(self.meta['centroid_norm_sq'])
+    self._centroid_proj = np.asarray(self.meta['centroid_projection'], dtype=np.float64)
+    self._variances = np.maximum(np.asarray(self.variances, dtype=np.float64), 1e-9)
+
+  def distance(self, text: str) -> float:
+    """Distance to the voice in units of the examples' average (1 = a typical example)."""
+    indices, counts = hashed_counts(text, self.dim)
+    if not len(indices):
+      return float('inf')
+    values = np.log1p(counts) * self.idf[indices]
+    values /= max(float(np.linalg.norm(values)), 1e-12)
+    dist_sq = max(1.0 - 2.0 * float(values @ self.centroid[indices]) + self._centroid_sq, 0.0)
+    calibration = self.meta['calibration']
+    residual = dist_sq
+    subspace = 0.0
+    if len(self._variances):
+      proj = values @ self.components[indices] - self._centroid_proj
+      residual = max(dist_sq - float(proj @ proj), 0.0)
+      subspace = float(np.mean(proj * proj / self._variances))
+    return max(subspace, residual / calibration['residual'])
+
+  def style(self, text: str) -> float:
+    calibration = self.meta['calibration']
+    excess = max(0.0, self.distance(text) - calibration['p50'])
+    return float(2.0 ** (-excess / max(calibration['p95'] - calibration['p50'], 0.25)))
+
+  def constraint_fit(self, text: str) -> float:
+    """How well `text` matches the examples' length/emoji/hashtag habits and explicit constraints."""
+    stats = self.meta['stats']
+    constraints = self.meta.get('constraints') or {}
+    got = text_stats(text)
+    checks = []
+    for name in ('chars', 'hashtags', 'emoji_rate'):
+      s = stats[name]
+      checks.append(_within(got[name], s['p10'], s['p90'], max(s['std'], s['p50'] * 0.25, 1.0 if name == 'hashtags' else 0.05)))
+    sentence = constraints.get('sentenceLength') or {}
+    lo = sentence.get('min', stats['sentence_chars']['p10'])
+    hi = sentence.get('max', stats['sentence_chars']['p90'])
+    checks.append(_within(got['sentence_chars'], lo, hi, max(hi - lo, 10) / 2))
+    if constraints.get('emojiThreshold') is not None:
+      checks.append(_within(got['emoji_rate'], 0.0, float(constraints['emojiThreshold']), 0.05))
+    return float(np.mean(checks))
+
+  def score(self, text: str) -> dict[str, float]:
+    style = self.style(text)
+    constraints = self.constraint_fit(text)
+    return {'style': round(style, 4), 'constraints': round(constraints, 4), 'brandFit': round(0.7 * style + 0.3 * constraints, 4)}
+
+
+def save_model(root: str | Path, model_id: str, arrays: dict[str, np.ndarray], meta: dict) -> Path:
+  """Write a model directory atomically; an existing model with the same ID is kept."""
+  root = Path(root)
+  target = root / model_id
+  if (target / 'meta.json').exists():
+    return target
+  tmp = root / f".{model_id}.{os.getpid()}.tmp"
+  tmp.mkdir(parents=True, exist_ok=True)
+  for name in ('idf', 'centroid', 'components', 'variances'):
+    np.save(tmp / f"{name}.npy", np.ascontiguousarray(arrays[name], dtype=np.float32))
+  with open(tmp / 'meta.json', 'w', encoding='utf-8') as f:
+    json.dump({'format': FORMAT, **meta}, f)
+  try:
+    os.replace(tmp, target)
+  except OSError:
+    # Another process saved the same model first.
+    for path in tmp.iterdir():
+      path.unlink()
+    tmp.rmdir()
+  return target
+
+
+def load_model(path: str | Path) -> VoiceModel:
+  path = Path(path)
+  with open(path / 'meta.json', encoding='utf-8') as f:
+    meta = json.load(f)
+  if meta.get('format') != FORMAT:
+    raise ValueError(f"unsupported voice model format {meta.get('format')!r} in {path}")
+  arrays = {name: np.load(path / f"{name}.npy", mmap_mode='r') for name in ('idf', 'centroid', 'components', 'variances')}
+  return VoiceModel(model_id=path.name, meta=meta, **arrays)
+
+
+class VoiceModels:
+  """Models under `root` by ID, with the most recently used kept open."""
+
+  def __init__(self, root: str | Path, cache_size: int = 256):
+    self.root = Path(root)
+    self.cache_size = cache_size
+    self._models: OrderedDict[str, VoiceModel] = OrderedDict()
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_env(cls) -> 'VoiceModels':
+    return cls(os.getenv('VOICE_MODEL_DIR', 'voice-models'), cache_size=int(os.getenv('VOICE_MODEL_CACHE', '256')))
+
+  def get(self, model_id: str | None) -> VoiceModel | None:
+    """The model, or None when `model_id` is unset or unknown."""
+    if not model_id or '/' in model_id or model_id.startswith('.'):
+      return None
+    with self._lock:
+      model = self._models.get(model_id)
+      if model is not None:
+        self._models.move_to_end(model_id)
+        return model
+    path = self.root / model_id
+    if not (path / 'meta.json').exists():
+      return None
+    model = load_model(path)
+    with self._lock:
+      self._models[model_id] = model
+      while len(self._models) > self.cache_size:
+        self._models.popitem(last=False)
+    return model